@@ -0,0 +1,114 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+
+def get_token_auth_settings():
+    options = {
+        'LIFETIME_DAYS': 7,
+        'CACHE_TTL': 60,
+        'CACHE_SIZE': 1024,
+    }
+    options.update(getattr(settings, 'TOKEN_AUTH', {}))
+    return options
+
+
+def token_expiry(token):
+    return token.created + timedelta(get_token_auth_settings()['LIFETIME_DAYS'])
+
+
+class TokenCache(object):
+    """ Per-process LRU of tokens with their users, so authenticated requests
+    don't query for them.
+
+    Saving or deleting a token or user drops its entries here; other
+    processes see the change once their entries expire after `timeout`
+    seconds.
+    """
+
+    def __init__(self, max_entries=1024, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, token = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        # Views may change the user they're given, so each gets its own copy
+        return copy.deepcopy(token)
+
+    def set(self, token):
+        with self.lock:
+            self.entries[token.key] = (time.monotonic() + self.timeout, copy.deepcopy(token))
+            self.entries.move_to_end(token.key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def forget_token(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def forget_user(self, user_id):
+        with self.lock:
+            for key in [key for key, (expires, token) in self.entries.items() if token.user_id == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_auth_settings = get_token_auth_settings()
+token_cache = TokenCache(_auth_settings['CACHE_SIZE'], _auth_settings['CACHE_TTL'])
+
+
+def get_valid_token(key):
+    """ The token with this key and its user, from the cache when possible.
+    Raises AuthenticationFailed if it doesn't exist, has expired or its user is inactive.
+    """
+    token = token_cache.get(key)
+    if token is None:
+        try:
+            token = Token.objects.select_related('user').get(key=key)
+        except Token.DoesNotExist:
+            raise AuthenticationFailed('Invalid token.')
+        token_cache.set(token)
+
+    if not token.user.is_active:
+        raise AuthenticationFailed('User inactive or deleted.')
+    if token_expiry(token) < timezone.now():
+        raise AuthenticationFailed('Token has expired.')
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ DRF token authentication through the token cache, refusing expired tokens """
+
+    def authenticate_credentials(self, key):
+        token = get_valid_token(key)
+        return (token.user, token)
+
+
+def forget_token_on_change(sender, instance, **kwargs):
+    token_cache.forget_token(instance.key)
+
+
+def forget_user_on_change(sender, instance, **kwargs):
+    # Password or active status may have changed
+    token_cache.forget_user(instance.pk)
@@ -0,0 +1,144 @@
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import AutoField
+
+from .logger import logger
+from .outbox import enqueue, model_type_for
+from .response_cache import bump_generation
+from .rollups import month_start, refresh_rollups, source_for_model
+
+# The instances `bulk_upsert` inserted, updated and could not write
+UpsertResult = namedtuple('UpsertResult', ['created', 'updated', 'failed'])
+
+
+def bulk_insert(model, instances, batch_size=500):
+    """ `bulk_create` that leaves primary keys set on the instances.
+
+    Only Postgres returns the keys of bulk inserted rows, so other databases
+    save the rows one by one, which is only meant for tests and local setups.
+    """
+    if connection.features.can_return_ids_from_bulk_insert:
+        return model.objects.bulk_create(instances, batch_size=batch_size)
+    for instance in instances:
+        instance.save(force_insert=True)
+    return instances
+
+
+def bulk_upsert(model, instances, unique_field, update_fields, batch_size=500):
+    """ Insert instances, or update the stored records with the same
+    `unique_field` value, and set their primary keys.
+
+    Postgres writes each batch with one `INSERT ... ON CONFLICT DO UPDATE`,
+    which sets only `update_fields` (and `auto_now` fields) on existing
+    records. If a batch fails, its rows are retried one by one, each in its
+    own savepoint, so a bad row doesn't fail the others. Other databases
+    save every row that way.
+    """
+    result = UpsertResult([], [], [])
+    fields = [f for f in model._meta.concrete_fields if not isinstance(f, AutoField)]
+    updated_fields = [f for f in fields if f.name in update_fields or getattr(f, 'auto_now', False)]
+    unique = model._meta.get_field(unique_field)
+
+    if connection.vendor == 'postgresql':
+        def write(rows):
+            return upsert_rows(model, rows, fields, unique, updated_fields)
+    else:
+        def write(rows):
+            return [save_row(model, row, unique, updated_fields) for row in rows]
+
+    for start in range(0, len(instances), batch_size):
+        batch = instances[start:start + batch_size]
+        if connection.vendor == 'postgresql':
+            try:
+                with transaction.atomic():
+                    created = write(batch)
+                for instance, was_created in zip(batch, created):
+                    (result.created if was_created else result.updated).append(instance)
+                continue
+            except Exception as e:
+                logger.warning('Could not upsert %s %s records at once, writing them one by one: %s' % (
+                    len(batch), model._meta.label, str(e)[:100]))
+        for instance in batch:
+            try:
+                with transaction.atomic():
+                    was_created, = write([instance])
+            except Exception as e:
+                logger.error('Could not write %s %s: %s' % (
+                    model._meta.label, getattr(instance, unique.attname), str(e)[:100]))
+                result.failed.append(instance)
+                continue
+            (result.created if was_created else result.updated).append(instance)
+    return result
+
+
+def upsert_rows(model, instances, fields, unique, updated_fields):
+    """ Upsert rows with one statement; returns whether each was inserted """
+    qn = connection.ops.quote_name
+    params = []
+    for instance in instances:
+        params.extend(f.get_db_prep_save(f.pre_save(instance, True), connection) for f in fields)
+    row = '(%s)' % ', '.join(['%s'] * len(fields))
+    sql = 'INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) DO UPDATE SET %s RETURNING %s, %s, (xmax = 0)' % (
+        qn(model._meta.db_table),
+        ', '.join(qn(f.column) for f in fields),
+        ', '.join([row] * len(instances)),
+        qn(unique.column),
+        ', '.join('%s = EXCLUDED.%s' % (qn(f.column), qn(f.column)) for f in updated_fields),
+        qn(model._meta.pk.column),
+        qn(unique.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        returned = {key: (pk, inserted) for pk, key, inserted in cursor.fetchall()}
+
+    created = []
+    for instance in instances:
+        # Map rows back by their unique value, which holds whatever order they come back in
+        pk, inserted = returned[unique.get_db_prep_value(getattr(instance, unique.attname), connection)]
+        instance.pk = pk
+        instance._state.adding = False
+        instance._state.db = connection.alias
+        created.append(inserted)
+    return created
+
+
+def save_row(model, instance, unique, updated_fields):
+    """ Upsert a row with the ORM; returns whether it was inserted """
+    pk = model.objects.filter(**{unique.attname: getattr(instance, unique.attname)}) \
+                      .values_list('pk', flat=True).first()
+    if pk is None:
+        instance.save(force_insert=True)
+        return True
+    instance.pk = pk
+    instance._state.adding = False
+    instance.save(update_fields=[f.name for f in updated_fields])
+    return False
+
+
+def rollup_keys(model, **filters):
+    """ Rollup keys of the stored records matching `filters`, taken before
+    they're updated in bulk, so the rollups they move out of are refreshed too.
+    """
+    source = source_for_model(model)
+    if source is None:
+        return []
+    rows = model.objects.filter(**filters).values(source.date_field, 'dtype')
+    return [source.key(month_start(row[source.date_field]), row['dtype']) for row in rows]
+
+
+def record_bulk_changes(model, instances, previous_rollup_keys=()):
+    """ What the save signals do, for records written in bulk: refresh their
+    rollups, invalidate cached responses and queue them for reindexing.
+    Call it once the records' relations are written too. Records that were
+    updated need their `rollup_keys` from before the update passed in.
+    """
+    if not len(instances):
+        return
+    source = source_for_model(model)
+    if source is not None:
+        refresh_rollups([source.instance_key(instance) for instance in instances] + list(previous_rollup_keys))
+    bump_generation(model._meta.label)
+    model_type = model_type_for(model)
+    if model_type is not None:
+        enqueue(model_type, [instance.pk for instance in instances])
@@ -0,0 +1,82 @@
+import calendar
+from hashlib import md5
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .response_cache import get_backend as get_response_cache
+
+
+class ConditionalGetMixin(object):
+    """ Answer conditional GETs with 304 Not Modified before serializing anything.
+
+    Lists are validated by the newest `modified_field` and the row count of the
+    filtered queryset, details by the object's own `modified_field`.
+    Serializers that nest other records can't see their edits in those
+    timestamps, so models they render should be listed in
+    `conditional_dependencies`; their response cache generations, bumped on
+    every save, go into the ETag too. Details that depend on other models
+    get no Last-Modified, which couldn't reflect their edits.
+    """
+
+    modified_field = None
+    conditional_dependencies = ()
+
+    def list(self, request, *args, **kwargs):
+        validators = self.get_list_validators(request)
+        return self.conditional_response(validators, super(ConditionalGetMixin, self).list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_detail_validators(request, kwargs)
+        return self.conditional_response(validators, super(ConditionalGetMixin, self).retrieve, request, *args, **kwargs)
+
+    def get_list_validators(self, request):
+        """ ETag for the current page; no Last-Modified, since deletes don't move the newest timestamp """
+        if self.modified_field is None:
+            return None, None
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        summary = queryset.aggregate(modified=Max(self.modified_field), count=Count('pk'))
+        modified = summary['modified'].isoformat() if summary['modified'] is not None else ''
+        return self.make_etag(request, modified, summary['count']), None
+
+    def get_detail_validators(self, request, kwargs):
+        if self.modified_field is None:
+            return None, None
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        modified = self.filter_queryset(self.get_queryset()) \
+                       .filter(**{self.lookup_field: kwargs[lookup_url_kwarg]}) \
+                       .values_list(self.modified_field, flat=True) \
+                       .first()
+        if modified is None:
+            # Missing objects fall through to the usual 404
+            return None, None
+        etag = self.make_etag(request, modified.isoformat())
+        model_label = self.get_queryset().model._meta.label
+        if any(label != model_label for label in self.conditional_dependencies):
+            return etag, None
+        return etag, calendar.timegm(modified.utctimetuple())
+
+    def make_etag(self, request, *parts):
+        user = request.user
+        parts = [str(part) for part in parts] + [
+            request.get_full_path(),
+            request.accepted_renderer.format,
+            str(user.pk) if user.is_authenticated else '',
+        ]
+        parts += get_response_cache().get_generations(list(self.conditional_dependencies))
+        return md5('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def conditional_response(self, validators, handler, request, *args, **kwargs):
+        etag, last_modified = validators
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        response = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = quote_etag(etag)
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
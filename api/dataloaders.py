@@ -0,0 +1,151 @@
+from collections import defaultdict
+
+from django.db.models import F, ForeignKey, ManyToManyField, ManyToManyRel, ManyToOneRel, OneToOneRel
+from graphene.utils.str_converters import to_camel_case
+from graphql.language import ast
+from promise import Promise
+from promise.dataloader import DataLoader
+
+
+class ModelLoader(DataLoader):
+    """ Batch loads records of a model by primary key """
+
+    def __init__(self, model):
+        super(ModelLoader, self).__init__()
+        self.model = model
+
+    def batch_load_fn(self, keys):
+        records = self.model.objects.in_bulk(keys)
+        return Promise.resolve([records.get(key) for key in keys])
+
+
+class RelatedLoader(DataLoader):
+    """ Batch loads the records held by a many-to-many or reverse foreign key, keyed by parent id """
+
+    def __init__(self, field):
+        super(RelatedLoader, self).__init__()
+        self.field = field
+        # The lookup from the related model back to the parent
+        if isinstance(field, ManyToManyField):
+            self.lookup = field.related_query_name()
+        else:
+            self.lookup = field.field.name
+
+    def batch_load_fn(self, keys):
+        records = self.field.related_model.objects \
+                            .filter(**{'%s__in' % self.lookup: keys}) \
+                            .annotate(loader_key=F(self.lookup))
+        groups = defaultdict(list)
+        for record in records:
+            groups[record.loader_key].append(record)
+        return Promise.resolve([groups[key] for key in keys])
+
+
+class Loaders(object):
+    """ The DataLoaders of one request, so batches and caches never span requests """
+
+    def __init__(self):
+        self.loaders = {}
+
+    def for_model(self, model):
+        key = ('model', model._meta.label)
+        if key not in self.loaders:
+            self.loaders[key] = ModelLoader(model)
+        return self.loaders[key]
+
+    def for_relation(self, field):
+        key = ('relation', field.model._meta.label, field.name)
+        if key not in self.loaders:
+            self.loaders[key] = RelatedLoader(field)
+        return self.loaders[key]
+
+
+def get_loaders(context):
+    loaders = getattr(context, 'dataloaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        context.dataloaders = loaders
+    return loaders
+
+
+def foreign_key_resolver(field):
+    def resolve(root, info, **kwargs):
+        pk = getattr(root, field.attname)
+        if pk is None:
+            return None
+        return get_loaders(info.context).for_model(field.related_model).load(pk)
+    return resolve
+
+
+def related_resolver(field):
+    def resolve(root, info, **kwargs):
+        return get_loaders(info.context).for_relation(field).load(root.pk)
+    return resolve
+
+
+def batched_resolvers(model, names):
+    """ DataLoader resolvers for the relations of `model` exposed under `names` """
+    resolvers = {}
+    for field in model._meta.get_fields():
+        if isinstance(field, OneToOneRel):
+            continue
+        if isinstance(field, (ManyToOneRel, ManyToManyRel)):
+            name = field.get_accessor_name()
+            resolver = related_resolver(field)
+        elif isinstance(field, ManyToManyField):
+            name = field.name
+            resolver = related_resolver(field)
+        elif isinstance(field, ForeignKey) and field.target_field.primary_key:
+            name = field.name
+            resolver = foreign_key_resolver(field)
+        else:
+            continue
+        if name in names:
+            resolvers[name] = resolver
+    return resolvers
+
+
+def selected_fields(info):
+    """ Names of the fields selected below the current field, following fragments """
+    names = set()
+
+    def collect(selection_set):
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                names.add(selection.name.value)
+            elif isinstance(selection, ast.FragmentSpread):
+                collect(info.fragments[selection.name.value].selection_set)
+            elif isinstance(selection, ast.InlineFragment):
+                collect(selection.selection_set)
+
+    for field_ast in info.field_asts:
+        if field_ast.selection_set is not None:
+            collect(field_ast.selection_set)
+    return names
+
+
+def only_selected(queryset, info):
+    """ Defer the columns a query doesn't select.
+
+    Foreign keys stay loaded as ids for the loaders. If anything selected
+    isn't a model field, like a custom resolver, the queryset is left alone.
+    """
+    model = queryset.model
+    fields = {}
+    for field in model._meta.concrete_fields:
+        fields[field.name] = field
+        fields[to_camel_case(field.name)] = field
+    # Relations are loaded by the loaders from the primary key
+    relations = set()
+    for name in [rel.get_accessor_name() for rel in model._meta.related_objects] + \
+                [field.name for field in model._meta.many_to_many]:
+        relations.update((name, to_camel_case(name)))
+
+    columns = set()
+    for name in selected_fields(info):
+        if name == '__typename' or name in relations:
+            continue
+        if name not in fields:
+            return queryset
+        columns.add(fields[name].name)
+    return queryset.only(*columns) if len(columns) else queryset.only('pk')
@@ -1,10 +1,14 @@
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import viewsets
 from django_filters import rest_framework as filters
 from django.contrib.auth.models import User
+from .authentication import CachedTokenAuthentication
 from .view_filters import ListFilter
+from .conditional import ConditionalGetMixin
+from .eager_loading import EagerLoadingMixin, EagerLoadPlan, PrefetchColumns
+from .exports import StreamingExportMixin
+from main.profiling import SerializerTimingMixin
 from .models import (
     DisasterType,
 
@@ -35,6 +39,7 @@ from .serializers import (
     RegionRelationSerializer,
 
     CountrySerializer,
+    MiniCountrySerializer,
     CountryKeyFigureSerializer,
     CountrySnippetSerializer,
     CountryRelationSerializer,
@@ -42,6 +47,8 @@ from .serializers import (
     DistrictSerializer,
     MiniDistrictSerializer,
 
+    RelatedAppealSerializer,
+    MiniFieldReportSerializer,
     ListEventSerializer,
     DetailEventSerializer,
     SituationReportSerializer,
@@ -53,19 +60,25 @@ from .serializers import (
     DetailFieldReportSerializer,
 )
 
-class DisasterTypeViewset(viewsets.ReadOnlyModelViewSet):
+class DisasterTypeViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = DisasterType.objects.all()
     serializer_class = DisasterTypeSerializer
 
-class RegionViewset(viewsets.ReadOnlyModelViewSet):
+class RegionViewset(SerializerTimingMixin, EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Region.objects.all()
+    eager_load_plans = {
+        'retrieve': EagerLoadPlan(prefetch_related=('links', 'contacts',)),
+    }
     def get_serializer_class(self):
         if self.action == 'list':
             return RegionSerializer
         return RegionRelationSerializer
 
-class CountryViewset(viewsets.ReadOnlyModelViewSet):
+class CountryViewset(SerializerTimingMixin, EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Country.objects.all()
+    eager_load_plans = {
+        'retrieve': EagerLoadPlan(prefetch_related=('links', 'contacts',)),
+    }
     def get_serializer_class(self):
         if self.action == 'list':
             return CountrySerializer
@@ -77,8 +90,8 @@ class RegionKeyFigureFilter(filters.FilterSet):
         model = RegionKeyFigure
         fields = ('region',)
 
-class RegionKeyFigureViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class RegionKeyFigureViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     serializer_class = RegionKeyFigureSerializer
     filter_class = RegionKeyFigureFilter
     def get_queryset(self):
@@ -92,8 +105,8 @@ class CountryKeyFigureFilter(filters.FilterSet):
         model = CountryKeyFigure
         fields = ('country',)
 
-class CountryKeyFigureViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class CountryKeyFigureViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     serializer_class = CountryKeyFigureSerializer
     filter_class = CountryKeyFigureFilter
     def get_queryset(self):
@@ -107,8 +120,8 @@ class RegionSnippetFilter(filters.FilterSet):
         model = RegionSnippet
         fields = ('region',)
 
-class RegionSnippetViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class RegionSnippetViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     serializer_class = RegionSnippetSerializer
     filter_class = RegionSnippetFilter
     def get_queryset(self):
@@ -122,8 +135,8 @@ class CountrySnippetFilter(filters.FilterSet):
         model = CountrySnippet
         fields = ('country',)
 
-class CountrySnippetViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class CountrySnippetViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     serializer_class = CountrySnippetSerializer
     filter_class = CountrySnippetFilter
     def get_queryset(self):
@@ -131,8 +144,11 @@ class CountrySnippetViewset(viewsets.ReadOnlyModelViewSet):
             return CountrySnippet.objects.all()
         return CountrySnippet.objects.filter(visibility=3)
 
-class DistrictViewset(viewsets.ReadOnlyModelViewSet):
+class DistrictViewset(SerializerTimingMixin, EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = District.objects.all()
+    eager_load_plans = {
+        'retrieve': EagerLoadPlan(select_related=('country',)),
+    }
     def get_serializer_class(self):
         if self.action == 'list':
             return MiniDistrictSerializer
@@ -151,14 +167,32 @@ class EventFilter(filters.FilterSet):
             'created_at': ('exact', 'gt', 'gte', 'lt', 'lte'),
         }
 
-class EventViewset(viewsets.ReadOnlyModelViewSet):
+class EventViewset(SerializerTimingMixin, ConditionalGetMixin, StreamingExportMixin, EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Event.objects.all()
+    eager_load_plans = {
+        'list': EagerLoadPlan(prefetch_related=(
+            PrefetchColumns('appeals', RelatedAppealSerializer, 'event'),
+            PrefetchColumns('countries', MiniCountrySerializer),
+            PrefetchColumns('field_reports', MiniFieldReportSerializer, 'event'),
+        )),
+        'retrieve': EagerLoadPlan(prefetch_related=(
+            PrefetchColumns('appeals', RelatedAppealSerializer, 'event'),
+            PrefetchColumns('countries', MiniCountrySerializer),
+            PrefetchColumns('field_reports', MiniFieldReportSerializer, 'event'),
+            'contacts',
+            'key_figures',
+            'snippets',
+        )),
+    }
     def get_serializer_class(self):
         if self.action == 'list':
             return ListEventSerializer
         else:
             return DetailEventSerializer
     ordering_fields = ('disaster_start_date', 'created_at', 'name', 'summary', 'num_affected', 'glide', 'alert_level',)
+    cursor_ordering = '-disaster_start_date'
+    modified_field = 'updated_at'
+    conditional_dependencies = ('api.Event', 'api.Appeal', 'api.FieldReport',)
     filter_class = EventFilter
 
 class SituationReportFilter(filters.FilterSet):
@@ -170,7 +204,7 @@ class SituationReportFilter(filters.FilterSet):
             'created_at': ('exact', 'gt', 'gte', 'lt', 'lte'),
         }
 
-class SituationReportViewset(viewsets.ReadOnlyModelViewSet):
+class SituationReportViewset(SerializerTimingMixin, StreamingExportMixin, viewsets.ReadOnlyModelViewSet):
     queryset = SituationReport.objects.all()
     serializer_class = SituationReportSerializer
     ordering_fields = ('created_at', 'name',)
@@ -189,10 +223,16 @@ class AppealFilter(filters.FilterSet):
             'end_date': ('exact', 'gt', 'gte', 'lt', 'lte'),
         }
 
-class AppealViewset(viewsets.ReadOnlyModelViewSet):
+class AppealViewset(SerializerTimingMixin, ConditionalGetMixin, StreamingExportMixin, EagerLoadingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Appeal.objects.all()
+    eager_load_plans = {
+        'default': EagerLoadPlan(select_related=('country',)),
+    }
     serializer_class = AppealSerializer
     ordering_fields = ('start_date', 'end_date', 'name', 'aid', 'dtype', 'num_beneficiaries', 'amount_requested', 'amount_funded', 'status', 'atype', 'event',)
+    cursor_ordering = '-start_date'
+    modified_field = 'modified_at'
+    conditional_dependencies = ('api.Appeal',)
     filter_class = AppealFilter
 
     def remove_unconfirmed_event(self, obj):
@@ -203,8 +243,21 @@ class AppealViewset(viewsets.ReadOnlyModelViewSet):
     def remove_unconfirmed_events(self, objs):
         return [self.remove_unconfirmed_event(obj) for obj in objs]
 
-    # Overwrite retrieve, list to exclude the event if it requires confirmation
+    def export_row(self, data):
+        return self.remove_unconfirmed_event(data)
+
     def list(self, request, *args, **kwargs):
+        validators = self.get_list_validators(request)
+        return self.conditional_response(validators, self.list_appeals, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_detail_validators(request, kwargs)
+        return self.conditional_response(validators, self.retrieve_appeal, request, *args, **kwargs)
+
+    # Overwrite retrieve, list to exclude the event if it requires confirmation
+    def list_appeals(self, request, *args, **kwargs):
+        if self.should_stream(request):
+            return self.stream_export(request)
         queryset = self.filter_queryset(self.get_queryset())
 
         page = self.paginate_queryset(queryset)
@@ -215,7 +268,7 @@ class AppealViewset(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(self.remove_unconfirmed_events(serializer.data))
 
-    def retrieve(self, request, *args, **kwargs):
+    def retrieve_appeal(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
         return Response(self.remove_unconfirmed_event(serializer.data))
@@ -230,22 +283,25 @@ class AppealDocumentFilter(filters.FilterSet):
             'created_at': ('exact', 'gt', 'gte', 'lt', 'lte'),
         }
 
-class AppealDocumentViewset(viewsets.ReadOnlyModelViewSet):
+class AppealDocumentViewset(SerializerTimingMixin, StreamingExportMixin, viewsets.ReadOnlyModelViewSet):
     queryset = AppealDocument.objects.all()
     serializer_class = AppealDocumentSerializer
     ordering_fields = ('created_at', 'name',)
     filter_class = AppealDocumentFilter
 
-class ProfileViewset(viewsets.ModelViewSet):
+class ProfileViewset(SerializerTimingMixin, viewsets.ModelViewSet):
     serializer_class = ProfileSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     def get_queryset(self):
         return Profile.objects.filter(user=self.request.user)
 
-class UserViewset(viewsets.ModelViewSet):
+class UserViewset(SerializerTimingMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     serializer_class = UserSerializer
-    authentication_classes = (TokenAuthentication,)
+    eager_load_plans = {
+        'default': EagerLoadPlan(select_related=('profile__country',), prefetch_related=('subscription',)),
+    }
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     def get_queryset(self):
         return User.objects.filter(pk=self.request.user.pk)
@@ -262,8 +318,18 @@ class FieldReportFilter(filters.FilterSet):
             'updated_at': ('exact', 'gt', 'gte', 'lt', 'lte'),
         }
 
-class FieldReportViewset(viewsets.ModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class FieldReportViewset(SerializerTimingMixin, ConditionalGetMixin, StreamingExportMixin, EagerLoadingMixin, viewsets.ModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
+    eager_load_plans = {
+        'list': EagerLoadPlan(
+            select_related=('event',),
+            prefetch_related=(PrefetchColumns('countries', MiniCountrySerializer),),
+        ),
+        'retrieve': EagerLoadPlan(
+            select_related=('user__profile__country', 'dtype', 'event',),
+            prefetch_related=('user__subscription', 'contacts', 'actions_taken__actions', 'sources__stype',),
+        ),
+    }
     def get_queryset(self):
         if self.request.user.is_authenticated:
             return FieldReport.objects.all()
@@ -277,4 +343,7 @@ class FieldReportViewset(viewsets.ModelViewSet):
             return DetailFieldReportSerializer
 
     ordering_fields = ('summary', 'event', 'dtype', 'created_at', 'updated_at')
+    cursor_ordering = '-created_at'
+    modified_field = 'updated_at'
+    conditional_dependencies = ('api.FieldReport', 'api.Event',)
     filter_class = FieldReportFilter
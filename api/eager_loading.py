@@ -0,0 +1,84 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.db.models.fields.related import ForeignObjectRel, ManyToManyField
+
+
+def serialized_columns(serializer_class, *extra):
+    """ Names of the concrete columns a serializer renders, plus any extras """
+    model = serializer_class.Meta.model
+    fields = serializer_class.Meta.fields
+    if fields == '__all__':
+        fields = [f.name for f in model._meta.concrete_fields]
+
+    columns = []
+    for name in list(fields) + list(extra):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Serializer-only fields, like method fields, don't map to a column
+            continue
+        if isinstance(field, (ForeignObjectRel, ManyToManyField)):
+            continue
+        if field.name not in columns:
+            columns.append(field.name)
+    return columns
+
+
+class PrefetchColumns(object):
+    """ Prefetch a relation, loading only the columns its serializer renders.
+
+    `extra` should name the foreign key back to the parent for reverse
+    relations, otherwise Django would fetch it again for every row.
+    """
+
+    def __init__(self, lookup, serializer_class, *extra):
+        self.lookup = lookup
+        self.serializer_class = serializer_class
+        self.extra = extra
+
+    def to_prefetch(self):
+        model = self.serializer_class.Meta.model
+        columns = serialized_columns(self.serializer_class, *self.extra)
+        return Prefetch(self.lookup, queryset=model.objects.only(*columns))
+
+
+class EagerLoadPlan(object):
+    """ The joins and prefetches a serializer needs to render without N+1 queries """
+
+    def __init__(self, select_related=(), prefetch_related=()):
+        self.select_related = select_related
+        self.prefetch_related = prefetch_related
+
+    def apply(self, queryset):
+        if len(self.select_related):
+            queryset = queryset.select_related(*self.select_related)
+        if len(self.prefetch_related):
+            # Build Prefetch objects per request, so no queryset state is
+            # shared between requests through the class attribute.
+            lookups = [p.to_prefetch() if isinstance(p, PrefetchColumns) else p
+                       for p in self.prefetch_related]
+            queryset = queryset.prefetch_related(*lookups)
+        return queryset
+
+
+class EagerLoadingMixin(object):
+    """ Apply the viewset's eager-load plan for the current action.
+
+    `eager_load_plans` maps a viewset action (`list`, `retrieve`, ...) to an
+    `EagerLoadPlan`. A `default` entry covers any action not listed.
+    The plan is applied in `filter_queryset`, which both `list` and
+    `get_object` go through, so viewsets remain free to override `get_queryset`.
+    """
+
+    eager_load_plans = {}
+
+    def get_eager_load_plan(self):
+        action = getattr(self, 'action', None)
+        return self.eager_load_plans.get(action, self.eager_load_plans.get('default'))
+
+    def filter_queryset(self, queryset):
+        queryset = super(EagerLoadingMixin, self).filter_queryset(queryset)
+        plan = self.get_eager_load_plan()
+        if plan is not None:
+            queryset = plan.apply(queryset)
+        return queryset
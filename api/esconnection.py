@@ -1,9 +1,116 @@
 import os
+import threading
+import time
+from django.conf import settings
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionError, TransportError
+
+from main import metrics
+
+
+def get_es_settings():
+    options = {
+        'TIMEOUT': 5,
+        'BULK_TIMEOUT': 120,
+        'MAX_RETRIES': 2,
+        'RETRY_ON_TIMEOUT': True,
+        'POOL_SIZE': 4,
+        'SNIFF': False,
+        'BREAKER_FAILURES': 5,
+        'BREAKER_RESET': 30,
+    }
+    options.update(getattr(settings, 'ELASTICSEARCH', {}))
+    return options
+
+
+def create_client(host, **overrides):
+    """ A client with bounded timeouts, retries and connection pool.
+
+    The pool is per process, so POOL_SIZE is the connections each worker
+    keeps open to each node.
+    """
+    options = get_es_settings()
+    options.update(overrides)
+    kwargs = {
+        'timeout': options['TIMEOUT'],
+        'max_retries': options['MAX_RETRIES'],
+        'retry_on_timeout': options['RETRY_ON_TIMEOUT'],
+        'maxsize': options['POOL_SIZE'],
+    }
+    if options['SNIFF']:
+        kwargs.update(sniff_on_start=True, sniff_on_connection_fail=True, sniffer_timeout=60)
+    return Elasticsearch([host], **kwargs)
+
+
+class SearchUnavailable(Exception):
+    """ Elasticsearch is down, too slow, or the circuit breaker is open """
+    pass
+
+
+def is_outage(error):
+    # Bad requests are our fault and don't say anything about the cluster
+    status = getattr(error, 'status_code', None)
+    return isinstance(error, ConnectionError) or not isinstance(status, int) or status >= 500
+
+
+class CircuitBreaker(object):
+    """ Fail fast while elasticsearch is unhealthy, instead of tying up workers.
+
+    After `max_failures` outages in a row calls raise SearchUnavailable
+    straight away for `reset_after` seconds. Then a single trial call goes
+    through; any answer from the cluster closes the circuit again, even an
+    error for a bad request, and an outage reopens it.
+    """
+
+    def __init__(self, max_failures=5, reset_after=30):
+        self.max_failures = max_failures
+        self.reset_after = reset_after
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def is_open(self):
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_after
+
+    def call(self, fn, *args, **kwargs):
+        with self.lock:
+            if self.is_open():
+                metrics.inc('goapi_es_requests_total', outcome='rejected')
+                raise SearchUnavailable('Elasticsearch circuit breaker is open')
+            if self.opened_at is not None:
+                # Half open: hold the circuit open for everyone else during the trial
+                self.opened_at = time.monotonic()
+
+        try:
+            result = fn(*args, **kwargs)
+        except TransportError as e:
+            metrics.inc('goapi_es_requests_total', outcome='error')
+            if not is_outage(e):
+                # The cluster answered, so it's up; close the circuit if this was the trial
+                with self.lock:
+                    self.reset()
+                raise
+            with self.lock:
+                self.failures += 1
+                if self.opened_at is not None or self.failures >= self.max_failures:
+                    self.opened_at = time.monotonic()
+            raise SearchUnavailable(str(e)) from e
+
+        metrics.inc('goapi_es_requests_total', outcome='ok')
+        with self.lock:
+            self.reset()
+        return result
+
+
+_es_settings = get_es_settings()
+ES_BREAKER = CircuitBreaker(_es_settings['BREAKER_FAILURES'], _es_settings['BREAKER_RESET'])
 
 host = os.environ.get('ES_HOST')
 if host is not None:
-    ES_CLIENT = Elasticsearch([host])
+    ES_CLIENT = create_client(host)
 else:
     print('Warning: No elasticsearch host found, will not index elasticsearch')
     ES_CLIENT = None
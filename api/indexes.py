@@ -1,11 +1,48 @@
+# Names are also indexed as their prefixes, e.g. `flo`, `floo`, `flood`,
+# so the suggest endpoint can match what has been typed so far with a term lookup.
+GenericAnalysis = {
+    'filter': {
+        'autocomplete_filter': {
+            'type': 'edge_ngram',
+            'min_gram': 1,
+            'max_gram': 20,
+        },
+    },
+    'analyzer': {
+        'autocomplete': {
+            'type': 'custom',
+            'tokenizer': 'standard',
+            'filter': ['lowercase', 'asciifolding', 'autocomplete_filter'],
+        },
+        'autocomplete_search': {
+            'type': 'custom',
+            'tokenizer': 'standard',
+            'filter': ['lowercase', 'asciifolding'],
+        },
+    },
+}
+
 GenericMapping = {
     'properties': {
         'id': {'type': 'keyword'},
         'type': {'type': 'keyword'},
-        'name': {'type': 'text'},
+        'name': {
+            'type': 'text',
+            'fields': {
+                'suggest': {
+                    'type': 'text',
+                    'analyzer': 'autocomplete',
+                    'search_analyzer': 'autocomplete_search',
+                },
+            },
+        },
         'body': { 'type': 'text'},
         'date': {'type': 'date'},
     }
 }
 
 ES_PAGE_NAME = 'page_all'
+
+# `page_all` is an alias of the newest versioned index, e.g. `page_all_20180601120000`.
+# An index being built carries the marker alias until it takes over.
+ES_REINDEX_MARKER = 'reindexing_page_all'
@@ -1,17 +1,75 @@
+import atexit
 import logging
 import sys
 import os
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue, Full, Empty
 from azure_storage_logging.handlers import QueueStorageHandler
 
+from main import metrics
+
 formatter = logging.Formatter(fmt='%(asctime)s %(levelname)-8s %(message)s',
                               datefmt='%Y-%m-%d %H:%M:%S')
 
+
+class BoundedQueueHandler(QueueHandler):
+    """ Hand records to a listener thread, dropping them when its queue is full.
+
+    Logging never waits on the handlers behind the listener, however slow
+    they are. `dropped` counts the records that didn't fit.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            with self.dropped_lock:
+                self.dropped += 1
+            metrics.inc('goapi_log_records_dropped_total')
+
+
+class BatchingQueueListener(QueueListener):
+    """ Take records off the queue up to `batch_size` at a time, and flush
+    the handlers once per batch rather than once per record.
+    """
+
+    def __init__(self, queue, *handlers, batch_size=100):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self):
+        # Wait for room, so stopping with a full queue still stops the thread
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        while True:
+            batch = [self.dequeue(True)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.dequeue(False))
+                except Empty:
+                    break
+            for _ in batch:
+                self.queue.task_done()
+            stopping = self._sentinel in batch
+            for record in batch:
+                if record is not self._sentinel:
+                    self.handle(record)
+            for handler in self.handlers:
+                handler.flush()
+            if stopping:
+                return
+
+
 screen_handler = logging.StreamHandler(stream=sys.stdout)
 screen_handler.setFormatter(formatter)
-
-logger = logging.getLogger('api')
-logger.setLevel('DEBUG')
-logger.addHandler(screen_handler)
+handlers = [screen_handler]
 
 if (os.environ.get('AZURE_STORAGE_ACCOUNT') is not None and
         os.environ.get('AZURE_STORAGE_KEY') is not None):
@@ -20,4 +78,16 @@ if (os.environ.get('AZURE_STORAGE_ACCOUNT') is not None and
                                   queue='api',
                                   )
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    handlers.append(handler)
+
+# Handlers run on the listener's thread; the loggers only put records on the queue
+log_queue = Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+queue_handler = BoundedQueueHandler(log_queue)
+listener = BatchingQueueListener(log_queue, *handlers, batch_size=int(os.environ.get('LOG_BATCH_SIZE', 100)))
+listener.start()
+# Write out what is still queued when a command finishes
+atexit.register(listener.stop)
+
+logger = logging.getLogger('api')
+logger.setLevel('DEBUG')
+logger.addHandler(queue_handler)
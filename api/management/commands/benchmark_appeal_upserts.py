@@ -0,0 +1,52 @@
+import time
+from datetime import datetime, timezone
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Appeal
+from .ingest_appeals import UPDATED_FIELDS, write_appeals
+
+
+def synthetic_appeals(prefix, count, amount):
+    """ Appeals spread over a few years of start dates, with codes made from `prefix` """
+    return [Appeal(aid=str(i), name='Appeal %s' % i, code='%s%s' % (prefix, i), sector='Sector',
+                   amount_requested=amount, num_beneficiaries=i,
+                   start_date=datetime(2015 + i % 3, i % 12 + 1, 1, tzinfo=timezone.utc))
+            for i in range(count)]
+
+
+def write_rows(appeals):
+    """ How ingest_appeals used to write appeals, one or two queries each """
+    for appeal in appeals:
+        fields = {name: getattr(appeal, name) for name in UPDATED_FIELDS}
+        Appeal.objects.update_or_create(code=appeal.code, defaults=fields)
+
+
+class Command(BaseCommand):
+    help = 'Time creating and updating synthetic appeals row by row and with bulk upserts. Nothing is kept.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appeals', type=int, default=10000,
+                            help='Synthetic appeals to write')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Appeals in each bulk upsert')
+
+    def time(self, label, write, appeals):
+        started = time.perf_counter()
+        write(appeals)
+        elapsed = time.perf_counter() - started
+        self.stdout.write('%s: %s appeals in %.2f s, %.0f a second' % (
+            label, len(appeals), elapsed, len(appeals) / max(elapsed, 1e-9)))
+
+    def handle(self, *args, **options):
+        count = options['appeals']
+
+        def upsert(appeals):
+            write_appeals(appeals, options['chunk_size'])
+
+        with transaction.atomic():
+            for label, prefix, write in (('row by row', 'ROW', write_rows), ('bulk upsert', 'BULK', upsert)):
+                self.time('%s, create' % label, write, synthetic_appeals(prefix, count, 100))
+                self.time('%s, update' % label, write, synthetic_appeals(prefix, count, 200))
+            # Only the timings are wanted
+            transaction.set_rollback(True)
@@ -0,0 +1,54 @@
+import csv
+import random
+import time
+from django.core.management.base import BaseCommand
+
+from .ingest_mdb import IndexedTable
+
+
+def synthetic_rows(reports, rows_per_report):
+    """ Rows shaped like an action table, a few for each report, in random order """
+    rows = [{'ReportID': str(rid), 'ActionTakenByRedCrossID': str(i), 'Value': 'action %s' % i}
+            for rid in range(reports) for i in range(rows_per_report)]
+    random.shuffle(rows)
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Time joining extracted MDB table rows to reports by ReportID, indexed and by scanning'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv',
+                            help='A table exported with mdb-export to use instead of synthetic rows')
+        parser.add_argument('--reports', type=int, default=20000,
+                            help='Reports in the synthetic table')
+        parser.add_argument('--rows-per-report', type=int, default=3,
+                            help='Rows per report in the synthetic table')
+        parser.add_argument('--scan-sample', type=int, default=200,
+                            help='Reports to time scanning for; the rest is extrapolated')
+
+    def handle(self, *args, **options):
+        if options['csv']:
+            with open(options['csv'], newline='', encoding='utf-8') as f:
+                rows = list(csv.DictReader(f))
+        else:
+            rows = synthetic_rows(options['reports'], options['rows_per_report'])
+        rids = list({row['ReportID'] for row in rows})
+        self.stdout.write('%s rows for %s reports' % (len(rows), len(rids)))
+
+        started = time.perf_counter()
+        table = IndexedTable(rows, 'benchmark')
+        built = time.perf_counter()
+        matched = sum(len(table.get(rid)) for rid in rids)
+        finished = time.perf_counter()
+        self.stdout.write('indexed: built in %.1f ms, joined %s rows to every report in %.1f ms' % (
+            (built - started) * 1000, matched, (finished - built) * 1000))
+
+        # How ingest_mdb used to join, once per table per report
+        sample = rids[:options['scan_sample']]
+        started = time.perf_counter()
+        for rid in sample:
+            [row for row in rows if row['ReportID'] == rid]
+        scanned = (time.perf_counter() - started) * 1000
+        self.stdout.write('scanning: %.1f ms for %s reports, about %.1f s for every report' % (
+            scanned, len(sample), scanned / max(len(sample), 1) * len(rids) / 1000))
@@ -0,0 +1,66 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from api.esconnection import ES_CLIENT
+from api.models import SearchDocument
+from api.search import DEFAULT_SIZE, parse_search
+from api.search_backends import ElasticsearchBackend, DatabaseBackend
+from api.logger import logger
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Time the same searches against elasticsearch and the database search documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('keywords', nargs='*',
+                            help='Keywords to search for, by default words from 20 random document names')
+        parser.add_argument('--runs', type=int, default=20,
+                            help='Times to run each search')
+        parser.add_argument('--size', type=int, default=DEFAULT_SIZE,
+                            help='Hits per search')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild the database search documents first, so both backends hold the same records')
+
+    def handle(self, *args, **options):
+        backends = [DatabaseBackend()]
+        if ES_CLIENT is not None:
+            backends.insert(0, ElasticsearchBackend(ES_CLIENT))
+        else:
+            logger.warning('No elasticsearch host, only timing the database')
+
+        if options['rebuild']:
+            logger.info('Rebuilding the database search documents')
+            backends[-1].rebuild()
+
+        keywords = options['keywords'] or self.sample_keywords()
+        if not len(keywords):
+            raise CommandError('No keywords given and no search documents to take them from')
+
+        for backend in backends:
+            timings = []
+            hits = 0
+            for keyword in keywords:
+                search = parse_search({'keyword': keyword, 'size': options['size']})
+                for i in range(options['runs']):
+                    started = time.perf_counter()
+                    results = backend.search(search)
+                    timings.append((time.perf_counter() - started) * 1000)
+                hits += results['total']
+            self.stdout.write('%s: %s searches, %.1f hits on average, mean %.1f ms, p50 %.1f ms, p95 %.1f ms, p99 %.1f ms' % (
+                backend.name,
+                len(timings),
+                hits / len(keywords),
+                sum(timings) / len(timings),
+                percentile(timings, 0.5),
+                percentile(timings, 0.95),
+                percentile(timings, 0.99),
+            ))
+
+    def sample_keywords(self):
+        names = SearchDocument.objects.exclude(name='').order_by('?').values_list('name', flat=True)[:20]
+        return [name.split()[0] for name in names]
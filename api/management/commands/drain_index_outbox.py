@@ -0,0 +1,149 @@
+import time
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max
+from elasticsearch.helpers import streaming_bulk
+from api.esconnection import ES_CLIENT, get_es_settings
+from api.indexes import ES_REINDEX_MARKER
+from api.models import IndexOutboxEntry
+from api.outbox import indexing_queryset, index_action, delete_action, es_id
+from api.search_backends import DatabaseBackend
+from api.utils import advisory_lock
+from api.logger import logger
+
+
+class Command(BaseCommand):
+    help = 'Bring the search index up to date with the changes queued in the index outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Outbox entries to process per bulk request')
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Give up on an entry after this many failed attempts')
+        parser.add_argument('--max-retries', type=int, default=3,
+                            help='Times to retry documents elasticsearch rejects as overloaded')
+        parser.add_argument('--max-reindex-hours', type=float, default=6,
+                            help='Drain anyway once the reindex marker is older than this')
+
+    def handle(self, *args, **options):
+        # Overlapping runs could write an older version of a record over a newer one
+        with advisory_lock('drain_index_outbox') as locked:
+            if not locked:
+                logger.info('Another drain of the index outbox is running, leaving it to that one')
+                return
+            self.drain_outbox(options)
+
+    def drain_outbox(self, options):
+        if ES_CLIENT is not None and self.reindexing(options['max_reindex_hours']):
+            # Changes drained now would only reach the index being replaced
+            logger.info('Reindexing in progress, leaving the index outbox for later')
+            return
+
+        # Only drain what is queued now, so busy ingests can't keep the job running
+        high_water = IndexOutboxEntry.objects.aggregate(Max('id'))['id__max']
+        if high_water is None:
+            logger.info('Index outbox is empty')
+            return
+
+        last_id = 0
+        totals = {'indexed': 0, 'deleted': 0, 'failed': 0}
+        while True:
+            entries = list(IndexOutboxEntry.objects.filter(
+                id__gt=last_id,
+                id__lte=high_water,
+                attempts__lt=options['max_attempts'],
+            ).order_by('id')[:options['batch_size']])
+            if not len(entries):
+                break
+            last_id = entries[-1].id
+            for key, count in self.drain(entries, options['max_retries']).items():
+                totals[key] += count
+
+        logger.info('Indexed %(indexed)s, deleted %(deleted)s and failed %(failed)s documents' % totals)
+        stuck = IndexOutboxEntry.objects.filter(attempts__gte=options['max_attempts']).count()
+        if stuck:
+            logger.error('%s index outbox entries failed %s times and were skipped' % (stuck, options['max_attempts']))
+
+    def reindexing(self, max_hours):
+        """ Whether an index is being built, going by the marker on it.
+
+        A reindex that was killed leaves its marker behind. One older than
+        `max_hours` is taken to be such a leftover, so the outbox doesn't
+        grow forever.
+        """
+        if not ES_CLIENT.indices.exists_alias(name=ES_REINDEX_MARKER):
+            return False
+        settings = ES_CLIENT.indices.get_settings(index=ES_REINDEX_MARKER, name='index.creation_date')
+        created = max(int(index['settings']['index']['creation_date']) for index in settings.values()) / 1000
+        hours = (time.time() - created) / 3600
+        if hours > max_hours:
+            logger.error('%s has carried the %s marker for %.1f hours, draining the index outbox anyway. '
+                         'Run index_elasticsearch to rebuild the index and clear the marker.' % (
+                             ', '.join(sorted(settings)), ES_REINDEX_MARKER, hours))
+            return False
+        return True
+
+    def drain(self, entries, max_retries):
+        """ Index or delete the documents of a batch of entries, then check them off """
+        ids_by_type = defaultdict(set)
+        for entry in entries:
+            ids_by_type[entry.model_type].add(entry.object_id)
+
+        # Records that no longer exist get their documents deleted
+        actions = []
+        for model_type, ids in ids_by_type.items():
+            records = indexing_queryset(model_type).in_bulk(ids)
+            for pk in ids:
+                if pk in records:
+                    actions.append(index_action(records[pk]))
+                else:
+                    actions.append(delete_action(model_type, pk))
+
+        if ES_CLIENT is None:
+            # Without elasticsearch, keep the database search documents up to date instead
+            DatabaseBackend().bulk(actions)
+            errors = {}
+        else:
+            errors = self.bulk(actions, max_retries)
+
+        with transaction.atomic():
+            done = [entry.id for entry in entries if es_id(entry.model_type, entry.object_id) not in errors]
+            IndexOutboxEntry.objects.filter(id__in=done).delete()
+            for entry in entries:
+                error = errors.get(es_id(entry.model_type, entry.object_id))
+                if error is not None:
+                    IndexOutboxEntry.objects.filter(id=entry.id).update(attempts=F('attempts') + 1, last_error=error)
+
+        counts = {'indexed': 0, 'deleted': 0, 'failed': 0}
+        for action in actions:
+            if action['_id'] in errors:
+                counts['failed'] += 1
+            elif action['_op_type'] == 'index':
+                counts['indexed'] += 1
+            else:
+                counts['deleted'] += 1
+        return counts
+
+    def bulk(self, actions, max_retries):
+        """ Send the actions, returning the error of each document that failed by id """
+        errors = {}
+        results = streaming_bulk(
+            client=ES_CLIENT,
+            actions=actions,
+            raise_on_error=False,
+            raise_on_exception=False,
+            max_retries=max_retries,
+            request_timeout=get_es_settings()['BULK_TIMEOUT'],
+        )
+        for ok, result in results:
+            if ok:
+                continue
+            op_type, info = result.popitem()
+            # Deleting a document that was never indexed is fine
+            if op_type == 'delete' and info.get('status') == 404:
+                continue
+            errors[info['_id']] = str(info.get('error'))[:512]
+        if len(errors):
+            logger.error('Could not index %s documents, e.g. %s' % (len(errors), next(iter(errors.values()))))
+        return errors
@@ -3,20 +3,18 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.template.loader import render_to_string
-from elasticsearch.helpers import bulk
-from api.indexes import ES_PAGE_NAME
-from api.esconnection import ES_CLIENT
 from api.models import Country, Appeal, Event, FieldReport
 from api.logger import logger
 from notifications.models import RecordType, SubscriptionType
 from notifications.hello import get_hello
 from notifications.notification import send_notification
 from main.frontend import frontend_url
+from main import metrics
 
 time_interval = timedelta(minutes=5)
 
 class Command(BaseCommand):
-    help = 'Index and send notificatins about recently changed records'
+    help = 'Send notifications about recently changed records'
 
 
     def get_time_threshold(self):
@@ -156,55 +154,11 @@ class Command(BaseCommand):
         )
         logger.info('Notifying %s subscriber(s) about %s %s %s' % (len(emails), record_count, adj.lower(), record_type))
         send_notification(subject, recipients, html)
+        metrics.inc('goapi_command_records_total', command='index_and_notify', action='notifications')
+        metrics.inc('goapi_command_records_total', len(emails), command='index_and_notify', action='recipients')
 
 
-    def index_new_records(self, records):
-        self.bulk([self.convert_for_bulk(record, create=True) for record in list(records)])
-
-
-    def index_updated_records(self, records):
-        self.bulk([self.convert_for_bulk(record, create=False) for record in list(records)])
-
-
-    def convert_for_bulk(self, record, create):
-        data = record.indexing()
-        metadata = {
-            '_op_type': 'create' if create else 'update',
-            '_index': ES_PAGE_NAME,
-            '_type': 'page',
-            '_id': record.es_id()
-        }
-        if (create):
-            metadata.update(**data)
-        else:
-            metadata['doc'] = data
-        return metadata
-
-
-    def bulk(self, actions):
-        try:
-            created, errors = bulk(client=ES_CLIENT, actions=actions)
-            if len(errors):
-                logger.error('Produced the following errors:')
-                logger.error('[%s]' % ', '.join(map(str, errors)))
-        except Exception as e:
-            logger.error('Could not index records')
-            logger.error('%s...' % str(e)[:512])
-
-
-    # Remove items in a queryset where updated_at == created_at.
-    # This leaves us with only ones that have been modified.
-    def filter_just_created(self, queryset):
-        if queryset.first() is None:
-            return []
-        if queryset.first().modified_at is not None:
-            return [record for record in queryset if (
-                record.modified_at.replace(microsecond=0) == record.created_at.replace(microsecond=0))]
-        else:
-            return [record for record in queryset if (
-                record.updated_at.replace(microsecond=0) == record.created_at.replace(microsecond=0))]
-
-
+    @metrics.command_metrics('index_and_notify')
     def handle(self, *args, **options):
         t = self.get_time_threshold()
 
@@ -225,17 +179,3 @@ class Command(BaseCommand):
 
         self.notify(new_events, RecordType.EVENT, SubscriptionType.NEW)
         self.notify(updated_events, RecordType.EVENT, SubscriptionType.EDIT)
-
-        logger.info('Indexing %s updated field reports' % updated_reports.count())
-        self.index_updated_records(self.filter_just_created(updated_reports))
-        logger.info('Indexing %s updated appeals' % updated_appeals.count())
-        self.index_updated_records(self.filter_just_created(updated_appeals))
-        logger.info('Indexing %s updated events' % updated_events.count())
-        self.index_updated_records(self.filter_just_created(updated_events))
-
-        logger.info('Indexing %s new field reports' % new_reports.count())
-        self.index_new_records(new_reports)
-        logger.info('Indexing %s new appeals' % new_appeals.count())
-        self.index_new_records(new_appeals)
-        logger.info('Indexing %s new events' % new_events.count())
-        self.index_new_records(new_events)
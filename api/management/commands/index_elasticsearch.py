@@ -1,57 +1,191 @@
-from django.core.management.base import BaseCommand
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
 
 from elasticsearch.client import IndicesClient
-from elasticsearch.helpers import bulk
-from elasticsearch import Elasticsearch
+from elasticsearch.helpers import streaming_bulk
 
-from api.esconnection import ES_CLIENT
-from api.indexes import GenericMapping, ES_PAGE_NAME
-from api.models import Event, Appeal, FieldReport
+from api.esconnection import ES_CLIENT, get_es_settings
+from api.indexes import GenericAnalysis, GenericMapping, ES_PAGE_NAME, ES_REINDEX_MARKER
+from api.outbox import OUTBOX_MODELS, indexing_queryset
+from api.search_backends import DatabaseBackend
+from api.utils import advisory_lock, iterate_in_chunks
 from api.logger import logger
 
+
 class Command(BaseCommand):
-    help = 'Create a new elasticsearch index and bulk-index existing objects'
+    help = 'Build a new elasticsearch index from existing objects and point the page alias at it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replicas', type=int, default=1,
+                            help='Replicas of the new index once it is built')
+        parser.add_argument('--keep', type=int, default=1,
+                            help='Previous indices to keep for rollback')
+        parser.add_argument('--rollback', action='store_true',
+                            help='Point the alias back at the previous index instead of reindexing')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Records to read and documents to send at a time')
+        parser.add_argument('--max-chunk-bytes', type=int, default=10 * 1024 * 1024,
+                            help='Largest bulk request to send, in bytes')
 
     def handle(self, *args, **options):
-        logger.info('Recreating indices')
-        self.recreate_index(ES_PAGE_NAME, GenericMapping)
-
-        logger.info('Indexing events')
-        self.push_table_to_index(model=Event)
-
-        logger.info('Indexing appeals')
-        self.push_table_to_index(model=Appeal)
-
-        logger.info('Indexing field reports')
-        self.push_table_to_index(model=FieldReport)
-
-    def recreate_index(self, index_name, index_mapping):
-        indices_client = IndicesClient(client=ES_CLIENT)
-        if indices_client.exists(index_name):
-            indices_client.delete(index=index_name)
-        indices_client.create(index=index_name)
-        indices_client.put_mapping(doc_type='page',
-                                   index=index_name,
-                                   body=index_mapping)
-
-
-    def push_table_to_index(self, model):
-        query = model.objects.all()
-        data = [
-            self.convert_for_bulk(s) for s in list(query)
-        ]
-        created, errors = bulk(client=ES_CLIENT, actions=data)
+        if ES_CLIENT is None:
+            if options['rollback']:
+                raise CommandError('No elasticsearch host to roll back')
+            logger.warning('No elasticsearch host, rebuilding the database search documents instead')
+            DatabaseBackend().rebuild(options['chunk_size'])
+            return
+        self.indices = IndicesClient(client=ES_CLIENT)
+
+        if options['rollback']:
+            self.rollback()
+            return
+
+        with advisory_lock('index_elasticsearch') as locked:
+            if not locked:
+                raise CommandError('Another index_elasticsearch run is building an index')
+            self.reindex(options)
+
+    def reindex(self, options):
+        # No other run is building one, so marked indices were left by runs that were killed
+        self.delete_abandoned()
+
+        # Versioned names sort by age, e.g. `page_all_20180601120000`
+        index_name = '%s_%s' % (ES_PAGE_NAME, timezone.now().strftime('%Y%m%d%H%M%S'))
+        logger.info('Building %s' % index_name)
+        self.create_index(index_name, GenericMapping)
+        try:
+            for model_type in OUTBOX_MODELS:
+                self.push_table_to_index(index_name, model_type, options['chunk_size'], options['max_chunk_bytes'])
+            self.finish_index(index_name, options['replicas'])
+            self.switch_alias(index_name)
+        except BaseException:
+            # Interrupted too: the marker would hold the index outbox until this index is gone.
+            # The alias still points at the old index, so searches never saw this one.
+            logger.error('Reindexing failed or was interrupted, deleting %s' % index_name)
+            self.indices.delete(index=index_name)
+            raise
+
+        self.prune(index_name, options['keep'])
+
+    def create_index(self, index_name, index_mapping):
+        """ An index tuned for the bulk load: no refreshes, no replicas.
+
+        The reindex marker alias tells `drain_index_outbox` to hold queued
+        changes until the alias switches, so none land only in the old index.
+        """
+        self.indices.create(index=index_name, body={
+            'settings': {
+                'number_of_replicas': 0,
+                'refresh_interval': '-1',
+                'analysis': GenericAnalysis,
+            },
+            'mappings': {'page': index_mapping},
+            'aliases': {ES_REINDEX_MARKER: {}},
+        })
+
+    def delete_abandoned(self):
+        """ Delete indices still carrying the reindex marker """
+        if not self.indices.exists_alias(name=ES_REINDEX_MARKER):
+            return
+        for name in self.indices.get_alias(name=ES_REINDEX_MARKER):
+            logger.warning('Deleting %s, left behind by an unfinished reindex' % name)
+            self.indices.delete(index=name)
+
+    def finish_index(self, index_name, replicas):
+        self.indices.put_settings(index=index_name, body={
+            'index': {
+                'number_of_replicas': replicas,
+                'refresh_interval': '1s',
+            },
+        })
+        self.indices.refresh(index=index_name, request_timeout=get_es_settings()['BULK_TIMEOUT'])
+
+    def versioned_indices(self):
+        """ Names of the versioned page indices, oldest first """
+        prefix = '%s_' % ES_PAGE_NAME
+        return sorted(name for name in self.indices.get(index='%s*' % prefix)
+                      if name[len(prefix):].isdigit())
+
+    def aliased_indices(self):
+        if not self.indices.exists_alias(name=ES_PAGE_NAME):
+            return []
+        return list(self.indices.get_alias(name=ES_PAGE_NAME))
+
+    def switch_alias(self, index_name):
+        """ Move the page alias to `index_name` in one step, so searches see either index but never neither """
+        if self.indices.exists(index=ES_PAGE_NAME) and not self.indices.exists_alias(name=ES_PAGE_NAME):
+            # Before versioned indices `page_all` was an index itself, and it
+            # has to go before an alias can take the name
+            logger.warning('Deleting the unversioned %s index' % ES_PAGE_NAME)
+            self.indices.delete(index=ES_PAGE_NAME)
+
+        actions = [{'remove': {'index': name, 'alias': ES_PAGE_NAME}} for name in self.aliased_indices()]
+        actions.append({'add': {'index': index_name, 'alias': ES_PAGE_NAME}})
+        actions.append({'remove': {'index': index_name, 'alias': ES_REINDEX_MARKER}})
+        self.indices.update_aliases(body={'actions': actions})
+        logger.info('Pointed %s at %s' % (ES_PAGE_NAME, index_name))
+
+    def prune(self, index_name, keep):
+        """ Delete all but the `keep` newest indices before `index_name` """
+        previous = [name for name in self.versioned_indices() if name < index_name]
+        stale = previous[:max(len(previous) - keep, 0)]
+        for name in stale:
+            logger.info('Deleting %s' % name)
+            self.indices.delete(index=name)
+
+    def rollback(self):
+        current = self.aliased_indices()
+        previous = [name for name in self.versioned_indices() if current and name < min(current)]
+        if not len(previous):
+            raise CommandError('No previous index to roll back to')
+        actions = [{'remove': {'index': name, 'alias': ES_PAGE_NAME}} for name in current]
+        actions.append({'add': {'index': previous[-1], 'alias': ES_PAGE_NAME}})
+        self.indices.update_aliases(body={'actions': actions})
+        logger.info('Pointed %s back at %s' % (ES_PAGE_NAME, previous[-1]))
+
+    def push_table_to_index(self, index_name, model_type, chunk_size, max_chunk_bytes):
+        """ Stream a model's documents into the index, a chunk of records at a time """
+        queryset = indexing_queryset(model_type).order_by('pk')
+        total = queryset.count()
+        name = queryset.model._meta.verbose_name_plural
+        logger.info('Indexing %s %s' % (total, name))
+
+        actions = (self.convert_for_bulk(index_name, s)
+                   for chunk in iterate_in_chunks(queryset, chunk_size)
+                   for s in chunk)
+        results = streaming_bulk(
+            client=ES_CLIENT,
+            actions=actions,
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            raise_on_error=False,
+            request_timeout=get_es_settings()['BULK_TIMEOUT'],
+        )
+
+        started = time.time()
+        created = 0
+        errors = []
+        for done, (ok, result) in enumerate(results, 1):
+            if ok:
+                created += 1
+            else:
+                errors.append(result)
+            if done % chunk_size == 0 or done == total:
+                elapsed = time.time() - started
+                logger.info('%s/%s %s (%d per second)' % (done, total, name, done / elapsed if elapsed else done))
+
         logger.info('Created %s records' % created)
         if len(errors):
             logger.error('Produced the following errors:')
-            logger.error('[%s]' % ', '.join(map(str, errors)))
-
+            logger.error('[%s]' % ', '.join(map(str, errors[:10])))
+            raise CommandError('Could not index %s %s' % (len(errors), name))
 
-    def convert_for_bulk(self, model_object):
+    def convert_for_bulk(self, index_name, model_object):
         data = model_object.indexing()
         metadata = {
             '_op_type': 'create',
-            '_index': ES_PAGE_NAME,
+            '_index': index_name,
             '_type': 'page',
             '_id': model_object.es_id(),
         }
@@ -2,33 +2,81 @@ import os
 import sys
 import requests
 import json
+import hashlib
 from datetime import datetime, timezone, timedelta
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.bulk import bulk_upsert, record_bulk_changes, rollup_keys
 from api.models import AppealType, AppealStatus, Appeal, Region, Country, DisasterType, Event
 from api.fixtures.dtype_map import DISASTER_TYPE_MAPPING
 from api.logger import logger
+from main import metrics
 
 dtype_keys = [a.lower() for a in DISASTER_TYPE_MAPPING.keys()]
 dtype_vals = [a.lower() for a in DISASTER_TYPE_MAPPING.values()]
 
+
+def record_hash(record):
+    """ Hash of an appeals API record, the same for records with the same content """
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Fields the ingest sets on appeals it updates; the event guess is only made for new ones
+UPDATED_FIELDS = (
+    'aid', 'name', 'dtype', 'atype', 'country', 'region', 'sector', 'status', 'start_date', 'end_date',
+    'num_beneficiaries', 'amount_requested', 'amount_funded', 'source_hash',
+)
+
+
+def write_appeals(appeals, chunk_size=500):
+    """ Insert or update appeals by code, one transaction per chunk, and do
+    what the save signals would. Returns how many were created and updated.
+    """
+    num_created = 0
+    num_updated = 0
+    for start in range(0, len(appeals), chunk_size):
+        chunk = appeals[start:start + chunk_size]
+        with transaction.atomic():
+            previous = rollup_keys(Appeal, code__in=[appeal.code for appeal in chunk])
+            result = bulk_upsert(Appeal, chunk, 'code', UPDATED_FIELDS, chunk_size)
+            record_bulk_changes(Appeal, result.created + result.updated, previous)
+        num_created += len(result.created)
+        num_updated += len(result.updated)
+    return num_created, num_updated
+
+
 class Command(BaseCommand):
     help = 'Add new entries from Access database file'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Appeals to write in each transaction')
+
     def parse_date(self, date_string):
         timeformat = '%Y-%m-%dT%H:%M:%S'
         return datetime.strptime(date_string[:18], timeformat).replace(tzinfo=timezone.utc)
 
+    def load_lookups(self):
+        """ Disaster types, countries and regions, to map every record without queries """
+        self.dtypes = {dtype.name: dtype for dtype in DisasterType.objects.all()}
+        self.countries_by_iso = {}
+        self.countries_by_name = {}
+        # Countries are ordered by name; the first match wins, as with `.first()`
+        for country in Country.objects.select_related('region'):
+            if country.iso is not None:
+                self.countries_by_iso.setdefault(country.iso, country)
+            self.countries_by_name.setdefault(country.name, country)
+        self.regions = {region.name: region for region in Region.objects.all()}
+
     def get_new_or_modified_appeals(self):
         use_local_file = True if os.getenv('DJANGO_DB_NAME') == 'test' and os.path.exists('appeals.json') else False
-        new = []
-        modified = []
         if use_local_file:
             # read from static file for development
             logger.info('Using local appeals.json file')
             with open('appeals.json') as f:
-                modified = json.loads(f.read())
+                records = json.loads(f.read())
         else:
-            # get latest, determine which appeals need to be ingested based on last modified time
+            # get the latest records from the appeals API
             logger.info('Querying appeals API for new appeals data')
             url = 'http://go-api.ifrc.org/api/appeals'
             auth = (os.getenv('APPEALS_USER'), os.getenv('APPEALS_PASS'))
@@ -42,14 +90,24 @@ class Command(BaseCommand):
             with open('appeals.json', 'w') as outfile:
                 json.dump(records, outfile)
 
-            since_last_checked = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(minutes=90)
-            codes = [a.code for a in Appeal.objects.all()]
-            for r in records:
-                if not r['APP_code'] in codes:
-                    new.append(r)
-                last_modified = self.parse_date(r['APP_modifyTime'])
-                if last_modified > since_last_checked:
+        # Records are modified when their content changed since they were last ingested
+        hashes = dict(Appeal.objects.values_list('code', 'source_hash'))
+        since_last_checked = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(minutes=90)
+        new = []
+        modified = []
+        for r in records:
+            if not r['APP_code'] in hashes:
+                new.append(r)
+            elif not hashes[r['APP_code']]:
+                # Not ingested since hashes were kept. Record the hash without
+                # touching `modified_at`, which would notify subscribers of an
+                # edit, and update it only if it was modified recently, as before.
+                if self.parse_date(r['APP_modifyTime']) > since_last_checked:
                     modified.append(r)
+                else:
+                    Appeal.objects.filter(code=r['APP_code']).update(source_hash=record_hash(r))
+            elif hashes[r['APP_code']] != record_hash(r):
+                modified.append(r)
 
         return new, modified
 
@@ -62,20 +120,13 @@ class Command(BaseCommand):
             disaster_name = list(DISASTER_TYPE_MAPPING.values())[idx]
         else:
             disaster_name = 'Other'
-        dtype = DisasterType.objects.get(name=disaster_name)
+        dtype = self.dtypes[disaster_name]
         return dtype
 
     def parse_country(self, iso_code, country_name):
         if len(iso_code) == 2:
-            country = Country.objects.filter(iso=iso_code.lower())
-        else:
-            country = Country.objects.filter(name=country_name)
-
-        if country.count() == 0:
-            country = None
-        else:
-            country = country.first()
-        return country
+            return self.countries_by_iso.get(iso_code.lower())
+        return self.countries_by_name.get(country_name)
 
     def parse_appeal_record(self, r, **options):
         # get the disaster type mapping
@@ -92,14 +143,14 @@ class Command(BaseCommand):
 
         # get the region mapping, using the country if possible
         if country is not None and country.region is not None:
-            region = Region.objects.get(pk=country.region.pk)
+            region = country.region
         else:
             regions = {'africa': 0, 'americas': 1, 'asia pacific': 2, 'europe': 3, 'middle east and north africa': 4}
             region_name = r['OSR_name'].lower().strip()
             if not region_name in regions:
                 region = None
             else:
-                region = Region.objects.get(name=regions[region_name])
+                region = self.regions[regions[region_name]]
 
         # get the most recent appeal detail, using the appeal start date
         # if there is more than one detail, the start date should be the *earliest
@@ -150,6 +201,8 @@ class Command(BaseCommand):
             'num_beneficiaries': detail['APD_noBeneficiaries'],
             'amount_requested': detail['APD_amountCHF'],
             'amount_funded': amount_funded,
+
+            'source_hash': record_hash(r),
         }
 
         if event is not None:
@@ -159,36 +212,24 @@ class Command(BaseCommand):
         return fields
 
 
+    @metrics.command_metrics('ingest_appeals')
     def handle(self, *args, **options):
         logger.info('Starting appeals ingest')
+        self.load_lookups()
         new, modified = self.get_new_or_modified_appeals()
         logger.info('%s current appeals' % Appeal.objects.all().count())
         logger.info('Creating %s new appeals' % len(new))
         logger.info('Updating %s existing appeals that have been modified' % len(modified))
 
-        num_created = 0
-        for i, r in enumerate(new):
-            fields = self.parse_appeal_record(r, is_new_appeal=True)
-            try:
-                Appeal.objects.create(**fields)
-            except Exception as e:
-                logger.error(str(e)[:100])
-                logger.error('Could not create appeal with code %s' % fields['code'])
-                continue
-            num_created = num_created + 1
-
-        num_updated = 0
-        for i, r in enumerate(modified):
-            fields = self.parse_appeal_record(r, is_new_appeal=False)
-            try:
-                appeal, created = Appeal.objects.update_or_create(code=fields['code'], defaults=fields)
-            except Exception as e:
-                logger.error(str(e)[:100])
-                logger.error('Could not update appeal with code %s' % fields['code'])
-                continue
-            num_updated = num_updated + 1
+        appeals = [Appeal(**self.parse_appeal_record(r, is_new_appeal=True)) for r in new]
+        appeals += [Appeal(**self.parse_appeal_record(r, is_new_appeal=False)) for r in modified]
+        num_created, num_updated = write_appeals(appeals, options['chunk_size'])
 
         logger.info('%s appeals created' % num_created)
         logger.info('%s appeals updated' % num_updated)
+        metrics.inc('goapi_command_records_total', num_created, command='ingest_appeals', action='created')
+        metrics.inc('goapi_command_records_total', num_updated, command='ingest_appeals', action='updated')
+        metrics.inc('goapi_command_records_total', len(new) + len(modified) - num_created - num_updated,
+                    command='ingest_appeals', action='failed')
         logger.info('%s total appeals' % Appeal.objects.all().count())
         logger.info('Appeals ingest completed')
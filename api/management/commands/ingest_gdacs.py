@@ -6,11 +6,13 @@ from django.core.management.base import BaseCommand
 from api.models import Country, Event, GDACSEvent
 from api.event_sources import SOURCES
 from api.logger import logger
+from main import metrics
 
 
 class Command(BaseCommand):
     help = 'Add new entries from Access database file'
 
+    @metrics.command_metrics('ingest_gdacs')
     def handle(self, *args, **options):
         logger.info('Starting GDACs ingest')
         # get latest
@@ -91,3 +93,4 @@ class Command(BaseCommand):
                     [event.countries.add(c) for c in gdacsevent.countries.all()]
 
         logger.info('%s GDACs events added' % added)
+        metrics.inc('goapi_command_records_total', added, command='ingest_gdacs', action='created')
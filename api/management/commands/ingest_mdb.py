@@ -1,7 +1,11 @@
 import os
+import io
 import csv
 import subprocess
 import pytz
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from django.utils import timezone
 from datetime import datetime, timedelta
 from glob import glob
@@ -10,6 +14,7 @@ from zipfile import ZipFile
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from api.models import (
     DisasterType,
     Country,
@@ -21,29 +26,54 @@ from api.models import (
     Source,
     Event,
 )
+from api.bulk import bulk_insert, record_bulk_changes
 from api.fixtures.dtype_map import PK_MAP
 from api.event_sources import SOURCES
 from api.logger import logger
+from main import metrics
 
 REPORT_DATE_FORMAT = '%m/%d/%y %H:%M:%S'
 
-def extract_table(dbfile, table):
-    """ Extract a table from the Access database """
-    cmd = 'mdb-export %s %s' % (dbfile, table)
-    try:
-        output = subprocess.check_output(cmd.split(' ')).splitlines()
-    except Exception as e:
-        logger.error(e)
-    output = [o.decode('utf-8') for o in output]
-    reader = csv.reader(output, delimiter=',', quotechar='"')
-    records = []
-    for i, row in enumerate(reader):
-        if i == 0:
-            header = row
-        else:
-            d = {header[i]: l for i, l in enumerate(row)}
-            records.append(d)
-    return records
+class MdbExtractor(object):
+    """ Reads tables from the Access database with `mdb-export` """
+
+    def __init__(self, dbfile, command=('mdb-export',)):
+        self.dbfile = dbfile
+        self.command = list(command)
+
+    def rows(self, table):
+        """ The table's rows as dicts, parsed while mdb-export writes them """
+        process = subprocess.Popen(self.command + [self.dbfile, table], stdout=subprocess.PIPE)
+        try:
+            # newline='' keeps line breaks inside quoted values for the csv reader
+            for row in csv.DictReader(io.TextIOWrapper(process.stdout, encoding='utf-8', newline='')):
+                yield row
+        finally:
+            process.stdout.close()
+            process.wait()
+        if process.returncode != 0:
+            raise Exception('mdb-export of %s failed with exit status %s' % (table, process.returncode))
+
+
+class CsvExtractor(object):
+    """ Reads tables from `<table>.csv` files, as mdb-export would write them """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def rows(self, table):
+        with open(os.path.join(self.directory, '%s.csv' % table), newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                yield row
+
+
+def extract_tables(extractor, tables, max_workers=4):
+    """ Extract tables concurrently. `tables` maps each table to a function
+    of its rows and name, that builds what is kept of it.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {table: pool.submit(load, extractor.rows(table), table) for table, load in tables.items()}
+        return {table: future.result() for table, future in futures.items()}
 
 
 def contact_is_valid(contact, field):
@@ -96,69 +126,212 @@ def get_dbfile():
     return 'URLs.mdb'
 
 
-def fetch_relation(records, rid):
-    """ Find record with matching ReportID to rid """
-    matches = [r for r in records if r['ReportID'] == rid]
-    results = []
-    for match in matches:
-        results.append({key: (value if value != '' else None) for key, value in match.items()})
-    return results
+class IndexedTable(object):
+    """ Rows of an extracted table grouped by `ReportID`, so joining them to
+    reports takes one lookup instead of a scan of the table.
+
+    Empty values become None. With `unique`, a report with more than one row
+    raises an exception naming the table.
+    """
+
+    def __init__(self, records, name, unique=False, key='ReportID'):
+        self.name = name
+        self.rows = defaultdict(list)
+        for record in records:
+            rows = self.rows[record[key]]
+            if unique and len(rows):
+                raise Exception('More than one %s record for field report %s' % (name, record[key]))
+            rows.append({column: (value if value != '' else None) for column, value in record.items()})
+
+    def get(self, rid):
+        return self.rows.get(rid, [])
+
+    def first(self, rid):
+        rows = self.get(rid)
+        return rows[0] if len(rows) else None
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.rows.values())
+
+
+def unique_rows(rows, table):
+    return IndexedTable(rows, table, unique=True)
+
+
+def related_rows(rows, table):
+    return IndexedTable(rows, table)
+
+
+def all_rows(rows, table):
+    return list(rows)
+
+
+# A new report with the records written along with it
+PendingReport = namedtuple('PendingReport', 'report event country actions sources contacts')
+
+
+class FieldReportWriter(object):
+    """ Writes new field reports with their events and related records in bulk.
+
+    Lookups are loaded once. Every `chunk_size` reports are written in one
+    transaction, with one bulk insert per table, and then what the save
+    signals would have done is done for the whole chunk.
+    """
+
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self.dtypes = {str(dtype.pk): dtype for dtype in DisasterType.objects.all()}
+        self.countries = {str(country.pk): country for country in Country.objects.all()}
+        self.actions = set(Action.objects.values_list('pk', flat=True))
+        self.source_types = set(SourceType.objects.values_list('pk', flat=True))
+        self.pending = []
+        self.created = 0
+        self.elapsed = 0.0
+
+    def add(self, pending):
+        self.pending.append(pending)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not len(self.pending):
+            return
+        started = time.perf_counter()
+        with transaction.atomic():
+            self.write(self.pending)
+        elapsed = time.perf_counter() - started
+        self.created += len(self.pending)
+        self.elapsed += elapsed
+        logger.info('Wrote %s reports, %.0f a second' % (len(self.pending), len(self.pending) / elapsed))
+        self.pending = []
+
+    def write(self, pending):
+        events = [p.event for p in pending]
+        bulk_insert(Event, events, self.chunk_size)
+        reports = []
+        for p in pending:
+            p.report.event = p.event
+            reports.append(p.report)
+        bulk_insert(FieldReport, reports, self.chunk_size)
+
+        report_countries, report_regions, event_countries, event_regions = [], [], [], []
+        for p in pending:
+            if p.country is None:
+                continue
+            report_countries.append(FieldReport.countries.through(fieldreport_id=p.report.pk, country_id=p.country.pk))
+            event_countries.append(Event.countries.through(event_id=p.event.pk, country_id=p.country.pk))
+            if p.country.region_id is not None:
+                report_regions.append(FieldReport.regions.through(fieldreport_id=p.report.pk, region_id=p.country.region_id))
+                event_regions.append(Event.regions.through(event_id=p.event.pk, region_id=p.country.region_id))
+        for rows in (report_countries, report_regions, event_countries, event_regions):
+            if len(rows):
+                type(rows[0]).objects.bulk_create(rows, batch_size=self.chunk_size)
+
+        actions_taken = []
+        for p in pending:
+            for act, action_ids in p.actions:
+                act.field_report = p.report
+                actions_taken.append((act, action_ids))
+        bulk_insert(ActionsTaken, [act for act, action_ids in actions_taken], self.chunk_size)
+        # Unknown actions are left out, as they always were
+        ActionsTaken.actions.through.objects.bulk_create([
+            ActionsTaken.actions.through(actionstaken_id=act.pk, action_id=int(pk))
+            for act, action_ids in actions_taken for pk in set(action_ids)
+            if pk is not None and int(pk) in self.actions
+        ], batch_size=self.chunk_size)
+
+        sources = []
+        for p in pending:
+            for source in p.sources:
+                if source.stype_id is None or int(source.stype_id) not in self.source_types:
+                    logger.warn('Could not find source type %s for report %s' % (source.stype_id, p.report.rid))
+                    continue
+                source.field_report = p.report
+                sources.append(source)
+        Source.objects.bulk_create(sources, batch_size=self.chunk_size)
+
+        contacts = []
+        for p in pending:
+            for contact in p.contacts:
+                contact.field_report = p.report
+                contacts.append(contact)
+        FieldReportContact.objects.bulk_create(contacts, batch_size=self.chunk_size)
+
+        record_bulk_changes(Event, events)
+        record_bulk_changes(FieldReport, reports)
+
+
+# The tables ingested, and how each is kept
+TABLES = {
+    'EW_Report_NumericDetails': unique_rows,
+    'EW_Report_NumericDetails_GOV': unique_rows,
+    'EW_Report_InformationManagement': unique_rows,
+    'EW_Report_ActionTakenByRedCross': related_rows,
+    'EW_Report_ActionTakenByPnsRC': related_rows,
+    'EW_Report_ActionTakenByFederationRC': related_rows,
+    'EW_lofSources': all_rows,
+    'EW_Reports_Sources': related_rows,
+    'EW_DisasterResponseTools': unique_rows,
+    'EW_Report_Contacts': related_rows,
+    'EW_Reports': all_rows,
+    'DMISUsers': all_rows,
+}
 
 
 class Command(BaseCommand):
     help = 'Add new entries from Access database file'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--csv-dir',
+                            help='Read tables from <table>.csv files in this directory instead of the Access database')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Tables to extract at the same time')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Reports to write in each transaction')
+
+    def get_extractor(self, options):
+        if options['csv_dir']:
+            return CsvExtractor(options['csv_dir'])
+        return MdbExtractor(get_dbfile())
+
+    @metrics.command_metrics('ingest_mdb')
     def handle(self, *args, **options):
         # get latest
-        filename = get_dbfile()
-
-        # numeric details records
-        details_rc = extract_table(filename, 'EW_Report_NumericDetails')
-        # check for 1 record for each field report
-        fids = [r['ReportID'] for r in details_rc]
-        if len(set(fids)) != len(fids):
-            raise Exception('More than one NumericDetails record for a field report')
-        # numeric details records
-        details_gov = extract_table(filename, 'EW_Report_NumericDetails_GOV')
-        # check for 1 record for each field report
-        fids = [r['ReportID'] for r in details_gov]
-        if len(set(fids)) != len(fids):
-            raise Exception('More than one NumericDetails record for a field report')
+        extractor = self.get_extractor(options)
+        tables = extract_tables(extractor, TABLES, max_workers=options['workers'])
+
+        # one record for each field report
+        details_rc = tables['EW_Report_NumericDetails']
+        details_gov = tables['EW_Report_NumericDetails_GOV']
 
         # information
-        info_table = extract_table(filename, 'EW_Report_InformationManagement')
-        fids = [r['ReportID'] for r in info_table]
-        if len(set(fids)) != len(fids):
-            raise Exception('More than one InformationManagement record for a field report')
+        info_table = tables['EW_Report_InformationManagement']
 
         ### many-to-many
 
         # actions taken
-        actions_national = extract_table(filename, 'EW_Report_ActionTakenByRedCross')
-        actions_foreign = extract_table(filename, 'EW_Report_ActionTakenByPnsRC')
-        actions_federation = extract_table(filename, 'EW_Report_ActionTakenByFederationRC')
+        actions_national = tables['EW_Report_ActionTakenByRedCross']
+        actions_foreign = tables['EW_Report_ActionTakenByPnsRC']
+        actions_federation = tables['EW_Report_ActionTakenByFederationRC']
 
         # source types
-        source_types = extract_table(filename, 'EW_lofSources')
-        for s in source_types:
-            SourceType.objects.get_or_create(pk=s['SourceID'], defaults={'name': s['SourceName']})
+        source_types = tables['EW_lofSources']
+        existing = set(str(pk) for pk in SourceType.objects.values_list('pk', flat=True))
+        SourceType.objects.bulk_create([SourceType(pk=s['SourceID'], name=s['SourceName'])
+                                        for s in source_types if s['SourceID'] not in existing])
 
-        source_table = extract_table(filename, 'EW_Reports_Sources')
+        source_table = tables['EW_Reports_Sources']
 
-        # disaster response
-        dr_table = extract_table(filename, 'EW_DisasterResponseTools')
-        # check for 1 record for each field report
-        fids = [r['ReportID'] for r in dr_table]
-        if len(set(fids)) != len(fids):
-            raise Exception('More than one DisasterResponseTools record for a field report')
+        # disaster response, one record for each field report
+        dr_table = tables['EW_DisasterResponseTools']
 
         # contacts
-        contacts = extract_table(filename, 'EW_Report_Contacts')
+        contacts = tables['EW_Report_Contacts']
 
         # field report
-        reports = extract_table(filename, 'EW_Reports')
-        rids = [r.rid for r in FieldReport.objects.all()]
-        num_reports_created = 0
+        reports = tables['EW_Reports']
+        rids = set(FieldReport.objects.values_list('rid', flat=True))
+        writer = FieldReportWriter(chunk_size=options['chunk_size'])
         logger.info('%s reports in database' % len(reports))
         for i, report in enumerate(reports):
 
@@ -170,7 +343,7 @@ class Command(BaseCommand):
 
             report_name = report['Summary']
             report_description = report['BriefSummary']
-            report_dtype = DisasterType.objects.get(pk=PK_MAP[report['DisasterTypeID']])
+            report_dtype = writer.dtypes[PK_MAP[report['DisasterTypeID']]]
             record = {
                 'rid': rid,
                 'summary': report_name,
@@ -181,10 +354,8 @@ class Command(BaseCommand):
                 'actions_others': report['ActionTakenByOthers'],
                 'report_date': datetime.strptime(report['Inserted'], REPORT_DATE_FORMAT).replace(tzinfo=pytz.utc),
             }
-            details = fetch_relation(details_rc, report['ReportID'])
-            assert(len(details) <= 1)
-            if len(details) > 0:
-                details = details[0]
+            details = details_rc.first(rid)
+            if details is not None:
                 record.update({
                     'num_injured': details['NumberOfInjured'],
                     'num_dead': details['NumberOfCasualties'],
@@ -196,10 +367,8 @@ class Command(BaseCommand):
                     'num_volunteers': details['NumberOfVolunteersInvolved'],
                     'num_expats_delegates': details['NumberOfExpatsDelegates']
                 })
-            details = fetch_relation(details_gov, report['ReportID'])
-            assert(len(details) <= 1)
-            if len(details) > 0:
-                details = details[0]
+            details = details_gov.first(rid)
+            if details is not None:
                 record.update({
                     'gov_num_injured': details['NumberOfInjured_GOV'],
                     'gov_num_dead': details['NumberOfDead_GOV'],
@@ -208,9 +377,9 @@ class Command(BaseCommand):
                     'gov_num_displaced': details['NumberOfDisplaced_GOV'],
                     'gov_num_assisted': details['NumberOfAssistedByGov_GOV']
                 })
-            info = fetch_relation(info_table, report['ReportID'])
-            if len(info) > 0:
-                info = {k: '' if v is None else v for k, v in info[0].items()}
+            info = info_table.first(rid)
+            if info is not None:
+                info = {k: '' if v is None else v for k, v in info.items()}
                 record.update({
                     'bulletin': {'': 0, 'None': 0, 'Planned': 2, 'Published': 3}[info['InformationBulletin']],
                     'dref': {'': 0, 'No': 0, 'Planned': 2, 'Yes': 3}[info['DREFRequested']],
@@ -219,10 +388,9 @@ class Command(BaseCommand):
                     'appeal_amount': 0 if info['EmergencyAppealAmount'] == '' else float(info['EmergencyAppealAmount']),
                 })
             # disaster response
-            response = fetch_relation(dr_table, report['ReportID'])
-
-            if len(response) > 0:
-                response = {k: '' if v is None else v for k, v in response[0].items()}
+            response = dr_table.first(rid)
+            if response is not None:
+                response = {k: '' if v is None else v for k, v in response.items()}
                 record.update({
                     'rdrt': {'': 0, 'No': 0, 'Yes': 3, 'Planned/Requested': 2}[response['RDRT']],
                     'fact': {'': 0, 'No': 0, 'Yes': 3, 'Planned/Requested': 2}[response['FACT']],
@@ -241,67 +409,29 @@ class Command(BaseCommand):
                 'auto_generated_source': SOURCES['report_ingest'],
             }
             event = Event(**event_record)
-            event.save()
-
-            logger.info('Adding %s' % report_name)
-            field_report.event = event
-            field_report.save()
-            num_reports_created = num_reports_created + 1
 
-            try:
-                country = Country.objects.select_related().get(pk=report['CountryID'])
-            except ObjectDoesNotExist:
+            country = writer.countries.get(report['CountryID'])
+            if country is None:
                 logger.warn('Could not find a matching country for %s' % report['CountryID'])
-                country = None
-
-            if country is not None:
-                field_report.countries.add(country)
-                event.countries.add(country)
-                if country.region is not None:
-                    # No need to add a field report region, as that happens through a trigger.
-                    field_report.regions.add(country.region)
-                    event.regions.add(country.region)
 
             ### add items with foreignkeys to report
-            # national red cross actions
-            actions = fetch_relation(actions_national, report['ReportID'])
-            if len(actions) > 0:
-                txt = ' '.join([a['Value'] for a in actions if a['Value'] is not None])
-                act = ActionsTaken(organization='NTLS', summary=txt, field_report=field_report)
-                act.save()
-                for pk in [a['ActionTakenByRedCrossID'] for a in actions]:
-                    act.actions.add(*Action.objects.filter(pk=pk))
-
-            # foreign red cross actions
-            actions = fetch_relation(actions_foreign, report['ReportID'])
-            if len(actions) > 0:
-                txt = ' '.join([a['Value'] for a in actions if a['Value'] is not None])
-                act = ActionsTaken(organization='PNS', summary=txt, field_report=field_report)
-                act.save()
-                for pk in [a['ActionTakenByRedCrossID'] for a in actions]:
-                    act.actions.add(*Action.objects.filter(pk=pk))
-
-            # federation red cross actions
-            actions = fetch_relation(actions_federation, report['ReportID'])
-            if len(actions) > 0:
-                txt = ' '.join([a['Value'] for a in actions if a['Value'] is not None])
-                act = ActionsTaken(organization='FDRN', summary=txt, field_report=field_report)
-                act.save()
-                for pk in [a['ActionTakenByRedCrossID'] for a in actions]:
-                    act.actions.add(*Action.objects.filter(pk=pk))
+            actions = []
+            for organization, table in (('NTLS', actions_national), ('PNS', actions_foreign), ('FDRN', actions_federation)):
+                rows = table.get(rid)
+                if len(rows) > 0:
+                    txt = ' '.join([a['Value'] for a in rows if a['Value'] is not None])
+                    actions.append((ActionsTaken(organization=organization, summary=txt),
+                                    [a['ActionTakenByRedCrossID'] for a in rows]))
 
             # sources
-            sources = fetch_relation(source_table, report['ReportID'])
-            for s in sources:
+            sources = []
+            for s in source_table.get(rid):
                 spec = '' if s['Specification'] is None else s['Specification']
-                src = Source.objects.create(stype=SourceType.objects.get(pk=s['SourceID']),
-                                            spec=spec, field_report=field_report)
-
-            # disaster response
-            response = fetch_relation(dr_table, report['ReportID'])
+                sources.append(Source(stype_id=s['SourceID'], spec=spec))
 
             # contacts
-            contact = fetch_relation(contacts, report['ReportID'])
+            report_contacts = []
+            contact = contacts.get(rid)
             if len(contact) > 0:
                 # make sure just one contacts record
                 assert(len(contact) == 1)
@@ -309,15 +439,21 @@ class Command(BaseCommand):
                 fields = ['Originator', 'Primary', 'Federation', 'NationalSociety', 'MediaNationalSociety', 'Media']
                 for f in fields:
                     if contact_is_valid(contact, f):
-                        ct = FieldReportContact.objects.create(
+                        report_contacts.append(FieldReportContact(
                             ctype=f,
                             name=contact['%sName' % f],
                             title=contact['%sFunction' % f],
                             email=contact['%sContact' % f],
-                            field_report=field_report,
-                        )
+                        ))
+
+            logger.info('Adding %s' % report_name)
+            writer.add(PendingReport(field_report, event, country, actions, sources, report_contacts))
+        writer.flush()
+        num_reports_created = writer.created
+        logger.info('Wrote %s reports in %.1f s' % (writer.created, writer.elapsed))
         total_reports = FieldReport.objects.all()
         logger.info('%s reports created' % num_reports_created)
+        metrics.inc('goapi_command_records_total', num_reports_created, command='ingest_mdb', action='created')
         logger.info('%s reports in database' % total_reports.count())
 
         # org type mapping
@@ -330,7 +466,7 @@ class Command(BaseCommand):
         last_login_threshold = timezone.now() - timedelta(days=365)
 
         # add users
-        user_records = extract_table(filename, 'DMISUsers')
+        user_records = tables['DMISUsers']
         processed_users = 0
         for i, user_data in enumerate(user_records):
             if user_data['LoginLastSuccess'] == '':
@@ -371,4 +507,4 @@ class Command(BaseCommand):
             user.profile.phone_number = user_data['PhoneNumberProf'] if len(user_data['PhoneNumberProf']) <= 100 else ''
             user.save()
             processed_users = processed_users + 1
-        logger.info('%s updated active user records' % len(processed_users))
+        logger.info('%s updated active user records' % processed_users)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from api.rollups import ROLLUP_SOURCES, rebuild_rollups
+from api.logger import logger
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly time rollups used by the aggregate endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_types', nargs='*', choices=sorted(ROLLUP_SOURCES.keys()),
+                            help='Model types to rebuild, defaults to all of them')
+
+    def handle(self, *args, **options):
+        model_types = options['model_types'] or sorted(ROLLUP_SOURCES.keys())
+        for model_type in model_types:
+            logger.info('Rebuilding %s rollups' % model_type)
+            num_rows = rebuild_rollups(model_type)
+            logger.info('Created %s %s rollup rows' % (num_rows, model_type))
@@ -0,0 +1,55 @@
+# Generated by Django 2.0.5 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_event_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupBuild',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_type', models.CharField(max_length=20, unique=True)),
+                ('built_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TimeRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_type', models.CharField(max_length=20)),
+                ('month', models.DateTimeField()),
+                ('dtype', models.IntegerField(null=True)),
+                ('area_type', models.CharField(max_length=10)),
+                ('area_id', models.IntegerField(null=True)),
+                ('count', models.IntegerField(default=0)),
+                ('num_beneficiaries', models.BigIntegerField(default=0)),
+                ('amount_requested', models.DecimalField(decimal_places=2, default=0.0, max_digits=16)),
+                ('amount_funded', models.DecimalField(decimal_places=2, default=0.0, max_digits=16)),
+                ('num_injured', models.BigIntegerField(default=0)),
+                ('num_dead', models.BigIntegerField(default=0)),
+                ('num_missing', models.BigIntegerField(default=0)),
+                ('num_affected', models.BigIntegerField(default=0)),
+                ('num_displaced', models.BigIntegerField(default=0)),
+                ('num_assisted', models.BigIntegerField(default=0)),
+                ('num_localstaff', models.BigIntegerField(default=0)),
+                ('num_volunteers', models.BigIntegerField(default=0)),
+                ('num_expats_delegates', models.BigIntegerField(default=0)),
+                ('gov_num_injured', models.BigIntegerField(default=0)),
+                ('gov_num_dead', models.BigIntegerField(default=0)),
+                ('gov_num_missing', models.BigIntegerField(default=0)),
+                ('gov_num_affected', models.BigIntegerField(default=0)),
+                ('gov_num_displaced', models.BigIntegerField(default=0)),
+                ('gov_num_assisted', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='timerollup',
+            index_together={('model_type', 'area_type', 'area_id', 'month'), ('model_type', 'month', 'dtype')},
+        ),
+    ]
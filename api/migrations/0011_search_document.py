@@ -0,0 +1,55 @@
+# Generated by Django 2.0.5 on 2026-10-18 18:12
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+# Weighted like a generated column: names rank above bodies
+SEARCH_VECTOR_TRIGGER = '''
+CREATE FUNCTION api_searchdocument_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('pg_catalog.english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('pg_catalog.english', coalesce(NEW.body, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER api_searchdocument_search_vector
+    BEFORE INSERT OR UPDATE OF name, body ON api_searchdocument
+    FOR EACH ROW EXECUTE PROCEDURE api_searchdocument_search_vector();
+
+CREATE INDEX api_searchdocument_search_vector_gin ON api_searchdocument USING gin (search_vector);
+CREATE INDEX api_searchdocument_sort ON api_searchdocument (date DESC NULLS LAST, page_type, record_id);
+'''
+
+DROP_SEARCH_VECTOR_TRIGGER = '''
+DROP INDEX api_searchdocument_sort;
+DROP INDEX api_searchdocument_search_vector_gin;
+DROP TRIGGER api_searchdocument_search_vector ON api_searchdocument;
+DROP FUNCTION api_searchdocument_search_vector();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_index_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('es_id', models.CharField(max_length=40, unique=True)),
+                ('page_type', models.CharField(max_length=20)),
+                ('record_id', models.IntegerField()),
+                ('name', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('date', models.DateTimeField(null=True)),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(editable=False, null=True)),
+            ],
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.5 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appeal',
+            name='source_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
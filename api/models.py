@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 from enumfields import EnumIntegerField
 from enumfields import IntEnum
@@ -65,6 +66,18 @@ class Country(models.Model):
         ordering = ('name',)
         verbose_name_plural = 'Countries'
 
+    def indexing(self):
+        return {
+            'id': self.id,
+            'type': 'country',
+            'name': self.name,
+            'body': '%s %s' % (self.name, self.society_name),
+            'date': None,
+        }
+
+    def es_id(self):
+        return 'country-%s' % self.id
+
     def __str__(self):
         return self.name
 
@@ -81,6 +94,18 @@ class District(models.Model):
     class Meta:
         ordering = ('code',)
 
+    def indexing(self):
+        return {
+            'id': self.id,
+            'type': 'district',
+            'name': self.name,
+            'body': '%s %s' % (self.name, self.country_name),
+            'date': None,
+        }
+
+    def es_id(self):
+        return 'district-%s' % self.id
+
     def __str__(self):
         return '%s - %s' % (self.country_name, self.name)
 
@@ -344,6 +369,9 @@ class Appeal(models.Model):
     country = models.ForeignKey(Country, null=True, on_delete=models.SET_NULL)
     region = models.ForeignKey(Region, null=True, on_delete=models.SET_NULL)
 
+    # Hash of the appeals API record last ingested, to skip unchanged records
+    source_hash = models.CharField(max_length=64, blank=True, editable=False)
+
     # Supplementary fields
     # These aren't included in the ingest, and are
     # entered manually by IFRC staff
@@ -673,4 +701,111 @@ class Profile(models.Model):
         return self.user.username
 
 
+class TimeRollup(models.Model):
+    """ Monthly count and sums of a model's records, per disaster type and area.
+
+    `area_type` is `all` for totals, or `country`/`region` with the area's id.
+    Records linked to several countries count once in each country's rows.
+    """
+
+    model_type = models.CharField(max_length=20)
+    month = models.DateTimeField()
+    dtype = models.IntegerField(null=True)
+    area_type = models.CharField(max_length=10)
+    area_id = models.IntegerField(null=True)
+
+    count = models.IntegerField(default=0)
+
+    # Summable columns of the rolled-up models
+    num_beneficiaries = models.BigIntegerField(default=0)
+    amount_requested = models.DecimalField(max_digits=16, decimal_places=2, default=0.00)
+    amount_funded = models.DecimalField(max_digits=16, decimal_places=2, default=0.00)
+    num_injured = models.BigIntegerField(default=0)
+    num_dead = models.BigIntegerField(default=0)
+    num_missing = models.BigIntegerField(default=0)
+    num_affected = models.BigIntegerField(default=0)
+    num_displaced = models.BigIntegerField(default=0)
+    num_assisted = models.BigIntegerField(default=0)
+    num_localstaff = models.BigIntegerField(default=0)
+    num_volunteers = models.BigIntegerField(default=0)
+    num_expats_delegates = models.BigIntegerField(default=0)
+    gov_num_injured = models.BigIntegerField(default=0)
+    gov_num_dead = models.BigIntegerField(default=0)
+    gov_num_missing = models.BigIntegerField(default=0)
+    gov_num_affected = models.BigIntegerField(default=0)
+    gov_num_displaced = models.BigIntegerField(default=0)
+    gov_num_assisted = models.BigIntegerField(default=0)
+
+    class Meta:
+        index_together = (
+            ('model_type', 'area_type', 'area_id', 'month'),
+            ('model_type', 'month', 'dtype'),
+        )
+
+    def __str__(self):
+        return '%s %s %s %s' % (self.model_type, self.month, self.area_type, self.area_id)
+
+
+class RollupBuild(models.Model):
+    """ When the rollups of a model type were last rebuilt.
+
+    Rollups are only used for a model type once they have been built.
+    """
+
+    model_type = models.CharField(max_length=20, unique=True)
+    built_at = models.DateTimeField()
+
+    def __str__(self):
+        return '%s %s' % (self.model_type, self.built_at)
+
+
+class IndexOutboxEntry(models.Model):
+    """ A record whose search index document is out of date.
+
+    Written in the same transaction as the change to the record, and removed
+    by `drain_index_outbox` once the index has caught up.
+    """
+
+    model_type = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return '%s-%s' % (self.model_type, self.object_id)
+
+
+class CacheGeneration(models.Model):
+    """ Current generation of a model's data, part of response cache keys.
+
+    The token changes whenever a record of the model is saved or deleted.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    token = models.CharField(max_length=32)
+
+    def __str__(self):
+        return '%s %s' % (self.name, self.token)
+
+
+class SearchDocument(models.Model):
+    """ A record's search document, kept in the database for when there is no elasticsearch.
+
+    Holds the same fields as `indexing()`. On Postgres a trigger keeps
+    `search_vector` up to date from the name and body, and a GIN index covers it.
+    """
+
+    es_id = models.CharField(max_length=40, unique=True)
+    page_type = models.CharField(max_length=20)
+    record_id = models.IntegerField()
+    name = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+    date = models.DateTimeField(null=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    def __str__(self):
+        return self.es_id
+
+
 from .triggers import *
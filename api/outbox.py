@@ -0,0 +1,89 @@
+from django.apps import apps
+
+from .indexes import ES_PAGE_NAME
+from .models import IndexOutboxEntry
+
+
+# Model types whose records have search index documents. The type is also
+# the prefix of the document ids, e.g. `event-12`.
+OUTBOX_MODELS = {
+    'event': 'api.Event',
+    'appeal': 'api.Appeal',
+    'fieldreport': 'api.FieldReport',
+    'country': 'api.Country',
+    'district': 'api.District',
+}
+
+
+def model_type_for(model):
+    for model_type, label in OUTBOX_MODELS.items():
+        if model._meta.label == label:
+            return model_type
+    return None
+
+
+def enqueue(model_type, ids):
+    """ Record that the documents of these records need reindexing, or deleting if the records are gone """
+    IndexOutboxEntry.objects.bulk_create(
+        [IndexOutboxEntry(model_type=model_type, object_id=pk) for pk in set(ids)],
+        batch_size=1000,
+    )
+
+
+def indexing_queryset(model_type):
+    """ Records of a model type, with what their `indexing()` reads loaded up front """
+    model = apps.get_model(OUTBOX_MODELS[model_type])
+    if model_type == 'appeal':
+        return model.objects.select_related('country')
+    if model_type in ('event', 'fieldreport'):
+        return model.objects.prefetch_related('countries')
+    return model.objects.all()
+
+
+def es_id(model_type, pk):
+    return '%s-%s' % (model_type, pk)
+
+
+def index_action(record):
+    return {
+        '_op_type': 'index',
+        '_index': ES_PAGE_NAME,
+        '_type': 'page',
+        '_id': record.es_id(),
+        '_source': record.indexing(),
+    }
+
+
+def delete_action(model_type, pk):
+    return {
+        '_op_type': 'delete',
+        '_index': ES_PAGE_NAME,
+        '_type': 'page',
+        '_id': es_id(model_type, pk),
+    }
+
+
+def record_change_on_save(sender, instance, raw=False, **kwargs):
+    model_type = model_type_for(sender)
+    if not raw and model_type is not None:
+        enqueue(model_type, [instance.pk])
+
+
+def record_change_on_delete(sender, instance, **kwargs):
+    model_type = model_type_for(sender)
+    if model_type is not None:
+        enqueue(model_type, [instance.pk])
+
+
+def record_change_on_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # Country changes show up in event and field report documents
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        model_type = model_type_for(type(instance))
+        if model_type is not None:
+            enqueue(model_type, [instance.pk])
+    elif pk_set:
+        model_type = model_type_for(model)
+        if model_type is not None:
+            enqueue(model_type, pk_set)
@@ -0,0 +1,229 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+COUNT_EXACT = 'exact'
+COUNT_APPROXIMATE = 'approximate'
+COUNT_NONE = 'none'
+COUNT_MODES = (COUNT_EXACT, COUNT_APPROXIMATE, COUNT_NONE)
+
+
+def approximate_count(queryset):
+    """ Estimate the number of rows in a queryset without a COUNT(*) scan.
+
+    Unfiltered querysets read the planner's row estimate for the table from
+    `pg_class.reltuples`, filtered querysets use the estimate from EXPLAIN.
+    Falls back to an exact count on other databases or when Postgres has no
+    statistics for the table yet.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    estimate = None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            if row is not None:
+                estimate = row[0]
+        else:
+            sql, params = queryset.values('pk').query.get_compiler(using=queryset.db).as_sql()
+            cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+
+    # Tables that were never analyzed report 0 or -1
+    if estimate is None or estimate <= 0:
+        return queryset.count()
+    return int(estimate)
+
+
+class KeysetPosition(object):
+    """ Position of a row in a keyset ordering, encoded into an opaque cursor """
+
+    def __init__(self, value, pk, reverse=False):
+        self.value = value
+        self.pk = pk
+        self.reverse = reverse
+
+    def encode(self):
+        value = self.value
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        elif value is not None and not isinstance(value, (int, float, str)):
+            value = str(value)
+        data = {'v': value, 'p': self.pk, 'r': 1 if self.reverse else 0}
+        return urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def decode(cls, encoded, field):
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            value = data['v']
+            if value is not None:
+                value = field.to_python(value)
+            return cls(value, int(data['p']), bool(data.get('r')))
+        except (TypeError, ValueError, KeyError, ValidationError, UnicodeError):
+            raise NotFound('Invalid cursor')
+
+
+def keyset_ordering(field, descending, reverse):
+    """ Ordering for walking a keyset forwards, or backwards when `reverse` """
+    # Nulls always sort last when walking forwards, so first when reversed
+    nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+    if descending != reverse:
+        return [F(field.name).desc(**nulls), F('pk').desc()]
+    return [F(field.name).asc(**nulls), F('pk').asc()]
+
+
+def keyset_filter(field, position, descending):
+    """ Rows after `position` in the direction it was taken in """
+    name = field.name
+    op = 'lt' if descending != position.reverse else 'gt'
+    pk_after = Q(**{'pk__%s' % op: position.pk})
+
+    if position.value is None:
+        after = Q(**{'%s__isnull' % name: True}) & pk_after
+        if position.reverse:
+            after |= Q(**{'%s__isnull' % name: False})
+        return after
+
+    after = Q(**{'%s__%s' % (name, op): position.value}) | (Q(**{name: position.value}) & pk_after)
+    if field.null and not position.reverse:
+        after |= Q(**{'%s__isnull' % name: True})
+    return after
+
+
+class LimitOffsetCursorPagination(LimitOffsetPagination):
+    """ Limit/offset pagination with an opt-in keyset (cursor) mode.
+
+    Passing `cursor` (or `pagination=cursor` for the first page) switches to
+    keyset pagination over the view's `cursor_ordering` field with an `id`
+    tiebreak, so deep pages cost the same as the first one.
+    `count=exact|approximate|none` controls how the total is computed;
+    cursor mode skips it unless asked.
+    """
+
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    count_query_param = 'count'
+    default_cursor_ordering = '-id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.use_cursor = (self.cursor_query_param in request.query_params or
+                           request.query_params.get(self.mode_query_param) == 'cursor')
+        self.count_mode = self.get_count_mode(request)
+
+        if self.use_cursor:
+            return self.paginate_keyset(queryset, request, view)
+        if self.count_mode == COUNT_EXACT:
+            return super(LimitOffsetCursorPagination, self).paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.count = approximate_count(queryset) if self.count_mode == COUNT_APPROXIMATE else None
+
+        # Fetch one extra row to know whether there is a next page
+        results = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(results) > self.limit
+        return results[:self.limit]
+
+    def get_count_mode(self, request):
+        default = COUNT_NONE if self.use_cursor else COUNT_EXACT
+        mode = request.query_params.get(self.count_query_param, default)
+        return mode if mode in COUNT_MODES else default
+
+    def get_cursor_ordering(self, view):
+        ordering = getattr(view, 'cursor_ordering', None) or self.default_cursor_ordering
+        descending = ordering.startswith('-')
+        return ordering.lstrip('-'), descending
+
+    def paginate_keyset(self, queryset, request, view):
+        self.limit = self.get_limit(request) or self.default_limit
+        field_name, descending = self.get_cursor_ordering(view)
+        self.field = queryset.model._meta.get_field(field_name)
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        position = KeysetPosition.decode(encoded, self.field) if encoded else None
+        reverse = position is not None and position.reverse
+
+        self.count = None
+        if self.count_mode == COUNT_EXACT:
+            self.count = queryset.count()
+        elif self.count_mode == COUNT_APPROXIMATE:
+            self.count = approximate_count(queryset)
+
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(self.field, position, descending))
+        queryset = queryset.order_by(*keyset_ordering(self.field, descending, reverse))
+
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if reverse:
+            results.reverse()
+
+        # Links point from the first and last rows of this page; a page reached
+        # going backwards always has a next page, and vice versa.
+        self.next_position = None
+        self.previous_position = None
+        if len(results):
+            if has_more or reverse:
+                self.next_position = self.position_of(results[-1], reverse=False)
+            if (has_more and reverse) or (position is not None and not reverse):
+                self.previous_position = self.position_of(results[0], reverse=True)
+        return results
+
+    def position_of(self, instance, reverse):
+        return KeysetPosition(getattr(instance, self.field.attname), instance.pk, reverse)
+
+    def get_next_link(self):
+        if self.use_cursor:
+            return self.get_cursor_link(self.next_position)
+        if self.count_mode == COUNT_EXACT:
+            return super(LimitOffsetCursorPagination, self).get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_previous_link(self):
+        if self.use_cursor:
+            return self.get_cursor_link(self.previous_position)
+        return super(LimitOffsetCursorPagination, self).get_previous_link()
+
+    def get_cursor_link(self, position):
+        if position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.mode_query_param)
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, position.encode())
+
+    def get_paginated_response(self, data):
+        fields = []
+        if self.count is not None:
+            fields.append(('count', self.count))
+        fields += [
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]
+        return Response(OrderedDict(fields))
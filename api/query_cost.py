@@ -0,0 +1,121 @@
+from django.conf import settings
+from graphql.error import GraphQLError
+from graphql.language import ast
+from graphql.type import GraphQLList, GraphQLNonNull
+from graphql.utils.get_operation_ast import get_operation_ast
+
+
+def get_limits():
+    limits = {
+        'MAX_DEPTH': 10,
+        'MAX_COST': 10000,
+        'PAGE_SIZE': 20,
+    }
+    limits.update(getattr(settings, 'GRAPHQL_QUERY_LIMITS', {}))
+    return limits
+
+
+def unwrap(graphql_type):
+    while isinstance(graphql_type, GraphQLNonNull):
+        graphql_type = graphql_type.of_type
+    return graphql_type
+
+
+class QueryCost(object):
+    """ Static depth and cost of a GraphQL operation, measured before it runs.
+
+    Every field costs 1, times the number of parents it is resolved for.
+    Connections multiply their `edges` by `first` or `last`, other lists by
+    an estimated `page_size`, so deep selections through lists add up
+    quickly. Introspection fields are free.
+    """
+
+    def __init__(self, schema, document, operation_name=None, variables=None, page_size=20):
+        self.schema = schema
+        self.document = document
+        self.operation_name = operation_name
+        self.variables = variables or {}
+        self.page_size = page_size
+        self.fragments = {definition.name.value: definition for definition in document.definitions
+                          if isinstance(definition, ast.FragmentDefinition)}
+
+    def measure(self):
+        """ (depth, cost) of the operation, or (0, 0) if there isn't exactly one to run """
+        operation = get_operation_ast(self.document, self.operation_name)
+        if operation is None:
+            return 0, 0
+        if operation.operation == 'mutation':
+            root = self.schema.get_mutation_type()
+        else:
+            root = self.schema.get_query_type()
+        return self.measure_selections(operation.selection_set, root, None)
+
+    def measure_selections(self, selection_set, parent_type, page_size):
+        depth, cost = 0, 0
+        for field, field_type in self.fields(selection_set, parent_type):
+            field_depth, field_cost = self.measure_field(field, field_type, page_size)
+            depth = max(depth, field_depth)
+            cost += field_cost
+        return depth, cost
+
+    def fields(self, selection_set, parent_type):
+        """ The fields of a selection set with their definitions, through fragments """
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                name = selection.name.value
+                if name.startswith('__') or not hasattr(parent_type, 'fields'):
+                    continue
+                definition = parent_type.fields.get(name)
+                if definition is not None:
+                    yield selection, definition
+            else:
+                if isinstance(selection, ast.FragmentSpread):
+                    fragment = self.fragments.get(selection.name.value)
+                    if fragment is None:
+                        continue
+                else:
+                    fragment = selection
+                fragment_type = parent_type
+                if fragment.type_condition is not None:
+                    fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+                for field in self.fields(fragment.selection_set, fragment_type):
+                    yield field
+
+    def measure_field(self, field, definition, page_size):
+        field_type = unwrap(definition.type)
+        size = 1
+        if isinstance(field_type, GraphQLList):
+            size = page_size if field.name.value == 'edges' and page_size else self.page_size
+            field_type = unwrap(field_type.of_type)
+
+        if field.selection_set is None:
+            return 1, 1
+        child_depth, child_cost = self.measure_selections(field.selection_set, field_type, self.requested_page_size(field))
+        return child_depth + 1, 1 + size * child_cost
+
+    def requested_page_size(self, field):
+        """ `first` or `last` of a connection field """
+        for argument in field.arguments or []:
+            if argument.name.value not in ('first', 'last'):
+                continue
+            value = argument.value
+            if isinstance(value, ast.Variable):
+                value = self.variables.get(value.name.value)
+            elif isinstance(value, ast.IntValue):
+                value = value.value
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return None
+        return None
+
+
+def check_query_cost(schema, document, operation_name=None, variables=None):
+    """ Raise a GraphQLError if the operation is deeper or costlier than allowed """
+    limits = get_limits()
+    depth, cost = QueryCost(schema, document, operation_name, variables, limits['PAGE_SIZE']).measure()
+    if depth > limits['MAX_DEPTH']:
+        raise GraphQLError('Query depth of %s exceeds the maximum of %s' % (depth, limits['MAX_DEPTH']))
+    if cost > limits['MAX_COST']:
+        raise GraphQLError('Query cost of %s exceeds the maximum of %s' % (cost, limits['MAX_COST']))
+    return depth, cost
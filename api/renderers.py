@@ -0,0 +1,28 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def ndjson_line(data):
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+
+class NDJSONRenderer(BaseRenderer):
+    """ Newline-delimited JSON, one object per line.
+
+    Paginated responses render just their `results`.
+    """
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and 'results' in data:
+            data = data['results']
+        if not isinstance(data, list):
+            data = [data]
+        return ''.join(ndjson_line(item) for item in data).encode(self.charset)
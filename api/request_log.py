@@ -0,0 +1,105 @@
+import json
+import logging
+import random
+import re
+import time
+
+from django.conf import settings
+
+request_logger = logging.getLogger('api.requests')
+
+REDACTED = '[redacted]'
+
+
+def get_request_log_settings():
+    options = {
+        'SAMPLE_RATE': 0.0,
+        'MAX_VALUE_LENGTH': 256,
+        'MAX_BODY_LENGTH': 2048,
+        # Headers, query parameters and JSON keys with any of these words in
+        # their names, e.g. `api_key`, `X-Api-Key` or `apiKey`, are redacted
+        'REDACT': ('password', 'token', 'key', 'secret', 'authorization', 'cookie',
+                   'csrftoken', 'csrfmiddlewaretoken'),
+    }
+    options.update(getattr(settings, 'REQUEST_LOG', {}))
+    return options
+
+
+def name_words(name):
+    """ The lowercase words of a name split at `-`, `_`, digits and camelCase """
+    return [word.lower() for word in re.findall(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+', name)]
+
+
+def is_sensitive(name, options):
+    # Whole words only, so `keyword` isn't taken for a `key`
+    return any(word in options['REDACT'] for word in name_words(name))
+
+
+def truncate(value, length):
+    value = str(value)
+    return value if len(value) <= length else value[:length] + '...'
+
+
+def redact(data, options):
+    """ A copy of decoded JSON with sensitive keys redacted and long strings cut """
+    if isinstance(data, dict):
+        return {key: REDACTED if is_sensitive(key, options) else redact(value, options)
+                for key, value in data.items()}
+    if isinstance(data, list):
+        return [redact(value, options) for value in data]
+    if isinstance(data, str):
+        return truncate(data, options['MAX_VALUE_LENGTH'])
+    return data
+
+
+def request_headers(request, options):
+    headers = {}
+    for header, value in request.META.items():
+        if not header.startswith('HTTP_'):
+            continue
+        name = header[5:].lower().replace('_', '-')
+        headers[name] = REDACTED if is_sensitive(name, options) else truncate(value, options['MAX_VALUE_LENGTH'])
+    return headers
+
+
+def request_body(request, options):
+    length = request.META.get('CONTENT_LENGTH')
+    if not length or length == '0':
+        return None
+    if 'application/json' not in request.META.get('CONTENT_TYPE', ''):
+        # Only bodies we can redact are logged
+        return '[%s bytes]' % length
+    try:
+        body = redact(json.loads(request.body.decode('utf-8')), options)
+    except ValueError:
+        return '[%s bytes, not JSON]' % len(request.body)
+    return truncate(json.dumps(body), options['MAX_BODY_LENGTH'])
+
+
+def log_request(request, response, started):
+    """ Log a sampled share of requests as one JSON object each """
+    options = get_request_log_settings()
+    if options['SAMPLE_RATE'] <= 0 or random.random() >= options['SAMPLE_RATE']:
+        return
+
+    entry = {
+        'method': request.method,
+        'path': request.path,
+        'query': {name: REDACTED if is_sensitive(name, options) else truncate(value, options['MAX_VALUE_LENGTH'])
+                  for name, value in request.GET.items()},
+        'status': response.status_code,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+        'headers': request_headers(request, options),
+        'body': request_body(request, options),
+    }
+    request_logger.info(json.dumps(entry, sort_keys=True))
+
+
+class RequestLogMixin(object):
+    """ Log a sampled share of a view's requests, with `REQUEST_LOG` settings """
+
+    def dispatch(self, request, *args, **kwargs):
+        started = time.perf_counter()
+        response = super().dispatch(request, *args, **kwargs)
+        log_request(request, response, started)
+        return response
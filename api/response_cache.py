@@ -0,0 +1,177 @@
+import threading
+from collections import OrderedDict
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.http import urlencode
+
+from .models import CacheGeneration
+
+
+class LocalBackend(object):
+    """ In-process LRU cache of responses.
+
+    Generation tokens live in the database, so that saves made by other
+    processes, like the ingest cron jobs, invalidate this process's entries.
+    Other connections only see a token once it commits, so it's only bumped
+    then; bumping it earlier would just lock its row until the commit.
+    """
+
+    bump_before_commit = False
+
+    def __init__(self, max_entries=512, **kwargs):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_generations(self, names):
+        tokens = dict(CacheGeneration.objects.filter(name__in=names).values_list('name', 'token'))
+        return [tokens.get(name, '0') for name in names]
+
+    def bump_generation(self, name):
+        token = uuid4().hex
+        updated = CacheGeneration.objects.filter(name=name).update(token=token)
+        if not updated:
+            CacheGeneration.objects.get_or_create(name=name, defaults={'token': token})
+
+
+class RedisBackend(object):
+    """ Responses and generation tokens in Redis, shared by every worker.
+
+    Works with any client exposing `get`, `set(key, value, ex=...)` and `mget`.
+    """
+
+    prefix = 'go-api:response-cache'
+    bump_before_commit = True
+
+    def __init__(self, client=None, url=None, timeout=None, **kwargs):
+        if client is None:
+            import redis
+            client = redis.StrictRedis.from_url(url)
+        self.client = client
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.client.get('%s:entry:%s' % (self.prefix, key))
+
+    def set(self, key, value):
+        self.client.set('%s:entry:%s' % (self.prefix, key), value, ex=self.timeout)
+
+    def clear(self):
+        # Entries expire on their own; forgetting the generations orphans them
+        pass
+
+    def get_generations(self, names):
+        tokens = self.client.mget(['%s:generation:%s' % (self.prefix, name) for name in names])
+        return [token.decode('utf-8') if isinstance(token, bytes) else (token or '0') for token in tokens]
+
+    def bump_generation(self, name):
+        self.client.set('%s:generation:%s' % (self.prefix, name), uuid4().hex)
+
+
+class NoBackend(object):
+    """ Never caches """
+
+    bump_before_commit = False
+
+    def __init__(self, **kwargs):
+        pass
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+    def get_generations(self, names):
+        return ['0' for name in names]
+
+    def bump_generation(self, name):
+        pass
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'redis': RedisBackend,
+    'none': NoBackend,
+}
+
+_backend = None
+_backend_config = None
+
+
+def get_backend():
+    """ The configured backend, rebuilt if `RESPONSE_CACHE` settings change """
+    global _backend, _backend_config
+    config = getattr(settings, 'RESPONSE_CACHE', {})
+    if _backend is None or _backend_config is not config:
+        options = {
+            'max_entries': config.get('MAX_ENTRIES', 512),
+            'url': config.get('REDIS_URL'),
+            'timeout': config.get('TIMEOUT'),
+            'client': config.get('CLIENT'),
+        }
+        _backend = BACKENDS[config.get('BACKEND', 'local')](**options)
+        _backend_config = config
+    return _backend
+
+
+def normalize_query(query_dict):
+    """ A canonical query string, so parameter order doesn't split the cache """
+    items = []
+    for key in sorted(query_dict.keys()):
+        for value in query_dict.getlist(key):
+            items.append((key, value))
+    return urlencode(items)
+
+
+def cache_key(name, query_dict, dependencies):
+    generations = get_backend().get_generations(list(dependencies))
+    return '%s?%s#%s' % (name, normalize_query(query_dict), '.'.join(generations))
+
+
+def bump_generation(name):
+    """ Invalidate every cached response that depends on `name`.
+
+    Inside a transaction the token changes once it commits, so a response
+    computed from pre-commit data can't outlive the commit. Backends whose
+    tokens other processes see right away also change it immediately.
+    """
+    backend = get_backend()
+    if not transaction.get_connection().in_atomic_block:
+        backend.bump_generation(name)
+        return
+    if backend.bump_before_commit:
+        backend.bump_generation(name)
+    transaction.on_commit(lambda: backend.bump_generation(name))
+
+
+def bump_generation_on_change(sender, **kwargs):
+    bump_generation(sender._meta.label)
+
+
+def bump_generation_on_m2m_change(sender, instance, action, reverse, model, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_generation(model._meta.label if reverse else type(instance)._meta.label)
@@ -0,0 +1,209 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth, TruncYear
+from django.utils import timezone
+
+from .models import TimeRollup, RollupBuild
+from .response_cache import bump_generation
+
+
+class RollupSource(object):
+    """ How a model's records are bucketed into monthly rollups """
+
+    def __init__(self, model_type, model_label, date_field, country_field, region_field, sum_fields):
+        self.model_type = model_type
+        self.model_label = model_label
+        self.date_field = date_field
+        self.area_fields = (('country', country_field), ('region', region_field))
+        self.sum_fields = sum_fields
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def key(self, month, dtype):
+        return (self.model_type, month, dtype)
+
+    def instance_key(self, instance):
+        return self.key(month_start(getattr(instance, self.date_field)), instance.dtype_id)
+
+    def compute(self, queryset):
+        """ Aggregate a queryset into unsaved rollup rows """
+        queryset = queryset.filter(**{'%s__isnull' % self.date_field: False}) \
+                           .annotate(rollup_month=TruncMonth(self.date_field, tzinfo=timezone.utc))
+        annotations = {'rollup_count': Count('id')}
+        for field in self.sum_fields:
+            annotations['rollup_%s' % field] = Sum(field)
+
+        rows = []
+        for area_type, area_field in (('all', None),) + self.area_fields:
+            values = ['rollup_month', 'dtype']
+            grouped = queryset
+            if area_field is not None:
+                values.append(area_field)
+                grouped = grouped.filter(**{'%s__isnull' % area_field: False})
+            # Clear the model's default ordering, which would end up in the GROUP BY
+            grouped = grouped.order_by().values(*values).annotate(**annotations)
+            for group in grouped:
+                rollup = TimeRollup(
+                    model_type=self.model_type,
+                    month=group['rollup_month'],
+                    dtype=group['dtype'],
+                    area_type=area_type,
+                    area_id=group[area_field] if area_field is not None else None,
+                    count=group['rollup_count'],
+                )
+                for field in self.sum_fields:
+                    setattr(rollup, field, group['rollup_%s' % field] or 0)
+                rows.append(rollup)
+        return rows
+
+
+ROLLUP_SOURCES = {
+    'appeal': RollupSource('appeal', 'api.Appeal', 'start_date', 'country', 'region',
+                           ('num_beneficiaries', 'amount_requested', 'amount_funded',)),
+    'event': RollupSource('event', 'api.Event', 'disaster_start_date', 'countries', 'regions',
+                          ('num_affected',)),
+    'fieldreport': RollupSource('fieldreport', 'api.FieldReport', 'created_at', 'countries', 'regions',
+                                ('num_injured', 'num_dead', 'num_missing', 'num_affected', 'num_displaced',
+                                 'num_assisted', 'num_localstaff', 'num_volunteers', 'num_expats_delegates',
+                                 'gov_num_injured', 'gov_num_dead', 'gov_num_missing', 'gov_num_affected',
+                                 'gov_num_displaced', 'gov_num_assisted',)),
+    'heop': RollupSource('heop', 'deployments.Heop', 'start_date', 'country', 'region', ()),
+}
+
+
+def month_start(date):
+    if date is None:
+        return None
+    return date.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def source_for_model(model):
+    for source in ROLLUP_SOURCES.values():
+        if source.model_label == model._meta.label:
+            return source
+    return None
+
+
+def refresh_rollups(keys):
+    """ Recompute the rollup rows for a set of (model type, month, dtype) keys """
+    for model_type, month, dtype in set(keys):
+        if month is None:
+            continue
+        source = ROLLUP_SOURCES[model_type]
+        queryset = source.model.objects.filter(**{
+            '%s__gte' % source.date_field: month,
+            '%s__lt' % source.date_field: next_month(month),
+        })
+        if dtype is None:
+            queryset = queryset.filter(dtype__isnull=True)
+        else:
+            queryset = queryset.filter(dtype=dtype)
+        with transaction.atomic():
+            TimeRollup.objects.filter(model_type=model_type, month=month, dtype=dtype).delete()
+            TimeRollup.objects.bulk_create(source.compute(queryset))
+
+
+def rebuild_rollups(model_type):
+    """ Recompute every rollup row for a model type """
+    source = ROLLUP_SOURCES[model_type]
+    with transaction.atomic():
+        TimeRollup.objects.filter(model_type=model_type).delete()
+        rows = source.compute(source.model.objects.all())
+        TimeRollup.objects.bulk_create(rows, batch_size=1000)
+        RollupBuild.objects.update_or_create(model_type=model_type, defaults={'built_at': timezone.now()})
+        bump_generation(source.model_label)
+    return len(rows)
+
+
+def aggregate_from_rollups(model_type, unit, start_date, area_type=None, area_id=None, dtype=None, sums=None):
+    """ Answer a time aggregate from the rollups.
+
+    Returns None if the request can't be answered from them: the model type
+    has no rollups yet, the start date doesn't fall on a month boundary, or a
+    requested sum isn't rolled up.
+    """
+    source = ROLLUP_SOURCES.get(model_type)
+    sums = sums or {}
+    if source is None:
+        return None
+    if start_date != month_start(start_date):
+        return None
+    if any(column not in source.sum_fields for column in sums.values()):
+        return None
+    if not RollupBuild.objects.filter(model_type=model_type).exists():
+        return None
+
+    rollups = TimeRollup.objects.filter(model_type=model_type, month__gte=start_date)
+    if area_type is None:
+        rollups = rollups.filter(area_type='all')
+    else:
+        rollups = rollups.filter(area_type=area_type, area_id=area_id)
+    if dtype is not None:
+        rollups = rollups.filter(dtype=dtype)
+
+    trunc_method = TruncMonth if unit == 'month' else TruncYear
+    annotations = {'rollup_count': Sum('count')}
+    for alias, column in sums.items():
+        annotations['rollup_%s' % alias] = Sum(column)
+    rows = rollups.annotate(timespan=trunc_method('month', tzinfo=timezone.utc)) \
+                  .values('timespan') \
+                  .annotate(**annotations) \
+                  .order_by('timespan')
+
+    aggregate = []
+    for row in rows:
+        entry = {'timespan': row['timespan'], 'count': row['rollup_count']}
+        for alias in sums:
+            entry[alias] = row['rollup_%s' % alias]
+        aggregate.append(entry)
+    return aggregate
+
+
+def rollup_keys_before_save(sender, instance, raw=False, **kwargs):
+    # Remember which bucket the record was in, in case the save moves it
+    source = source_for_model(sender)
+    if raw or source is None or instance.pk is None:
+        return
+    old = sender.objects.filter(pk=instance.pk).values(source.date_field, 'dtype').first()
+    if old is not None:
+        instance._rollup_previous_key = source.key(month_start(old[source.date_field]), old['dtype'])
+
+
+def update_rollups_after_save(sender, instance, raw=False, **kwargs):
+    source = source_for_model(sender)
+    if raw or source is None:
+        return
+    keys = [source.instance_key(instance)]
+    previous = getattr(instance, '_rollup_previous_key', None)
+    if previous is not None:
+        keys.append(previous)
+    refresh_rollups(keys)
+
+
+def update_rollups_after_delete(sender, instance, **kwargs):
+    source = source_for_model(sender)
+    if source is not None:
+        refresh_rollups([source.instance_key(instance)])
+
+
+def update_rollups_after_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        source = source_for_model(type(instance))
+        if source is not None:
+            refresh_rollups([source.instance_key(instance)])
+    elif pk_set:
+        # The records are on the other side, e.g. `country.event_set.add(event)`
+        source = source_for_model(model)
+        if source is not None:
+            refresh_rollups([source.instance_key(record) for record in model.objects.filter(pk__in=pk_set)])
@@ -1,57 +1,187 @@
+from functools import partial
+
 import graphene
+from graphene import relay
+from graphene_django.filter.utils import get_filtering_args_from_filterset
+from graphene_django.settings import graphene_settings
 from graphene_django.types import DjangoObjectType
+from graphql.error import GraphQLError
+from rest_framework.exceptions import NotFound
+from .dataloaders import batched_resolvers, only_selected
+from .drf_views import AppealFilter, EventFilter, FieldReportFilter
 from .models import Country, DisasterType, Country, ActionsTaken, Event, Appeal, FieldReport
+from .pagination import KeysetPosition, keyset_filter, keyset_ordering
+from .query_cost import get_limits
+
+
+class BatchedObjectType(DjangoObjectType):
+    """ Resolves foreign keys and many-to-many or reverse relations through
+    the request's DataLoaders, so nested selections cost one query per
+    relation rather than one per row.
+    """
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def __init_subclass_with_meta__(cls, **options):
+        super(BatchedObjectType, cls).__init_subclass_with_meta__(**options)
+        for name, resolver in batched_resolvers(cls._meta.model, cls._meta.fields).items():
+            if not hasattr(cls, 'resolve_%s' % name):
+                setattr(cls, 'resolve_%s' % name, resolver)
+
 
 # GraphQL Schemas
-class CountryObjectType(DjangoObjectType):
+class CountryObjectType(BatchedObjectType):
     class Meta:
         model = Country
 
 
-class DisasterObjectType(DjangoObjectType):
+class DisasterObjectType(BatchedObjectType):
     class Meta:
         model = DisasterType
 
 
-class EventType(DjangoObjectType):
+class EventType(BatchedObjectType):
     class Meta:
         model = Event
 
 
-class ActionsTakenType(DjangoObjectType):
+class ActionsTakenType(BatchedObjectType):
     class Meta:
         model = ActionsTaken
 
 
-class AppealType(DjangoObjectType):
+class AppealType(BatchedObjectType):
     class Meta:
         model = Appeal
 
 
-class FieldReportType(DjangoObjectType):
+class FieldReportType(BatchedObjectType):
     class Meta:
         model = FieldReport
 
 
+class EventConnection(relay.Connection):
+    class Meta:
+        node = EventType
+
+
+class AppealConnection(relay.Connection):
+    class Meta:
+        node = AppealType
+
+
+class FieldReportConnection(relay.Connection):
+    class Meta:
+        node = FieldReportType
+
+
+class KeysetConnectionField(relay.ConnectionField):
+    """ A connection over a queryset, filtered with a django-filter FilterSet and
+    paginated by keyset on `ordering`, like the v2 list endpoints' cursors.
+    """
+
+    def __init__(self, connection_type, filterset_class, ordering, **kwargs):
+        self.filterset_class = filterset_class
+        self.ordering = ordering
+        kwargs.update(get_filtering_args_from_filterset(filterset_class, connection_type._meta.node))
+        super(KeysetConnectionField, self).__init__(connection_type, **kwargs)
+
+    def get_resolver(self, parent_resolver):
+        resolver = super(relay.ConnectionField, self).get_resolver(parent_resolver)
+        return partial(self.resolve_page, resolver)
+
+    def resolve_page(self, resolver, root, info, **args):
+        queryset = resolver(root, info, **args)
+        queryset = self.filterset_class(data=args, queryset=queryset).qs
+        return self.paginate(queryset, args)
+
+    def paginate(self, queryset, args):
+        first, last = args.get('first'), args.get('last')
+        max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        for name, value in (('first', first), ('last', last)):
+            if value is not None and not 0 <= value <= max_limit:
+                raise GraphQLError('`%s` must be between 0 and %s' % (name, max_limit))
+
+        # `last` without `first` walks backwards from `before`
+        reverse = first is None and last is not None
+        limit = last if reverse else first
+        if limit is None:
+            limit = get_limits()['PAGE_SIZE']
+        cursor = args.get('before') if reverse else args.get('after')
+
+        field = queryset.model._meta.get_field(self.ordering.lstrip('-'))
+        descending = self.ordering.startswith('-')
+        if cursor:
+            try:
+                position = KeysetPosition.decode(cursor, field)
+            except NotFound:
+                raise GraphQLError('Invalid cursor')
+            position.reverse = reverse
+            queryset = queryset.filter(keyset_filter(field, position, descending))
+        queryset = queryset.order_by(*keyset_ordering(field, descending, reverse))
+
+        rows = list(queryset[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if reverse:
+            rows.reverse()
+
+        connection_type = self.type
+        edges = [connection_type.Edge(node=row, cursor=KeysetPosition(getattr(row, field.attname), row.pk).encode())
+                 for row in rows]
+        page_info = relay.PageInfo(
+            start_cursor=edges[0].cursor if len(edges) else None,
+            end_cursor=edges[-1].cursor if len(edges) else None,
+            has_previous_page=has_more if reverse else bool(cursor),
+            has_next_page=bool(cursor) if reverse else has_more,
+        )
+        return connection_type(edges=edges, page_info=page_info)
+
+
+def visible_field_reports(info):
+    # Same as the v2 endpoint: anonymous users only see public reports
+    user = getattr(info.context, 'user', None)
+    if user is not None and user.is_authenticated:
+        return FieldReport.objects.all()
+    return FieldReport.objects.filter(visibility=3)
+
+
 class Query(graphene.ObjectType):
+    events = KeysetConnectionField(EventConnection, EventFilter, '-disaster_start_date')
+    appeals = KeysetConnectionField(AppealConnection, AppealFilter, '-start_date')
+    field_reports = KeysetConnectionField(FieldReportConnection, FieldReportFilter, '-created_at')
+
     all_countries = graphene.List(CountryObjectType)
     all_disasters_types = graphene.List(DisasterObjectType)
-    all_events = graphene.List(EventType)
-    all_events = graphene.List(EventType)
-    all_appeals = graphene.List(AppealType)
-    all_fieldreports = graphene.List(FieldReportType)
+    all_events = graphene.List(EventType, deprecation_reason='Use `events`, which is paginated.')
+    all_appeals = graphene.List(AppealType, deprecation_reason='Use `appeals`, which is paginated.')
+    all_fieldreports = graphene.List(FieldReportType, deprecation_reason='Use `fieldReports`, which is paginated.')
+
+    def resolve_events(self, info, **kwargs):
+        return Event.objects.all()
+
+    def resolve_appeals(self, info, **kwargs):
+        return Appeal.objects.all()
+
+    def resolve_field_reports(self, info, **kwargs):
+        return visible_field_reports(info)
+
+    def resolve_all_countries(self, info, **kwargs):
+        return only_selected(Country.objects.all(), info)
 
-    def resolve_all_disasters(self, info, **kwargs):
-        return DisasterType.objects.all()
+    def resolve_all_disasters_types(self, info, **kwargs):
+        return only_selected(DisasterType.objects.all(), info)
 
+    # The unpaginated lists are capped at the connections' maximum page size
     def resolve_all_events(self, info, **kwargs):
-        return Event.objects.select_related('dtype').all()
+        return only_selected(Event.objects.all(), info)[:graphene_settings.RELAY_CONNECTION_MAX_LIMIT]
 
     def resolve_all_appeals(self, info, **kwargs):
-        return Appeal.objects.select_related('event').select_related('country').all()
+        return only_selected(Appeal.objects.all(), info)[:graphene_settings.RELAY_CONNECTION_MAX_LIMIT]
 
     def resolve_all_fieldreports(self, info, **kwargs):
-        return FieldReport.objects.select_related('dtype').select_related('event').all()
+        return only_selected(visible_field_reports(info), info)[:graphene_settings.RELAY_CONNECTION_MAX_LIMIT]
 
 
 schema = graphene.Schema(query=Query)
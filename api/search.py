@@ -0,0 +1,244 @@
+import json
+import threading
+import time
+from collections import defaultdict, OrderedDict
+
+from rest_framework.request import Request
+
+from .drf_views import EventViewset, AppealViewset, FieldReportViewset, CountryViewset, DistrictViewset
+from .indexes import GenericMapping
+
+# Fields a search can ask for with `fields`
+SEARCH_FIELDS = tuple(GenericMapping['properties'])
+
+DEFAULT_SIZE = 10
+MAX_SIZE = 100
+# Elasticsearch's default `index.max_result_window`; page further with `search_after`
+MAX_WINDOW = 10000
+
+# Date first, then a unique tiebreaker so `search_after` never skips a hit
+SORT = [
+    {'date': {'order': 'desc'}},
+    {'type': {'order': 'asc'}},
+    {'id': {'order': 'asc'}},
+]
+
+# Viewsets whose list serializers render hydrated hits, by es id prefix
+SEARCH_VIEWSETS = {
+    'event': EventViewset,
+    'appeal': AppealViewset,
+    'fieldreport': FieldReportViewset,
+    'country': CountryViewset,
+    'district': DistrictViewset,
+}
+
+SUGGEST_SIZE = 5
+SUGGEST_MAX_SIZE = 20
+
+
+def parse_int(params, name, default, minimum, maximum):
+    value = params.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError('`%s` must be a number' % name)
+    if not minimum <= value <= maximum:
+        raise ValueError('`%s` must be between %s and %s' % (name, minimum, maximum))
+    return value
+
+
+def is_true(value):
+    return value is not None and value.lower() in ('1', 'true', 'yes')
+
+
+def parse_search(params):
+    """ Options of a search from its query parameters.
+    Raises ValueError with a message for the client if they don't make sense.
+    """
+    keyword = params.get('keyword')
+    if keyword is None:
+        raise ValueError('Must include a `keyword`')
+    options = {
+        'keyword': keyword,
+        'type': params.get('type'),
+        'size': parse_int(params, 'size', DEFAULT_SIZE, 1, MAX_SIZE),
+        'from': 0,
+        'search_after': None,
+        'fields': None,
+        'highlight': is_true(params.get('highlight')),
+    }
+
+    search_after = params.get('search_after')
+    if search_after is not None:
+        if params.get('from'):
+            raise ValueError('Use either `from` or `search_after`')
+        try:
+            search_after = json.loads(search_after)
+        except ValueError:
+            search_after = None
+        if not isinstance(search_after, list) or len(search_after) != len(SORT):
+            raise ValueError('`search_after` must be the `next` value of a previous page')
+        options['search_after'] = search_after
+    else:
+        options['from'] = parse_int(params, 'from', 0, 0, MAX_WINDOW - options['size'])
+
+    fields = params.get('fields')
+    if fields:
+        fields = fields.split(',')
+        unknown = [field for field in fields if field not in SEARCH_FIELDS]
+        if len(unknown):
+            raise ValueError('Unknown `fields`: %s' % ', '.join(unknown))
+        options['fields'] = fields
+    return options
+
+
+def search_body(options):
+    """ The elasticsearch request body for a search """
+    query = {
+        'match': {
+            'body': {
+                'query': options['keyword'],
+                'fuzziness': 0
+            }
+        }
+    }
+    if options['type'] is not None:
+        query = {
+            'bool': {
+                'filter': {
+                    'term': {'type': options['type']}
+                },
+                'must': query,
+            }
+        }
+
+    body = {'query': query, 'sort': SORT, 'size': options['size']}
+    if options['search_after'] is not None:
+        body['search_after'] = options['search_after']
+    else:
+        body['from'] = options['from']
+    if options['fields'] is not None:
+        body['_source'] = options['fields']
+    if options['highlight']:
+        body['highlight'] = {
+            'fields': {'name': {}, 'body': {}},
+        }
+    return body
+
+
+def next_page(hits, size):
+    """ `search_after` for the page after these hits, if there may be one """
+    if len(hits) < size:
+        return None
+    return json.dumps(hits[-1]['sort'])
+
+
+def hydrate_hits(request, hits):
+    """ Attach each hit's record as `record`, rendered like its v2 list endpoint.
+
+    Records are fetched with one query per type, through the viewset so its
+    eager loading and visibility rules apply; hits whose record is gone or
+    not visible to the user get `None`. Raises AuthenticationFailed for
+    invalid tokens.
+    """
+    ids_by_type = defaultdict(set)
+    for hit in hits:
+        model_type, _, pk = hit['_id'].rpartition('-')
+        if model_type in SEARCH_VIEWSETS and pk.isdigit():
+            ids_by_type[model_type].add(int(pk))
+
+    records = {}
+    for model_type, ids in ids_by_type.items():
+        view = SEARCH_VIEWSETS[model_type](action='list', format_kwarg=None)
+        # Authenticate the client as the viewset's own endpoint would, so it sees the same records
+        view.request = Request(request, authenticators=view.get_authenticators())
+        queryset = view.get_queryset()
+        plan = view.get_eager_load_plan()
+        if plan is not None:
+            queryset = plan.apply(queryset)
+        rows = list(queryset.filter(pk__in=ids))
+        for row, data in zip(rows, view.get_serializer(rows, many=True).data):
+            export_row = getattr(view, 'export_row', None)
+            records[row.es_id()] = export_row(data) if export_row else data
+
+    for hit in hits:
+        hit['record'] = records.get(hit['_id'])
+    return hits
+
+
+def parse_suggest(params):
+    prefix = (params.get('q') or '').strip()
+    if not prefix:
+        raise ValueError('Must include a `q`')
+    types = params.get('type')
+    return {
+        # Names are lowercased when indexed, so the cache can ignore case too
+        'prefix': prefix.lower(),
+        'types': types.split(',') if types else None,
+        'size': parse_int(params, 'size', SUGGEST_SIZE, 1, SUGGEST_MAX_SIZE),
+    }
+
+
+def suggest_body(options):
+    """ The elasticsearch request body for the names starting with a prefix """
+    query = {
+        'bool': {
+            'must': {
+                'match': {
+                    'name.suggest': {
+                        'query': options['prefix'],
+                        'operator': 'and',
+                    }
+                }
+            },
+        }
+    }
+    if options['types'] is not None:
+        query['bool']['filter'] = {'terms': {'type': options['types']}}
+    return {
+        'query': query,
+        'size': options['size'],
+        '_source': ['id', 'type', 'name'],
+    }
+
+
+class SuggestionCache(object):
+    """ Small per-process LRU of suggestions for the hottest prefixes.
+
+    Entries expire after `timeout` seconds, as often as `drain_index_outbox`
+    runs, so new and renamed records show up within a couple of minutes.
+    """
+
+    def __init__(self, max_entries=256, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+suggestion_cache = SuggestionCache()
@@ -0,0 +1,189 @@
+import json
+from functools import reduce
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, transaction
+from django.db.models import F, Func, Q, TextField
+from django.utils.dateparse import parse_datetime
+
+from .esconnection import ES_CLIENT, ES_BREAKER
+from .indexes import ES_PAGE_NAME
+from .models import SearchDocument
+from .outbox import OUTBOX_MODELS, indexing_queryset
+from .search import search_body, suggest_body
+from .utils import iterate_in_chunks
+from main.profiling import timed
+
+SEARCH_CONFIG = 'english'
+
+
+class ElasticsearchBackend(object):
+    """ Searches the `page_all` index, through the circuit breaker.
+    Raises SearchUnavailable when elasticsearch can't answer.
+    """
+    name = 'elasticsearch'
+
+    def __init__(self, client, breaker=ES_BREAKER):
+        self.client = client
+        self.breaker = breaker
+
+    def search(self, options):
+        with timed('es'):
+            results = self.breaker.call(
+                self.client.search,
+                index=ES_PAGE_NAME,
+                doc_type='page',
+                body=json.dumps(search_body(options)),
+            )
+        return results['hits']
+
+    def suggest(self, options):
+        # Only the sources come back, to keep the response small
+        with timed('es'):
+            results = self.breaker.call(
+                self.client.search,
+                index=ES_PAGE_NAME,
+                doc_type='page',
+                body=json.dumps(suggest_body(options)),
+                filter_path='hits.hits._source',
+                request_cache='true',
+            )
+        return [hit['_source'] for hit in results.get('hits', {}).get('hits', [])]
+
+
+class Headline(Func):
+    """ Postgres `ts_headline`, marking matches like elasticsearch highlights """
+    function = 'ts_headline'
+    template = "%(function)s('" + SEARCH_CONFIG + "'::regconfig, %(expressions)s, 'StartSel=<em>, StopSel=</em>')"
+    output_field = TextField()
+
+
+class DatabaseBackend(object):
+    """ Searches `SearchDocument` rows with Postgres full-text search.
+
+    Results have the shape of elasticsearch hits, in the same order. The
+    `search_after` values it hands out are its own, and only good for this
+    backend. On other databases keywords are matched with `icontains`,
+    which is only meant for tests and local setups.
+    """
+    name = 'database'
+
+    def full_text(self):
+        return connection.vendor == 'postgresql'
+
+    def keyword_query(self, keyword):
+        # Like the elasticsearch `match` query, any of the words can match
+        words = keyword.split()
+        if not len(words):
+            return None
+        return reduce(lambda a, b: a | b, [SearchQuery(word, config=SEARCH_CONFIG) for word in words])
+
+    def search(self, options):
+        queryset = SearchDocument.objects.all()
+        if options['type'] is not None:
+            queryset = queryset.filter(page_type=options['type'])
+
+        query = self.keyword_query(options['keyword'])
+        if query is None:
+            queryset = queryset.none()
+        elif self.full_text():
+            queryset = queryset.filter(search_vector=query).annotate(score=SearchRank(F('search_vector'), query))
+            if options['highlight']:
+                queryset = queryset.annotate(name_headline=Headline(F('name'), query),
+                                             body_headline=Headline(F('body'), query))
+        else:
+            matches = [Q(body__icontains=word) for word in options['keyword'].split()]
+            queryset = queryset.filter(reduce(lambda a, b: a | b, matches))
+
+        total = queryset.count()
+        if options['search_after'] is not None:
+            queryset = queryset.filter(self.after(options['search_after']))
+        queryset = queryset.order_by(F('date').desc(nulls_last=True), 'page_type', 'record_id')
+        if options['search_after'] is None:
+            queryset = queryset[options['from']:options['from'] + options['size']]
+        else:
+            queryset = queryset[:options['size']]
+
+        hits = [self.hit(document, options) for document in queryset]
+        return {
+            'total': total,
+            'max_score': max([hit['_score'] for hit in hits if hit['_score'] is not None], default=None),
+            'hits': hits,
+        }
+
+    def after(self, search_after):
+        """ Documents sorted after the `[date, type, id]` of a previous hit """
+        date, page_type, record_id = search_after
+        later = Q(page_type__gt=page_type) | Q(page_type=page_type, record_id__gt=record_id)
+        if date is None:
+            return Q(date__isnull=True) & later
+        date = parse_datetime(date) if isinstance(date, str) else None
+        if date is None:
+            raise ValueError('`search_after` must be the `next` value of a previous page')
+        return Q(date__lt=date) | Q(date__isnull=True) | (Q(date=date) & later)
+
+    def hit(self, document, options):
+        source = {
+            'id': document.record_id,
+            'type': document.page_type,
+            'name': document.name,
+            'body': document.body,
+            'date': document.date,
+        }
+        if options['fields'] is not None:
+            source = {field: value for field, value in source.items() if field in options['fields']}
+        hit = {
+            '_index': SearchDocument._meta.db_table,
+            '_type': 'page',
+            '_id': document.es_id,
+            '_score': getattr(document, 'score', None),
+            '_source': source,
+            'sort': [document.date.isoformat() if document.date else None, document.page_type, document.record_id],
+        }
+        if hasattr(document, 'body_headline'):
+            hit['highlight'] = {'name': [document.name_headline], 'body': [document.body_headline]}
+        return hit
+
+    def suggest(self, options):
+        # Names starting with the prefix, or with a word that does
+        prefix = options['prefix']
+        queryset = SearchDocument.objects.filter(Q(name__istartswith=prefix) | Q(name__icontains=' %s' % prefix))
+        if options['types'] is not None:
+            queryset = queryset.filter(page_type__in=options['types'])
+        return [{'id': record_id, 'type': page_type, 'name': name} for record_id, page_type, name in
+                queryset.order_by('name').values_list('record_id', 'page_type', 'name')[:options['size']]]
+
+    def document(self, es_id, source):
+        """ A document with the fields of a record's `indexing()` """
+        return SearchDocument(
+            es_id=es_id,
+            page_type=source['type'],
+            record_id=source['id'],
+            name=source['name'] or '',
+            body=source['body'] or '',
+            date=source['date'],
+        )
+
+    def bulk(self, actions):
+        """ Apply elasticsearch-style `index` and `delete` actions """
+        documents = [self.document(action['_id'], action['_source'])
+                     for action in actions if action['_op_type'] == 'index']
+        with transaction.atomic():
+            SearchDocument.objects.filter(es_id__in=[action['_id'] for action in actions]).delete()
+            SearchDocument.objects.bulk_create(documents)
+
+    def rebuild(self, chunk_size=500):
+        """ Replace every document, in one transaction so searches never see a partial set """
+        with transaction.atomic():
+            SearchDocument.objects.all().delete()
+            for model_type in OUTBOX_MODELS:
+                for chunk in iterate_in_chunks(indexing_queryset(model_type).order_by('pk'), chunk_size):
+                    SearchDocument.objects.bulk_create(
+                        [self.document(record.es_id(), record.indexing()) for record in chunk])
+
+
+def get_search_backend():
+    """ Elasticsearch when there is a host to talk to, the database otherwise """
+    if ES_CLIENT is not None:
+        return ElasticsearchBackend(ES_CLIENT, ES_BREAKER)
+    return DatabaseBackend()
@@ -0,0 +1,54 @@
+import logging
+import threading
+from queue import Queue
+from django.test import TestCase
+
+from api.logger import BoundedQueueHandler, BatchingQueueListener
+
+
+class SlowHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.unblocked = threading.Event()
+        self.messages = []
+        self.flushes = 0
+
+    def emit(self, record):
+        self.unblocked.wait(5)
+        self.messages.append(record.getMessage())
+
+    def flush(self):
+        self.flushes += 1
+
+
+class LoggingQueueTest(TestCase):
+    def setUp(self):
+        self.handler = SlowHandler()
+        self.queue = Queue(maxsize=3)
+        self.listener = BatchingQueueListener(self.queue, self.handler, batch_size=10)
+        self.logger = logging.getLogger('api.test_logger')
+        self.logger.propagate = False
+        self.queue_handler = BoundedQueueHandler(self.queue)
+        self.logger.addHandler(self.queue_handler)
+        self.addCleanup(self.logger.removeHandler, self.queue_handler)
+
+    def test_drops_records_when_full(self):
+        # Nothing is taking records off the queue yet
+        for i in range(5):
+            self.logger.error('record %s', i)
+        self.assertEqual(self.queue_handler.dropped, 2)
+
+        self.handler.unblocked.set()
+        self.listener.start()
+        self.listener.stop()
+        self.assertEqual(self.handler.messages, ['record 0', 'record 1', 'record 2'])
+        # One batch, plus the stop
+        self.assertLessEqual(self.handler.flushes, 2)
+
+    def test_logging_does_not_wait_for_handlers(self):
+        self.listener.start()
+        self.logger.error('slow')
+        self.assertEqual(self.handler.messages, [])
+        self.handler.unblocked.set()
+        self.listener.stop()
+        self.assertEqual(self.handler.messages, ['slow'])
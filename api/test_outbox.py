@@ -0,0 +1,116 @@
+import time
+from contextlib import contextmanager
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase
+
+import api.models as models
+from api.outbox import enqueue
+
+
+def bulk_results(failing_ids=()):
+    """ Stand-in for `streaming_bulk` that fails the given document ids """
+    def streaming_bulk(client, actions, **kwargs):
+        for action in actions:
+            info = {'_id': action['_id'], 'status': 200}
+            if action['_id'] in failing_ids:
+                info.update(status=503, error='unavailable')
+            streaming_bulk.sent.append(action)
+            yield info['status'] == 200, {action['_op_type']: info}
+    streaming_bulk.sent = []
+    return streaming_bulk
+
+
+class IndexOutboxTest(TestCase):
+    def setUp(self):
+        self.dtype = models.DisasterType.objects.create(name='d1', summary='foo')
+
+    def entries(self):
+        return sorted(models.IndexOutboxEntry.objects.values_list('model_type', 'object_id'))
+
+    def drain(self, streaming_bulk, reindexing=False, reindex_started=None):
+        client = mock.Mock()
+        client.indices.exists_alias.return_value = reindexing
+        started = time.time() if reindex_started is None else reindex_started
+        client.indices.get_settings.return_value = {
+            'page_all_20180601120000': {'settings': {'index': {'creation_date': str(int(started * 1000))}}},
+        }
+        with mock.patch('api.management.commands.drain_index_outbox.ES_CLIENT', client), \
+                mock.patch('api.management.commands.drain_index_outbox.streaming_bulk', streaming_bulk):
+            call_command('drain_index_outbox', batch_size=2)
+
+    def test_changes_are_queued(self):
+        event = models.Event.objects.create(name='event')
+        country = models.Country.objects.create(name='country')
+        event.countries.add(country)
+        appeal = models.Appeal.objects.create(aid='aid', name='appeal', code='code')
+        appeal_id = appeal.id
+        appeal.delete()
+        report = models.FieldReport.objects.create(rid='rid', dtype=self.dtype)
+        country.fieldreport_set.add(report)
+        self.assertEqual(self.entries(), [
+            ('appeal', appeal_id), ('appeal', appeal_id),
+            ('country', country.id),
+            ('event', event.id), ('event', event.id),
+            ('fieldreport', report.id), ('fieldreport', report.id),
+        ])
+
+    def test_drain(self):
+        country = models.Country.objects.create(name='country')
+        event = models.Event.objects.create(name='event')
+        event.countries.add(country)
+        appeal = models.Appeal.objects.create(aid='aid', name='appeal', code='code')
+        enqueue('fieldreport', [999])
+
+        streaming_bulk = bulk_results()
+        self.drain(streaming_bulk)
+        self.assertEqual(self.entries(), [])
+
+        # One document per record in each batch of two entries, however many changes were queued
+        actions = {action['_id']: action for action in streaming_bulk.sent}
+        self.assertEqual([action['_id'] for action in streaming_bulk.sent], [
+            'country-%s' % country.id, 'event-%s' % event.id,
+            'event-%s' % event.id, 'appeal-%s' % appeal.id,
+            'fieldreport-999',
+        ])
+        self.assertIn('country', actions['event-%s' % event.id]['_source']['body'])
+        self.assertEqual(actions['fieldreport-999']['_op_type'], 'delete')
+
+    def test_failures_are_retried_later(self):
+        appeal = models.Appeal.objects.create(aid='aid', name='appeal', code='code')
+        event = models.Event.objects.create(name='event')
+        self.drain(bulk_results(failing_ids=['event-%s' % event.id]))
+        entry = models.IndexOutboxEntry.objects.get()
+        self.assertEqual((entry.model_type, entry.object_id, entry.attempts), ('event', event.id, 1))
+        self.assertEqual(entry.last_error, 'unavailable')
+
+        self.drain(bulk_results())
+        self.assertEqual(self.entries(), [])
+
+    def test_held_during_reindex(self):
+        event = models.Event.objects.create(name='event')
+        streaming_bulk = bulk_results()
+        self.drain(streaming_bulk, reindexing=True)
+        self.assertEqual(streaming_bulk.sent, [])
+        self.assertEqual(self.entries(), [('event', event.id)])
+
+    def test_abandoned_reindex_does_not_hold(self):
+        models.Event.objects.create(name='event')
+        streaming_bulk = bulk_results()
+        with self.assertLogs('api', 'ERROR') as logs:
+            self.drain(streaming_bulk, reindexing=True, reindex_started=time.time() - 7 * 3600)
+        self.assertIn('draining the index outbox anyway', logs.output[0])
+        self.assertEqual(self.entries(), [])
+
+    def test_one_drain_at_a_time(self):
+        event = models.Event.objects.create(name='event')
+
+        @contextmanager
+        def held(name):
+            yield False
+
+        streaming_bulk = bulk_results()
+        with mock.patch('api.management.commands.drain_index_outbox.advisory_lock', held):
+            self.drain(streaming_bulk)
+        self.assertEqual(streaming_bulk.sent, [])
+        self.assertEqual(self.entries(), [('event', event.id)])
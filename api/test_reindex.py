@@ -0,0 +1,141 @@
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+
+import api.models as models
+
+
+class FakeIndices(object):
+    """ Just enough of an IndicesClient to follow indices and aliases around """
+    def __init__(self, indices):
+        self.indices = indices
+        self.settings = {}
+
+    def __call__(self, client):
+        return self
+
+    def create(self, index, body):
+        self.indices[index] = set(body.get('aliases', {}))
+        self.settings[index] = body['settings']
+
+    def delete(self, index):
+        del self.indices[index]
+
+    def exists(self, index):
+        return index in self.indices or self.exists_alias(name=index)
+
+    def exists_alias(self, name):
+        return any(name in aliases for aliases in self.indices.values())
+
+    def get(self, index):
+        prefix = index.rstrip('*')
+        return {name: {} for name in self.indices if name.startswith(prefix)}
+
+    def get_alias(self, name):
+        return {index: {} for index, aliases in self.indices.items() if name in aliases}
+
+    def put_settings(self, index, body):
+        self.settings[index].update(body['index'])
+
+    def refresh(self, index, **kwargs):
+        pass
+
+    def update_aliases(self, body):
+        for action in body['actions']:
+            for op, target in action.items():
+                if op == 'add':
+                    self.indices[target['index']].add(target['alias'])
+                else:
+                    self.indices[target['index']].remove(target['alias'])
+
+
+def bulk_results(client, actions, **kwargs):
+    for action in actions:
+        bulk_results.sent.append(action)
+        yield True, {}
+
+
+class ReindexTest(TestCase):
+    def setUp(self):
+        models.Event.objects.create(name='event')
+        models.Appeal.objects.create(aid='aid', name='appeal', code='code')
+
+    def reindex(self, indices, **options):
+        bulk_results.sent = []
+        with mock.patch('api.management.commands.index_elasticsearch.ES_CLIENT', object()), \
+                mock.patch('api.management.commands.index_elasticsearch.IndicesClient', indices), \
+                mock.patch('api.management.commands.index_elasticsearch.streaming_bulk', bulk_results), \
+                mock.patch('api.management.commands.index_elasticsearch.timezone.now') as now:
+            now.return_value.strftime.return_value = options.pop('timestamp', '20180601120000')
+            call_command('index_elasticsearch', **options)
+
+    def test_alias_moves_to_new_index(self):
+        indices = FakeIndices({
+            'page_all_20180101000000': set(),
+            'page_all_20180501000000': {'page_all'},
+        })
+        self.reindex(indices)
+        self.assertEqual(indices.indices, {
+            'page_all_20180501000000': set(),
+            'page_all_20180601120000': {'page_all'},
+        })
+        settings = indices.settings['page_all_20180601120000']
+        self.assertEqual((settings['number_of_replicas'], settings['refresh_interval']), (1, '1s'))
+        self.assertIn('autocomplete', settings['analysis']['analyzer'])
+        self.assertEqual({action['_index'] for action in bulk_results.sent}, {'page_all_20180601120000'})
+        self.assertEqual(len(bulk_results.sent), 2)
+
+        self.reindex(indices, rollback=True)
+        self.assertEqual(indices.indices['page_all_20180501000000'], {'page_all'})
+        self.assertEqual(indices.indices['page_all_20180601120000'], set())
+
+    def test_unversioned_index_is_replaced(self):
+        indices = FakeIndices({'page_all': set()})
+        self.reindex(indices)
+        self.assertEqual(indices.indices, {'page_all_20180601120000': {'page_all'}})
+
+    def test_failed_build_leaves_alias_alone(self):
+        indices = FakeIndices({'page_all_20180501000000': {'page_all'}})
+        with mock.patch('api.management.commands.index_elasticsearch.Command.finish_index', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self.reindex(indices)
+        self.assertEqual(indices.indices, {'page_all_20180501000000': {'page_all'}})
+
+    def test_interrupted_build_drops_marker(self):
+        indices = FakeIndices({'page_all_20180501000000': {'page_all'}})
+        with mock.patch('api.management.commands.index_elasticsearch.Command.finish_index',
+                        side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.reindex(indices)
+        self.assertEqual(indices.indices, {'page_all_20180501000000': {'page_all'}})
+
+    def test_abandoned_builds_are_deleted(self):
+        indices = FakeIndices({
+            'page_all_20180501000000': {'page_all'},
+            'page_all_20180515000000': {'reindexing_page_all'},
+        })
+        self.reindex(indices)
+        self.assertEqual(indices.indices, {
+            'page_all_20180501000000': set(),
+            'page_all_20180601120000': {'page_all'},
+        })
+
+    def test_documents_are_streamed_in_chunks(self):
+        country = models.Country.objects.create(name='country')
+        for i in range(3):
+            models.Event.objects.create(name='event %s' % i).countries.add(country)
+        # Per model a count and a cursor, plus one countries prefetch per chunk of events,
+        # and on Postgres taking and releasing the reindex lock
+        with self.assertNumQueries(14 if connection.vendor == 'postgresql' else 12):
+            self.reindex(FakeIndices({}), chunk_size=2)
+        events = [action for action in bulk_results.sent if action['type'] == 'event']
+        self.assertEqual(len(events), 4)
+        self.assertIn('country', events[-1]['body'])
+        self.assertIn('country-%s' % country.id, [action['_id'] for action in bulk_results.sent])
+
+    def test_rollback_without_previous_index(self):
+        indices = FakeIndices({'page_all_20180501000000': {'page_all'}})
+        with self.assertRaises(CommandError):
+            self.reindex(indices, rollback=True)
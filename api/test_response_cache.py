@@ -0,0 +1,104 @@
+from django.http import QueryDict
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+import api.models as models
+from api.response_cache import LocalBackend, RedisBackend, bump_generation, get_backend, normalize_query
+
+
+class FakeRedis(object):
+    """ Local stand-in for a Redis client """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+
+class ResponseCacheTest(TransactionTestCase):
+    # Saves invalidate cached responses when they commit
+    def setUp(self):
+        get_backend().clear()
+        self.country = models.Country.objects.create(name='c1')
+        models.Appeal.objects.create(aid='aid1', name='appeal', code='code1', country=self.country,
+                                     num_beneficiaries=10)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assert_invalidated_by_saves(self):
+        url = '/api/v1/aggregate_area/?type=country&id=%s' % self.country.id
+        first = self.get(url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        second = self.get(url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+
+        # Query string order doesn't matter
+        self.assertEqual(self.get('/api/v1/aggregate_area/?id=%s&type=country' % self.country.id)['X-Cache'], 'HIT')
+
+        models.Appeal.objects.create(aid='aid2', name='appeal', code='code2', country=self.country,
+                                     num_beneficiaries=5)
+        third = self.get(url)
+        self.assertEqual(third['X-Cache'], 'MISS')
+        self.assertIn(b'15', third.content)
+
+    def test_local_backend(self):
+        self.assert_invalidated_by_saves()
+
+    def test_redis_backend(self):
+        with override_settings(RESPONSE_CACHE={'BACKEND': 'redis', 'CLIENT': FakeRedis()}):
+            self.assertIsInstance(get_backend(), RedisBackend)
+            self.assert_invalidated_by_saves()
+
+    def test_local_generations_change_on_commit(self):
+        backend = get_backend()
+        before = backend.get_generations(['api.Appeal'])
+        with transaction.atomic():
+            bump_generation('api.Appeal')
+            # Nothing to see for other connections yet, so the row isn't touched
+            self.assertEqual(backend.get_generations(['api.Appeal']), before)
+        self.assertNotEqual(backend.get_generations(['api.Appeal']), before)
+
+    def test_redis_generations_change_right_away(self):
+        with override_settings(RESPONSE_CACHE={'BACKEND': 'redis', 'CLIENT': FakeRedis()}):
+            backend = get_backend()
+            with transaction.atomic():
+                bump_generation('api.Appeal')
+                during = backend.get_generations(['api.Appeal'])
+                self.assertNotEqual(during, ['0'])
+            self.assertNotEqual(backend.get_generations(['api.Appeal']), during)
+
+    def test_unrelated_saves_keep_entries(self):
+        url = '/api/v1/aggregate_dtype/?model_type=appeal'
+        self.get(url)
+        models.Event.objects.create(name='event')
+        self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+
+    def test_errors_are_not_cached(self):
+        response = self.client.get('/api/v1/aggregate_dtype/')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/v1/aggregate_dtype/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_lru_eviction(self):
+        backend = LocalBackend(max_entries=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('a'), 1)
+        self.assertEqual(backend.get('c'), 3)
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query(QueryDict('b=2&a=1&b=3')), 'a=1&b=2&b=3')
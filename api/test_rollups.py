@@ -0,0 +1,88 @@
+import json
+from datetime import datetime
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+import api.models as models
+from api.rollups import rebuild_rollups
+
+
+def date(year, month, day=1):
+    return datetime(year, month, day, tzinfo=timezone.utc)
+
+
+class TimeRollupTest(TransactionTestCase):
+    # Saves invalidate cached aggregates when they commit
+    def setUp(self):
+        region = models.Region.objects.create(name=1)
+        self.country1 = models.Country.objects.create(name='c1', region=region)
+        self.country2 = models.Country.objects.create(name='c2')
+        self.dtype = models.DisasterType.objects.create(name='d1', summary='foo')
+        self.region = region
+
+        for i, (start_date, country) in enumerate([
+                (date(2017, 1, 5), self.country1),
+                (date(2017, 1, 20), self.country2),
+                (date(2017, 3, 2), self.country1),
+                (date(2018, 6, 9), self.country1)]):
+            models.Appeal.objects.create(aid='aid%s' % i, name='appeal', code='code%s' % i,
+                                         start_date=start_date, country=country, region=country.region,
+                                         dtype=self.dtype, num_beneficiaries=10 * (i + 1), amount_requested=100)
+            event = models.Event.objects.create(name='event%s' % i, dtype=self.dtype,
+                                                disaster_start_date=start_date, num_affected=i + 1)
+            event.countries.add(country)
+            if i == 0:
+                event.countries.add(self.country2)
+
+    def get_aggregate(self, query):
+        response = self.client.get('/api/v1/aggregate/?%s' % query)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))['aggregate']
+
+    def compare(self, query):
+        # Rollups only answer once built; compare against the live aggregate
+        models.RollupBuild.objects.all().delete()
+        live = self.get_aggregate(query)
+        for model_type in ['appeal', 'event']:
+            rebuild_rollups(model_type)
+        self.assertEqual(self.get_aggregate(query), live)
+        return live
+
+    def test_matches_live_aggregate(self):
+        queries = [
+            'model_type=appeal&unit=month',
+            'model_type=appeal&unit=year&sum_beneficiaries=num_beneficiaries&sum_requested=amount_requested',
+            'model_type=appeal&unit=month&country=%s' % self.country1.id,
+            'model_type=appeal&unit=year&region=%s' % self.region.id,
+            'model_type=event&unit=month&sum_people=num_affected',
+            'model_type=event&unit=month&country=%s' % self.country2.id,
+            'model_type=event&unit=year&filter_dtype=%s&start_date=2017-02-01' % self.dtype.id,
+        ]
+        for query in queries:
+            self.compare(query)
+
+    def test_totals_count_multi_country_records_once(self):
+        aggregate = self.compare('model_type=event&unit=year')
+        self.assertEqual(aggregate[0]['count'], 3)
+
+    def test_incremental_updates(self):
+        for model_type in ['appeal', 'event']:
+            rebuild_rollups(model_type)
+        query = 'model_type=appeal&unit=month&country=%s' % self.country2.id
+        self.assertEqual(len(self.get_aggregate(query)), 1)
+
+        # Moving an appeal to another country and month updates both buckets
+        appeal = models.Appeal.objects.get(code='code0')
+        appeal.country = self.country2
+        appeal.start_date = date(2017, 2, 10)
+        appeal.save()
+        self.assertEqual([a['count'] for a in self.get_aggregate(query)], [1, 1])
+
+        appeal.delete()
+        self.assertEqual([a['count'] for a in self.get_aggregate(query)], [1])
+
+        # Countries are added to events after they're saved
+        event = models.Event.objects.create(name='new', dtype=self.dtype, disaster_start_date=date(2018, 6, 1))
+        event.countries.add(self.country2)
+        aggregate = self.get_aggregate('model_type=event&unit=year&country=%s' % self.country2.id)
+        self.assertEqual([a['count'] for a in aggregate], [2, 1])
@@ -0,0 +1,152 @@
+import json
+import pytz
+from datetime import datetime
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+import api.models as models
+from api.schema import schema
+
+
+DEEP_EVENT_QUERY = '''
+{
+  allEvents {
+    name
+    dtype { name }
+    countries { name appealSet { code } }
+    appeals { code event { name appeals { code } } }
+  }
+}
+'''
+
+DEEP_APPEAL_QUERY = '''
+query {
+  allAppeals {
+    ...appealFields
+    event { name countries { name } fieldReports { summary } }
+  }
+}
+fragment appealFields on AppealType { code country { name } }
+'''
+
+
+class GraphQLBatchingTest(TestCase):
+    def setUp(self):
+        dtype = models.DisasterType.objects.create(name='d1', summary='foo')
+        region = models.Region.objects.create(name=0)
+        for i in range(10):
+            country = models.Country.objects.create(name='country%s' % i, region=region)
+            event = models.Event.objects.create(name='event%s' % i, dtype=dtype)
+            event.countries.add(country)
+            for j in range(2):
+                models.Appeal.objects.create(aid='aid%s-%s' % (i, j), name='appeal', code='code%s-%s' % (i, j),
+                                             event=event, country=country)
+            models.FieldReport.objects.create(rid='rid%s' % i, summary='report%s' % i, event=event, dtype=dtype)
+
+    def execute(self, query):
+        with CaptureQueriesContext(connection) as context:
+            result = schema.execute(query, context_value=RequestFactory().get('/api/v1/graphql/'))
+        self.assertIsNone(result.errors)
+        return result.data, len(context.captured_queries)
+
+    def test_deep_event_query(self):
+        data, queries = self.execute(DEEP_EVENT_QUERY)
+        self.assertEqual(len(data['allEvents']), 10)
+        event = data['allEvents'][0]
+        self.assertEqual(len(event['countries'][0]['appealSet']), 2)
+        self.assertEqual(len(event['appeals']), 2)
+        self.assertEqual(len(event['appeals'][0]['event']['appeals']), 2)
+        # events, disaster types, countries, country appeals, appeals, appeal events;
+        # the appeals of those events are already in the loader's cache
+        self.assertEqual(queries, 6)
+
+    def test_deep_appeal_query(self):
+        data, queries = self.execute(DEEP_APPEAL_QUERY)
+        self.assertEqual(len(data['allAppeals']), 20)
+        appeal = data['allAppeals'][0]
+        self.assertIsNotNone(appeal['country']['name'])
+        self.assertEqual(len(appeal['event']['fieldReports']), 1)
+        # appeals, countries, events, event countries, field reports
+        self.assertEqual(queries, 5)
+
+    def test_only_selected_columns(self):
+        with CaptureQueriesContext(connection) as context:
+            schema.execute('{ allAppeals { code } }', context_value=RequestFactory().get('/'))
+        self.assertNotIn('amount_requested', context.captured_queries[0]['sql'])
+
+    def test_disaster_types(self):
+        data, queries = self.execute('{ allDisastersTypes { name } }')
+        self.assertEqual(len(data['allDisastersTypes']), 1)
+
+
+class GraphQLConnectionTest(TestCase):
+    def setUp(self):
+        start_dates = [datetime(2018, 1, 1, tzinfo=pytz.utc), datetime(2018, 2, 1, tzinfo=pytz.utc), None]
+        for i in range(7):
+            models.Appeal.objects.create(aid='aid%s' % i, name='appeal', code='code%s' % i,
+                                         start_date=start_dates[i % 3], num_beneficiaries=i)
+        dtype = models.DisasterType.objects.create(name='d1', summary='foo')
+        models.FieldReport.objects.create(rid='public', dtype=dtype, visibility=3)
+        models.FieldReport.objects.create(rid='private', dtype=dtype, visibility=1)
+
+    def query(self, query, variables=None):
+        response = self.client.post('/api/v1/graphql/', json.dumps({'query': query, 'variables': variables}),
+                                    content_type='application/json')
+        return response.status_code, json.loads(response.content.decode('utf-8'))
+
+    def page(self, args):
+        status, result = self.query('''
+            query ($first: Int, $after: String, $last: Int, $before: String) {
+              appeals(first: $first, after: $after, last: $last, before: $before) {
+                pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+                edges { node { code } }
+              }
+            }''', args)
+        self.assertEqual(status, 200)
+        appeals = result['data']['appeals']
+        return [edge['node']['code'] for edge in appeals['edges']], appeals['pageInfo']
+
+    def test_walk_forwards_and_back(self):
+        codes = []
+        page, info = self.page({'first': 3})
+        codes += page
+        while info['hasNextPage']:
+            page, info = self.page({'first': 3, 'after': info['endCursor']})
+            codes += page
+        self.assertEqual(sorted(codes), sorted(models.Appeal.objects.values_list('code', flat=True)))
+
+        page, info = self.page({'last': 3, 'before': info['startCursor']})
+        self.assertEqual(page, codes[3:6])
+        self.assertTrue(info['hasPreviousPage'])
+
+    def test_filters(self):
+        status, result = self.query('{ appeals(code: "code4") { edges { node { code } } } }')
+        self.assertEqual(result['data']['appeals']['edges'], [{'node': {'code': 'code4'}}])
+
+    def test_anonymous_field_reports(self):
+        status, result = self.query('{ fieldReports { edges { node { rid } } } }')
+        self.assertEqual(result['data']['fieldReports']['edges'], [{'node': {'rid': 'public'}}])
+
+    def test_page_size_limit(self):
+        status, result = self.query('{ appeals(first: 1000) { edges { node { code } } } }')
+        self.assertIsNone(result['data']['appeals'])
+        self.assertIn('errors', result)
+
+    def test_rejects_expensive_queries(self):
+        deep = '{ allEvents { appeals { event { appeals { event { appeals { event { appeals { event { appeals { code } } } } } } } } } } }'
+        status, result = self.query(deep)
+        self.assertEqual(status, 400)
+        self.assertIn('depth', result['errors'][0]['message'])
+
+        wide = '{ appeals(first: 100) { edges { node { event { appeals { event { countries { name } } } } } } } }'
+        status, result = self.query(wide)
+        self.assertEqual(status, 400)
+        self.assertIn('cost', result['errors'][0]['message'])
+
+        status, result = self.query('{ appeals(first: 10) { edges { node { event { name } } } } }')
+        self.assertEqual(status, 200)
+
+    def test_introspection_is_free(self):
+        status, result = self.query('{ __schema { types { name fields { name type { ofType { ofType { ofType { name } } } } } } } }')
+        self.assertEqual(status, 200)
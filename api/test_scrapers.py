@@ -1,11 +1,27 @@
-import time
-from datetime import timedelta
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.utils.crypto import get_random_string
 from notifications.models import Country, Region, DisasterType, RecordType, SubscriptionType, Subscription
-from .models import Appeal, Event, FieldReport
+from .models import Appeal, Event, FieldReport, Action, IndexOutboxEntry, TimeRollup
+from .bulk import bulk_upsert
 from api.management.commands.index_and_notify import Command as Notify
+from api.management.commands.ingest_mdb import (
+    IndexedTable,
+    MdbExtractor,
+    CsvExtractor,
+    extract_tables,
+    all_rows,
+    related_rows,
+)
 
 def get_user():
     user_number = get_random_string(8)
@@ -204,17 +220,254 @@ class AppealNotificationTest(TestCase):
         self.assertEqual(emails[0], user.email)
 
 
-class FilterJustCreatedTest(TestCase):
+class IndexedTableTest(TestCase):
+    def test_rows_by_report(self):
+        table = IndexedTable([
+            {'ReportID': '1', 'Value': 'a'},
+            {'ReportID': '2', 'Value': ''},
+            {'ReportID': '1', 'Value': 'b'},
+        ], 'EW_Report_ActionTakenByRedCross')
+        self.assertEqual([row['Value'] for row in table.get('1')], ['a', 'b'])
+        self.assertEqual(table.first('2'), {'ReportID': '2', 'Value': None})
+        self.assertEqual(table.get('3'), [])
+        self.assertIsNone(table.first('3'))
+        self.assertEqual(len(table), 3)
+
+    def test_unique(self):
+        with self.assertRaisesRegex(Exception, 'More than one EW_DisasterResponseTools record for field report 1'):
+            IndexedTable([{'ReportID': '1'}, {'ReportID': '1'}], 'EW_DisasterResponseTools', unique=True)
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_mdb_joins', reports=50, scan_sample=10, stdout=out)
+        self.assertIn('150 rows for 50 reports', out.getvalue())
+        self.assertIn('joined 150 rows', out.getvalue())
+
+
+# Stands in for mdb-export, writing `table` as CSV, or failing for `missing`
+FAKE_MDB_EXPORT = '''
+import sys
+if sys.argv[2] == 'missing':
+    sys.exit(1)
+sys.stdout.buffer.write('ReportID,Value\\r\\n1,"two\\nlines"\\r\\n2,Caf\\u00e9\\r\\n'.encode('utf-8'))
+'''
+
+
+class MdbExtractionTest(TestCase):
     def setUp(self):
-        # create two appeals, modify one 2 seconds later.
-        appeal1 = Appeal.objects.create(aid='test1', name='appeal', atype=2, code='1')
-        appeal2 = Appeal.objects.create(aid='test2', name='appeal', atype=2, code='2')
-        time.sleep(1)
-        appeal1.name = 'something new'
-        appeal1.save()
-
-    def test_filter_just_created(self):
-        notify = Notify()
-        filtered = notify.filter_just_created(Appeal.objects.filter(created_at__gte=notify.get_time_threshold()))
-        self.assertEqual(len(filtered), 1)
-        self.assertEqual(filtered[0].aid, 'test2')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.script = os.path.join(self.directory, 'mdb_export.py')
+        with open(self.script, 'w') as f:
+            f.write(FAKE_MDB_EXPORT)
+
+    def test_mdb_extractor(self):
+        extractor = MdbExtractor('URLs.mdb', command=(sys.executable, self.script))
+        self.assertEqual(list(extractor.rows('table')), [
+            {'ReportID': '1', 'Value': 'two\nlines'},
+            {'ReportID': '2', 'Value': 'Café'},
+        ])
+        with self.assertRaisesRegex(Exception, 'mdb-export of missing failed'):
+            list(extractor.rows('missing'))
+
+    def test_extract_tables(self):
+        for table in ('EW_Reports', 'EW_Report_Contacts'):
+            with open(os.path.join(self.directory, '%s.csv' % table), 'w') as f:
+                f.write('ReportID,Value\n1,a\n1,b\n')
+        tables = extract_tables(CsvExtractor(self.directory), {
+            'EW_Reports': all_rows,
+            'EW_Report_Contacts': related_rows,
+        }, max_workers=2)
+        self.assertEqual(len(tables['EW_Reports']), 2)
+        self.assertEqual([row['Value'] for row in tables['EW_Report_Contacts'].get('1')], ['a', 'b'])
+
+
+CONTACT_FIELDS = ['Originator', 'Primary', 'Federation', 'NationalSociety', 'MediaNationalSociety', 'Media']
+
+MDB_TABLES = {
+    'EW_Reports': [
+        'ReportID,Summary,BriefSummary,DisasterTypeID,StatusID,GovRequestsInternAssistance,ActionTakenByOthers,Inserted,CountryID',
+        '1,Floods,Rivers burst,1,1,1,,01/15/18 10:00:00,1',
+        '2,,Unknown country,1,1,0,,01/20/18 10:00:00,999',
+    ],
+    'EW_Report_NumericDetails': [
+        'ReportID,NumberOfInjured,NumberOfCasualties,NumberOfMissing,NumberOfAffected,NumberOfDisplaced,'
+        'NumberOfAssistedByRC,NumberOfLocalStaffInvolved,NumberOfVolunteersInvolved,NumberOfExpatsDelegates',
+        '1,1,2,3,400,5,6,7,8,9',
+    ],
+    'EW_Report_NumericDetails_GOV': [
+        'ReportID,NumberOfInjured_GOV,NumberOfDead_GOV,NumberOfMissing_GOV,NumberOfAffected_GOV,'
+        'NumberOfDisplaced_GOV,NumberOfAssistedByGov_GOV',
+    ],
+    'EW_Report_InformationManagement': [
+        'ReportID,InformationBulletin,DREFRequested,DREFRequestedAmount,EmergencyAppeal,EmergencyAppealAmount',
+        '1,Published,Yes,1000,No,',
+    ],
+    'EW_Report_ActionTakenByRedCross': ['ReportID,ActionTakenByRedCrossID,Value', '1,1,Shelter', '1,2,Food'],
+    'EW_Report_ActionTakenByPnsRC': ['ReportID,ActionTakenByRedCrossID,Value'],
+    'EW_Report_ActionTakenByFederationRC': ['ReportID,ActionTakenByRedCrossID,Value', '2,1,'],
+    'EW_lofSources': ['SourceID,SourceName', '1,Government'],
+    'EW_Reports_Sources': ['ReportID,SourceID,Specification', '1,1,Ministry', '2,1,'],
+    'EW_DisasterResponseTools': ['ReportID,RDRT,FACT,ERU', '1,Yes,No,Planned/Requested'],
+    'EW_Report_Contacts': [
+        'ReportID,' + ','.join('%s%s' % (f, suffix) for f in CONTACT_FIELDS for suffix in ('Name', 'Function', 'Contact')),
+        '1,Jo,Officer,jo@example.com' + ',,,' * (len(CONTACT_FIELDS) - 1),
+    ],
+    'DMISUsers': ['UserName,RealName,EmailAddress,LoginLastSuccess'],
+}
+
+
+class IngestMdbTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        for table, lines in MDB_TABLES.items():
+            with open(os.path.join(self.directory, '%s.csv' % table), 'w') as f:
+                f.write('\r\n'.join(lines) + '\r\n')
+        DisasterType.objects.create(pk=1, name='Flood', summary='')
+        region = Region.objects.create(name=0)
+        Country.objects.create(pk=1, name='c1', region=region)
+        Action.objects.create(pk=1, name='Shelter')
+
+    def test_ingest(self):
+        call_command('ingest_mdb', csv_dir=self.directory, chunk_size=1)
+
+        floods = FieldReport.objects.get(rid='1')
+        self.assertEqual(floods.num_affected, 400)
+        self.assertEqual(floods.dref_amount, 1000)
+        self.assertEqual(list(floods.countries.values_list('name', flat=True)), ['c1'])
+        self.assertEqual(floods.regions.count(), 1)
+        self.assertEqual(floods.event.name, 'Floods')
+        self.assertEqual(list(floods.event.countries.values_list('name', flat=True)), ['c1'])
+        # Action 2 doesn't exist
+        self.assertEqual(list(floods.actions_taken.get().actions.values_list('pk', flat=True)), [1])
+        self.assertEqual(floods.sources.get().spec, 'Ministry')
+        self.assertEqual(list(floods.contacts.values_list('ctype', 'email')), [('Originator', 'jo@example.com')])
+
+        unknown = FieldReport.objects.get(rid='2')
+        self.assertEqual(unknown.countries.count(), 0)
+        self.assertEqual(unknown.event.name, 'Flood')
+        self.assertEqual(unknown.actions_taken.get().organization, 'FDRN')
+
+        # Written in bulk, and still queued for indexing and counted in the rollups
+        outbox = IndexOutboxEntry.objects.filter(model_type='fieldreport').values_list('object_id', flat=True)
+        self.assertEqual(set(outbox), {floods.pk, unknown.pk})
+        rollup = TimeRollup.objects.get(model_type='fieldreport', area_type='country', area_id=1)
+        self.assertEqual((rollup.count, rollup.num_affected), (1, 400))
+
+        # Reports already ingested are skipped
+        call_command('ingest_mdb', csv_dir=self.directory)
+        self.assertEqual(FieldReport.objects.count(), 2)
+        self.assertEqual(Event.objects.count(), 2)
+
+
+def appeal_record(code, amount):
+    """ A record shaped like those of the appeals API """
+    return {
+        'APP_Id': 1, 'APP_name': 'Appeal %s' % code, 'APP_code': code, 'APP_status': 'Active',
+        'APP_modifyTime': '2017-01-01T00:00:00', 'ADT_name': 'Flood', 'GEC_code': 'C1', 'OSC_name': 'c1',
+        'OSR_name': 'Africa', 'OSS_name': 'Sector',
+        'Details': [{
+            'APD_startDate': '2017-01-01T00:00:00', 'APD_endDate': '2017-06-01T00:00:00', 'APD_TYP_Id': 64,
+            'APD_amountCHF': amount, 'ContributionAmount': None, 'APD_noBeneficiaries': 10,
+        }],
+    }
+
+
+class IngestAppealsTest(TestCase):
+    def setUp(self):
+        DisasterType.objects.create(name='Flood', summary='')
+        DisasterType.objects.create(name='Other', summary='')
+        region = Region.objects.create(name=0)
+        Country.objects.create(name='c1', iso='c1', region=region)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # The command writes the records it fetched to appeals.json
+        cwd = os.getcwd()
+        os.chdir(directory.name)
+        self.addCleanup(os.chdir, cwd)
+
+    def ingest(self, records):
+        # With DJANGO_DB_NAME=test the command reads appeals.json instead of the API
+        with open('appeals.json', 'w') as f:
+            json.dump(records, f)
+        response = mock.Mock(status_code=200)
+        response.json.return_value = records
+        with mock.patch('api.management.commands.ingest_appeals.requests.get', return_value=response):
+            call_command('ingest_appeals')
+
+    def test_only_changed_records_are_written(self):
+        self.ingest([appeal_record('A1', 100), appeal_record('A2', 200)])
+        first = Appeal.objects.get(code='A1')
+        self.assertEqual((first.country.name, first.region.name, first.dtype.name), ('c1', 0, 'Flood'))
+        self.assertEqual(first.amount_requested, 100)
+
+        IndexOutboxEntry.objects.all().delete()
+        self.ingest([appeal_record('A1', 100), appeal_record('A2', 250), appeal_record('A3', 300)])
+        self.assertEqual(Appeal.objects.get(code='A1').modified_at, first.modified_at)
+        self.assertEqual(Appeal.objects.get(code='A2').amount_requested, 250)
+        self.assertEqual(Appeal.objects.count(), 3)
+
+        # Written in bulk, and still queued for indexing and counted in the rollups
+        outbox = IndexOutboxEntry.objects.filter(model_type='appeal').values_list('object_id', flat=True)
+        self.assertEqual(set(outbox), set(Appeal.objects.filter(code__in=['A2', 'A3']).values_list('pk', flat=True)))
+        rollup = TimeRollup.objects.get(model_type='appeal', area_type='all')
+        self.assertEqual((rollup.count, rollup.amount_requested), (3, 650))
+
+    def test_appeals_ingested_before_hashes_are_backfilled(self):
+        self.ingest([appeal_record('A1', 100), appeal_record('A2', 200)])
+        Appeal.objects.update(source_hash='')
+        IndexOutboxEntry.objects.all().delete()
+        before = dict(Appeal.objects.values_list('code', 'modified_at'))
+
+        recent = appeal_record('A2', 250)
+        recent['APP_modifyTime'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+        self.ingest([appeal_record('A1', 100), recent])
+        # Only the recently modified appeal is updated; the other just gets its hash
+        first = Appeal.objects.get(code='A1')
+        self.assertEqual(first.modified_at, before['A1'])
+        self.assertNotEqual(first.source_hash, '')
+        self.assertEqual(Appeal.objects.get(code='A2').amount_requested, 250)
+        outbox = IndexOutboxEntry.objects.values_list('object_id', flat=True)
+        self.assertEqual(set(outbox), {Appeal.objects.get(code='A2').pk})
+
+
+class BulkUpsertTest(TestCase):
+    def test_upsert(self):
+        region = Region.objects.create(name=0)
+        existing = Appeal.objects.create(aid='1', name='old', code='A1', region=region, needs_confirmation=True)
+        appeals = [
+            Appeal(aid='2', name='new', code='A1'),
+            Appeal(aid='3', name='added', code='A2'),
+            Appeal(aid='4', name='bad', code='A3', num_beneficiaries='many'),
+        ]
+        result = bulk_upsert(Appeal, appeals, 'code', ('aid', 'name'), batch_size=2)
+
+        self.assertEqual([appeal.code for appeal in result.created], ['A2'])
+        self.assertEqual([appeal.code for appeal in result.updated], ['A1'])
+        self.assertEqual([appeal.code for appeal in result.failed], ['A3'])
+        self.assertEqual(appeals[0].pk, existing.pk)
+        updated = Appeal.objects.get(pk=existing.pk)
+        # Only the fields to update are written over
+        self.assertEqual((updated.aid, updated.name), ('2', 'new'))
+        self.assertEqual((updated.region, updated.needs_confirmation), (region, True))
+        self.assertEqual(Appeal.objects.get(pk=appeals[1].pk).name, 'added')
+        self.assertFalse(Appeal.objects.filter(code='A3').exists())
+
+    @skipUnless(connection.vendor == 'postgresql', 'Only Postgres upserts a batch at once')
+    def test_batch_database_errors_isolate_rows(self):
+        appeals = [Appeal(aid='1', name='fine', code='A1'), Appeal(aid='2', name='x' * 101, code='A2')]
+        result = bulk_upsert(Appeal, appeals, 'code', ('aid', 'name'))
+        self.assertEqual([appeal.code for appeal in result.created], ['A1'])
+        self.assertEqual([appeal.code for appeal in result.failed], ['A2'])
+        self.assertEqual(list(Appeal.objects.values_list('code', flat=True)), ['A1'])
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_appeal_upserts', appeals=20, chunk_size=8, stdout=out)
+        self.assertIn('row by row, update: 20 appeals', out.getvalue())
+        self.assertIn('bulk upsert, update: 20 appeals', out.getvalue())
+        # Nothing is kept
+        self.assertEqual(Appeal.objects.count(), 0)
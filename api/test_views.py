@@ -1,11 +1,32 @@
+import os
+import re
 import json
+import csv
+import tempfile
+from io import StringIO
+from unittest import mock
+import pytz
+from datetime import datetime, timedelta
+from django.utils import timezone
+from django.core.management import call_command
+from django.conf import settings
 from django.test import TestCase
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+import api.models as models
+from deployments.models import ERU, ERUOwner
 from api.views import (
     GetAuthToken,
 )
+from api.search import suggestion_cache
+from api.esconnection import CircuitBreaker
+from api.authentication import token_cache
+from rest_framework.authtoken.models import Token
+from main.metrics import MetricsStore, command_metrics, render, sample_key
+from elasticsearch.exceptions import ConnectionTimeout, RequestError
 
 class AuthTokenTest(APITestCase):
     def setUp(self):
@@ -23,3 +44,531 @@ class AuthTokenTest(APITestCase):
         response = json.loads(response)
         self.assertIsNotNone(response.get('token'))
         self.assertIsNotNone(response.get('expires'))
+
+    def test_request_log_redacts_password(self):
+        body = {'username': 'jo', 'password': '12345678'}
+        with self.settings(REQUEST_LOG={'SAMPLE_RATE': 1}), self.assertLogs('api.requests', 'INFO') as logs:
+            self.client.post('/get_auth_token', body, format='json', HTTP_AUTHORIZATION='Token abc')
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['path'], '/get_auth_token')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(json.loads(entry['body']), {'username': 'jo', 'password': '[redacted]'})
+        self.assertEqual(entry['headers']['authorization'], '[redacted]')
+        self.assertNotIn('12345678', logs.output[0])
+
+    def test_request_log_redacts_whole_words(self):
+        query = {'keyword': 'flood', 'password': 'secret1', 'api_key': 'secret2'}
+        with self.settings(REQUEST_LOG={'SAMPLE_RATE': 1}), self.assertLogs('api.requests', 'INFO') as logs, \
+                mock.patch('api.search_backends.ES_CLIENT') as client:
+            client.search.return_value = {'hits': {'total': 0, 'hits': []}}
+            self.client.get('/api/v1/es_search/', query, HTTP_AUTHORIZATION='Token abc', HTTP_X_API_KEY='secret3')
+        entry = json.loads(logs.records[0].getMessage())
+        # `keyword` isn't a key
+        self.assertEqual(entry['query'], {'keyword': 'flood', 'password': '[redacted]', 'api_key': '[redacted]'})
+        self.assertEqual(entry['headers']['authorization'], '[redacted]')
+        self.assertEqual(entry['headers']['x-api-key'], '[redacted]')
+        self.assertNotIn('secret', logs.output[0])
+
+    def test_request_log_sampling(self):
+        with self.settings(REQUEST_LOG={'SAMPLE_RATE': 0}), mock.patch('api.request_log.request_logger') as request_logger:
+            self.client.post('/get_auth_token', {'username': 'jo', 'password': '12345678'}, format='json')
+        request_logger.info.assert_not_called()
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create(username='jo')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % self.token.key)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/v2/user/')
+        return response, len(context.captured_queries)
+
+    def test_cached(self):
+        response, first = self.count_queries()
+        self.assertEqual(response.status_code, 200)
+        response, second = self.count_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['username'], 'jo')
+        self.assertEqual(second, first - 1)
+
+    def test_expired(self):
+        self.token.created = timezone.now() - timedelta(8)
+        self.token.save()
+        self.assertEqual(self.client.get('/api/v2/user/').status_code, 401)
+
+    def test_user_change_drops_cached_token(self):
+        self.assertEqual(self.client.get('/api/v2/user/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/v2/user/').status_code, 401)
+
+
+class EventListQueryCountTest(APITestCase):
+    def setUp(self):
+        dtype = models.DisasterType.objects.create(name='d1', summary='foo')
+        for i in range(12):
+            event = models.Event.objects.create(name='event%s' % i, summary='foo', dtype=dtype)
+            country = models.Country.objects.create(name='country%s' % i)
+            event.countries.add(country)
+            models.Appeal.objects.create(aid='aid%s' % i, name='appeal', code='code%s' % i, event=event, country=country)
+            report = models.FieldReport.objects.create(rid='rid%s' % i, event=event, dtype=dtype)
+            report.countries.add(country)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_constant_queries_per_page(self):
+        # The number of queries must not grow with the number of rows on a page
+        counts = [self.count_queries('/api/v2/event/?limit=%s' % limit) for limit in [1, 5, 12]]
+        self.assertEqual(len(set(counts)), 1)
+        # ETag validator, cache generations, count, events, appeals, countries, field reports
+        self.assertEqual(counts[0], 7)
+
+    def test_list_serialization(self):
+        response = self.client.get('/api/v2/event/?limit=1')
+        result = response.data['results'][0]
+        self.assertEqual(len(result['appeals']), 1)
+        self.assertEqual(len(result['countries']), 1)
+        self.assertEqual(len(result['field_reports']), 1)
+        self.assertIsNotNone(result['countries'][0]['name'])
+
+
+class CursorPaginationTest(APITestCase):
+    def setUp(self):
+        # Appeals share start dates, and some have none, to exercise the id tiebreak
+        start_dates = [datetime(2018, 1, 1, tzinfo=pytz.utc), datetime(2018, 2, 1, tzinfo=pytz.utc), None]
+        for i in range(11):
+            models.Appeal.objects.create(aid='aid%s' % i, name='appeal', code='code%s' % i,
+                                         start_date=start_dates[i % 3])
+
+    def walk(self, url, key):
+        pages = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([result['id'] for result in response.data['results']])
+            url = response.data[key]
+        return pages, response.data
+
+    def test_cursor_walk(self):
+        pages, last = self.walk('/api/v2/appeal/?pagination=cursor&limit=3', 'next')
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual(len(pages), 4)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(sorted(ids), sorted(models.Appeal.objects.values_list('id', flat=True)))
+
+        # Walking back from the last page returns the same pages
+        back_pages, first = self.walk(last['previous'], 'previous')
+        self.assertEqual(list(reversed(back_pages)), pages[:-1])
+
+    def test_cursor_skips_count(self):
+        response = self.client.get('/api/v2/appeal/?pagination=cursor')
+        self.assertNotIn('count', response.data)
+        response = self.client.get('/api/v2/appeal/?pagination=cursor&count=exact')
+        self.assertEqual(response.data['count'], 11)
+
+    def test_offset_without_count(self):
+        response = self.client.get('/api/v2/appeal/?limit=10&count=none')
+        self.assertNotIn('count', response.data)
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v2/appeal/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+class StreamingExportTest(APITestCase):
+    def setUp(self):
+        country = models.Country.objects.create(name='country')
+        event = models.Event.objects.create(name='event', disaster_start_date=datetime(2018, 1, 1, tzinfo=pytz.utc))
+        for i in range(60):
+            models.Appeal.objects.create(aid='aid%s' % i, name='appeal', code='code%s' % i,
+                                         country=country, event=event, needs_confirmation=(i % 2 == 0))
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_streams_every_row(self):
+        response = self.client.get('/api/v2/appeal/?format=csv&stream=1')
+        self.assertIn('attachment', response['Content-Disposition'])
+        rows = list(csv.DictReader(self.read(response).splitlines()))
+        # More rows than the default page size of 50
+        self.assertEqual(len(rows), 60)
+        self.assertEqual(rows[0]['country.name'], 'country')
+        self.assertEqual(len([row for row in rows if row['event']]), 30)
+
+    def test_ndjson_streams_every_row(self):
+        response = self.client.get('/api/v2/appeal/?format=ndjson&stream=1&code=code3')
+        lines = self.read(response).splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['code'], 'code3')
+
+    def test_without_stream_returns_a_page(self):
+        response = self.client.get('/api/v2/appeal/?format=ndjson')
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(response.content.decode('utf-8').splitlines()), 50)
+
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        for i in range(3):
+            models.Appeal.objects.create(aid='aid%s' % i, name='appeal', code='code%s' % i)
+
+    def test_list_not_modified(self):
+        response = self.client.get('/api/v2/appeal/')
+        etag = response['ETag']
+        response = self.client.get('/api/v2/appeal/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # Other pages have their own validators
+        response = self.client.get('/api/v2/appeal/?limit=1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_changes(self):
+        etag = self.client.get('/api/v2/appeal/')['ETag']
+        appeal = models.Appeal.objects.get(code='code1')
+        appeal.name = 'renamed'
+        appeal.save()
+        response = self.client.get('/api/v2/appeal/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        appeal.delete()
+        response = self.client.get('/api/v2/appeal/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_not_modified(self):
+        appeal = models.Appeal.objects.get(code='code0')
+        url = '/api/v2/appeal/%s/' % appeal.id
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/api/v2/appeal/0/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalDependenciesTest(APITransactionTestCase):
+    # Saves change the generations in the ETags when they commit
+    def setUp(self):
+        self.event = models.Event.objects.create(name='event')
+        dtype = models.DisasterType.objects.create(name='d1', summary='foo')
+        models.FieldReport.objects.create(rid='rid', dtype=dtype, event=self.event, visibility=3)
+        ERU.objects.create(event=self.event, eru_owner=ERUOwner.objects.create())
+        self.client.force_authenticate(User.objects.create(username='jo'))
+
+    def test_event_edits_change_nesting_lists(self):
+        for url in ('/api/v2/field_report/', '/api/v2/eru/'):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.event.name = 'renamed %s' % url
+            self.event.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(self.event.name, response.content.decode('utf-8'))
+
+    def test_event_detail_follows_nested_records(self):
+        url = '/api/v2/event/%s/' % self.event.id
+        response = self.client.get(url)
+        # The event's own timestamp misses edits to the appeals and field reports it nests
+        self.assertNotIn('Last-Modified', response)
+        report = models.FieldReport.objects.get()
+        report.summary = 'edited'
+        report.save()
+        # A client that only validates by date still gets the edit
+        since = 'Fri, 01 Jan 2100 00:00:00 GMT'
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class EsPageSearchTest(TestCase):
+    def setUp(self):
+        dtype = models.DisasterType.objects.create(name='d1', summary='foo')
+        self.event = models.Event.objects.create(name='flood')
+        self.appeal = models.Appeal.objects.create(aid='aid', name='flood appeal', code='code',
+                                                   event=self.event, needs_confirmation=True)
+        self.private_report = models.FieldReport.objects.create(rid='rid', dtype=dtype, visibility=1)
+        self.hits = [
+            {'_id': 'event-%s' % self.event.id, 'sort': [1514764800000, 'event', str(self.event.id)]},
+            {'_id': 'appeal-%s' % self.appeal.id, 'sort': [1514764800000, 'appeal', str(self.appeal.id)]},
+            {'_id': 'fieldreport-%s' % self.private_report.id, 'sort': [1514764800000, 'report', '1']},
+            {'_id': 'event-999', 'sort': [1514764800000, 'event', '999']},
+        ]
+
+    def search(self, query, **headers):
+        with mock.patch('api.search_backends.ES_CLIENT') as client:
+            client.search.return_value = {'hits': {'total': 4, 'hits': self.hits}}
+            response = self.client.get('/api/v1/es_search/', query, **headers)
+        body = json.loads(client.search.call_args[1]['body']) if client.search.called else None
+        return response, body
+
+    def test_paging_and_source_filtering(self):
+        response, body = self.search({'keyword': 'flood', 'from': 20, 'size': 4, 'fields': 'name,type', 'highlight': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((body['from'], body['size']), (20, 4))
+        self.assertEqual(body['_source'], ['name', 'type'])
+        self.assertIn('body', body['highlight']['fields'])
+        self.assertEqual(json.loads(response.json()['next']), self.hits[-1]['sort'])
+
+        response, body = self.search({'keyword': 'flood', 'search_after': response.json()['next']})
+        self.assertEqual(body['search_after'], self.hits[-1]['sort'])
+        self.assertNotIn('from', body)
+        # A short page is the last one
+        self.assertIsNone(response.json()['next'])
+
+    def test_invalid_parameters(self):
+        for query in ({'keyword': 'flood', 'size': 1000},
+                      {'keyword': 'flood', 'from': 10, 'search_after': '[1, "event", "1"]'},
+                      {'keyword': 'flood', 'search_after': 'nope'},
+                      {'keyword': 'flood', 'fields': 'name,secret'},
+                      {'size': 10}):
+            response, body = self.search(query)
+            self.assertEqual(response.status_code, 400)
+            self.assertIsNone(body)
+
+    def test_expand_hydrates_records(self):
+        # One query per type of hit, plus the event list's three prefetches
+        with self.assertNumQueries(6):
+            response, body = self.search({'keyword': 'flood', 'expand': '1'})
+        hits = response.json()['hits']
+        self.assertEqual(hits[0]['record']['name'], 'flood')
+        self.assertEqual(hits[1]['record']['code'], 'code')
+        # Unconfirmed events are left off appeals, like the appeal endpoint does
+        self.assertIsNone(hits[1]['record']['event'])
+        # Private field reports and deleted records aren't returned
+        self.assertIsNone(hits[2]['record'])
+        self.assertIsNone(hits[3]['record'])
+
+    def test_expand_authenticates_tokens(self):
+        token_cache.clear()
+        token = Token.objects.create(user=User.objects.create(username='jo'))
+        response, body = self.search({'keyword': 'flood', 'expand': '1'}, HTTP_AUTHORIZATION='Token %s' % token.key)
+        # Signed in users see private field reports, as on the field report endpoint
+        self.assertEqual(response.json()['hits'][2]['record']['id'], self.private_report.id)
+
+        response, body = self.search({'keyword': 'flood', 'expand': '1'}, HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(response.status_code, 401)
+
+
+class EsSuggestTest(TestCase):
+    def setUp(self):
+        suggestion_cache.clear()
+
+    def suggest(self, query):
+        with mock.patch('api.search_backends.ES_CLIENT') as client:
+            client.search.return_value = {'hits': {'hits': [
+                {'_source': {'id': 1, 'type': 'country', 'name': 'France'}},
+            ]}}
+            response = self.client.get('/api/v1/es_suggest/', query)
+        return response, client.search
+
+    def test_suggestions_match_name_prefixes(self):
+        response, search = self.suggest({'q': 'Fra', 'type': 'country,district'})
+        self.assertEqual(response.json()['results'], [{'id': 1, 'type': 'country', 'name': 'France'}])
+        body = json.loads(search.call_args[1]['body'])
+        self.assertEqual(body['query']['bool']['must']['match']['name.suggest']['query'], 'fra')
+        self.assertEqual(body['query']['bool']['filter'], {'terms': {'type': ['country', 'district']}})
+
+    def test_hot_prefixes_are_cached(self):
+        response, search = self.suggest({'q': 'fra'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        response, search = self.suggest({'q': 'FRA '})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertFalse(search.called)
+        self.assertEqual(response.json()['results'][0]['name'], 'France')
+
+    def test_prefix_is_required(self):
+        response, search = self.suggest({'q': ' '})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(search.called)
+
+
+class DatabaseSearchTest(TestCase):
+    def setUp(self):
+        suggestion_cache.clear()
+        country = models.Country.objects.create(name='Mozambique')
+        for i in range(3):
+            event = models.Event.objects.create(name='Cyclone %s' % i, disaster_start_date=datetime(2018, 1, 1 + i, tzinfo=pytz.utc))
+            event.countries.add(country)
+        models.Event.objects.create(name='Earthquake', disaster_start_date=datetime(2018, 2, 1, tzinfo=pytz.utc))
+        with mock.patch('api.management.commands.drain_index_outbox.ES_CLIENT', None):
+            call_command('drain_index_outbox')
+
+    def get(self, url, query):
+        with mock.patch('api.search_backends.ES_CLIENT', None):
+            return self.client.get(url, query).json()
+
+    def test_search_without_elasticsearch(self):
+        results = self.get('/api/v1/es_search/', {'keyword': 'mozambique', 'type': 'event', 'size': 2})
+        self.assertEqual(results['total'], 3)
+        self.assertEqual([hit['_source']['name'] for hit in results['hits']], ['Cyclone 2', 'Cyclone 1'])
+
+        results = self.get('/api/v1/es_search/', {'keyword': 'mozambique', 'type': 'event', 'size': 2,
+                                                  'search_after': results['next']})
+        self.assertEqual([hit['_source']['name'] for hit in results['hits']], ['Cyclone 0'])
+        self.assertIsNone(results['next'])
+
+    def test_documents_follow_the_outbox(self):
+        models.Event.objects.get(name='Earthquake').delete()
+        with mock.patch('api.management.commands.drain_index_outbox.ES_CLIENT', None):
+            call_command('drain_index_outbox')
+        self.assertEqual(self.get('/api/v1/es_search/', {'keyword': 'earthquake'})['total'], 0)
+
+    def test_benchmark(self):
+        out = StringIO()
+        with mock.patch('api.management.commands.benchmark_search.ES_CLIENT', None):
+            call_command('benchmark_search', 'cyclone', runs=2, stdout=out)
+        self.assertIn('database: 2 searches, 3.0 hits on average', out.getvalue())
+
+    def test_suggest_without_elasticsearch(self):
+        results = self.get('/api/v1/es_suggest/', {'q': 'moz'})['results']
+        self.assertEqual(results, [{'id': models.Country.objects.get().id, 'type': 'country', 'name': 'Mozambique'}])
+
+
+class SearchCircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(max_failures=2, reset_after=30)
+
+    def search(self, client):
+        with mock.patch('api.search_backends.ES_CLIENT', client), \
+                mock.patch('api.search_backends.ES_BREAKER', self.breaker):
+            return self.client.get('/api/v1/es_search/', {'keyword': 'flood'})
+
+    def test_outages_open_the_circuit(self):
+        client = mock.Mock()
+        client.search.side_effect = ConnectionTimeout('TIMEOUT', 'timed out', None)
+        for i in range(2):
+            response = self.search(client)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['degraded'])
+        self.assertEqual(client.search.call_count, 2)
+
+        # Open: fail fast without calling elasticsearch
+        self.assertTrue(self.search(client).json()['degraded'])
+        self.assertEqual(client.search.call_count, 2)
+
+        # After the reset period one trial call goes through, and closes it
+        client.search.side_effect = None
+        client.search.return_value = {'hits': {'total': 0, 'max_score': None, 'hits': []}}
+        self.breaker.opened_at -= 30
+        self.assertNotIn('degraded', self.search(client).json())
+        self.assertFalse(self.breaker.is_open())
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_bad_requests_do_not_count(self):
+        client = mock.Mock()
+        client.search.side_effect = RequestError(400, 'parsing_exception', {})
+        with self.assertRaises(RequestError):
+            self.search(client)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_bad_request_during_trial_closes_the_circuit(self):
+        client = mock.Mock()
+        client.search.side_effect = ConnectionTimeout('TIMEOUT', 'timed out', None)
+        for i in range(2):
+            self.search(client)
+        self.breaker.opened_at -= 30
+
+        # The trial gets an answer, even if it's an error for the query
+        client.search.side_effect = RequestError(400, 'parsing_exception', {})
+        with self.assertRaises(RequestError):
+            self.search(client)
+        self.assertFalse(self.breaker.is_open())
+
+        client.search.side_effect = None
+        client.search.return_value = {'hits': {'total': 0, 'max_score': None, 'hits': []}}
+        self.assertNotIn('degraded', self.search(client).json())
+        self.assertEqual(client.search.call_count, 4)
+
+
+class RequestProfilingTest(APITestCase):
+    def setUp(self):
+        models.Event.objects.create(name='event', disaster_start_date=datetime(2018, 1, 1, tzinfo=pytz.utc))
+
+    def test_server_timing(self):
+        # Only staff users get the header, unless it's turned on for everyone
+        self.assertFalse(self.client.get('/api/v2/event/').has_header('Server-Timing'))
+        profiling = dict(settings.REQUEST_PROFILING, SERVER_TIMING=True)
+        with self.settings(REQUEST_PROFILING=profiling):
+            self.assertTrue(self.client.get('/api/v2/event/').has_header('Server-Timing'))
+
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        timing = self.client.get('/api/v2/event/')['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(timing, r'render;dur=[\d.]+')
+        self.assertRegex(timing, r'total;dur=[\d.]+')
+        # Serializing the event list took some time
+        serialize = float(re.search(r'serialize;dur=([\d.]+)', timing).group(1))
+        self.assertGreater(serialize, 0)
+
+    def test_requests_over_budget_are_logged(self):
+        profiling = dict(settings.REQUEST_PROFILING, MAX_QUERIES=1, SAMPLE_RATE=1)
+        with self.settings(REQUEST_PROFILING=profiling), self.assertLogs('api', 'INFO') as logs:
+            self.client.get('/api/v2/event/')
+        self.assertIn('Over budget: GET /api/v2/event/', logs.output[0])
+        self.assertIn('FROM "api_event"', logs.output[1])
+
+    def test_disabled(self):
+        with self.settings(REQUEST_PROFILING={'ENABLED': False}):
+            response = self.client.get('/api/v2/event/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class MetricsTest(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'metrics.json')
+        override = self.settings(METRICS={'PATH': self.path, 'FLUSH_INTERVAL': 0})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_request_metrics(self):
+        self.client.get('/api/v2/event/')
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('# TYPE goapi_http_request_duration_seconds histogram', text)
+        self.assertIn('goapi_http_requests_total{method="GET",route="event-list",status="200"} 1', text)
+        self.assertIn('goapi_http_request_duration_seconds_bucket{le="+Inf",route="event-list"} 1', text)
+        self.assertIn('goapi_http_request_duration_seconds_count{route="event-list"} 1', text)
+        self.assertRegex(text, r'goapi_db_queries_total\{route="event-list"\} [1-9]')
+
+    def test_processes_share_the_file(self):
+        workers = [MetricsStore(self.path), MetricsStore(self.path)]
+        for worker in workers:
+            worker.add('goapi_command_runs_total', sample_key('goapi_command_runs_total', {'command': 'a'}), 2)
+            worker.flush()
+        self.assertIn('goapi_command_runs_total{command="a"} 4', render(MetricsStore(self.path).read()))
+
+    def test_command_metrics(self):
+        @command_metrics('failing')
+        def handle():
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            handle()
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('goapi_command_runs_total{command="failing",status="error"} 1', text)
+        self.assertIn('goapi_command_last_run_timestamp_seconds{command="failing"}', text)
+        self.assertNotIn('goapi_command_last_success_timestamp_seconds{command="failing"}', text)
+
+    def test_token(self):
+        with self.settings(METRICS={'PATH': self.path, 'TOKEN': 'secret'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
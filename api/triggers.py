@@ -1,8 +1,18 @@
 import os
 import threading
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.contrib.auth.models import User
-from .models import Profile
+from rest_framework.authtoken.models import Token
+from .models import Profile, Appeal, Event, FieldReport, Country, District
+from .rollups import (
+    rollup_keys_before_save,
+    update_rollups_after_save,
+    update_rollups_after_delete,
+    update_rollups_after_m2m,
+)
+from .response_cache import bump_generation_on_change, bump_generation_on_m2m_change
+from .outbox import record_change_on_save, record_change_on_delete, record_change_on_m2m
+from .authentication import forget_token_on_change, forget_user_on_change
 
 
 # Save a user profile whenever we create a user
@@ -11,3 +21,37 @@ def create_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
     instance.profile.save()
 post_save.connect(create_profile, sender=User)
+
+
+# Keep the monthly time rollups up to date
+for _model in (Appeal, Event, FieldReport, 'deployments.Heop'):
+    pre_save.connect(rollup_keys_before_save, sender=_model)
+    post_save.connect(update_rollups_after_save, sender=_model)
+    post_delete.connect(update_rollups_after_delete, sender=_model)
+for _through in (Event.countries.through, Event.regions.through,
+                 FieldReport.countries.through, FieldReport.regions.through):
+    m2m_changed.connect(update_rollups_after_m2m, sender=_through)
+
+
+# Invalidate cached aggregate responses
+for _model in (Appeal, Event, FieldReport, 'deployments.Heop'):
+    post_save.connect(bump_generation_on_change, sender=_model)
+    post_delete.connect(bump_generation_on_change, sender=_model)
+for _through in (Event.countries.through, Event.regions.through,
+                 FieldReport.countries.through, FieldReport.regions.through):
+    m2m_changed.connect(bump_generation_on_m2m_change, sender=_through)
+
+
+# Queue search index updates in the same transaction as the change
+for _model in (Appeal, Event, FieldReport, Country, District):
+    post_save.connect(record_change_on_save, sender=_model)
+    post_delete.connect(record_change_on_delete, sender=_model)
+for _through in (Event.countries.through, FieldReport.countries.through):
+    m2m_changed.connect(record_change_on_m2m, sender=_through)
+
+
+# Drop cached tokens when they, or their users, change
+post_save.connect(forget_token_on_change, sender=Token)
+post_delete.connect(forget_token_on_change, sender=Token)
+post_save.connect(forget_user_on_change, sender=User)
+post_delete.connect(forget_user_on_change, sender=User)
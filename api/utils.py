@@ -1,21 +1,49 @@
-def pretty_request(request):
-    headers = ''
-    for header, value in request.META.items():
-        if not header.startswith('HTTP'):
-            continue
-        header = '-'.join([h.capitalize() for h in header[5:].lower().split('_')])
-        headers += '{}: {}\n'.format(header, value)
-
-    return (
-        '{method} HTTP/1.1\n'
-        'Content-Length: {content_length}\n'
-        'Content-Type: {content_type}\n'
-        '{headers}\n\n'
-        '{body}'
-    ).format(
-        method=request.method,
-        content_length=request.META['CONTENT_LENGTH'],
-        content_type=request.META['CONTENT_TYPE'],
-        headers=headers,
-        body=request.body,
-    )
+import zlib
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.models import prefetch_related_objects
+
+
+def iterate_in_chunks(queryset, chunk_size):
+    """ Lists of up to `chunk_size` rows read through a server-side cursor.
+
+    `iterator()` ignores prefetch_related, so the queryset's lookups run
+    once per chunk instead, keeping memory and queries bounded by the chunk.
+    """
+    lookups = queryset._prefetch_related_lookups
+    chunk = []
+    for instance in queryset.prefetch_related(None).iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) >= chunk_size:
+            if len(lookups):
+                prefetch_related_objects(chunk, *lookups)
+            yield chunk
+            chunk = []
+    if len(chunk):
+        if len(lookups):
+            prefetch_related_objects(chunk, *lookups)
+        yield chunk
+
+
+
+@contextmanager
+def advisory_lock(name):
+    """ Hold a Postgres session advisory lock named `name`, if no one else does.
+
+    Yields whether the lock was taken. Other databases have no such locks,
+    so there it is always taken, which is only meant for tests and local setups.
+    """
+    if connection.vendor != 'postgresql':
+        yield True
+        return
+    key = zlib.crc32(name.encode('utf-8'))
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+        locked = cursor.fetchone()[0]
+    try:
+        yield locked
+    finally:
+        if locked:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
@@ -3,9 +3,10 @@ import pytz
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import authentication, permissions
+from rest_framework import permissions
+from rest_framework.exceptions import AuthenticationFailed
 
-from datetime import datetime, timedelta
+from datetime import datetime
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -18,12 +19,21 @@ from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.crypto import get_random_string
 from django.template.loader import render_to_string
+from graphene_django.views import GraphQLView
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult
 
 from rest_framework.authtoken.models import Token
-from .utils import pretty_request
-from .esconnection import ES_CLIENT
+from .authentication import CachedTokenAuthentication, get_valid_token, token_expiry
+from .request_log import RequestLogMixin
 from .models import Appeal, Event, FieldReport
-from .indexes import ES_PAGE_NAME
+from .search import parse_search, parse_suggest, next_page, hydrate_hits, is_true, suggestion_cache
+from .search_backends import get_search_backend
+from .esconnection import SearchUnavailable
+from .logger import logger
+from .rollups import aggregate_from_rollups
+from .response_cache import get_backend as get_response_cache, cache_key
+from .query_cost import check_query_cost
 from deployments.models import Heop
 from notifications.models import Subscription
 from notifications.notification import send_notification
@@ -32,7 +42,7 @@ from main.frontend import frontend_url
 
 
 class UpdateSubscriptionPreferences(APIView):
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permissions_classes = (permissions.IsAuthenticated,)
     def post(self, request):
         errors, created = Subscription.sync_user_subscriptions(self.request.user, request.data)
@@ -62,56 +72,97 @@ def unauthorized(message='You must be logged in'):
     }, status=401)
 
 
-class PublicJsonRequestView(View):
+class PublicJsonRequestView(RequestLogMixin, View):
     http_method_names = ['get', 'head', 'options']
     def handle_get(self, request, *args, **kwargs):
-        print(pretty_request(request))
+        raise NotImplementedError('Public views implement `handle_get`')
 
     def get(self, request, *args, **kwargs):
         return self.handle_get(request, *args, **kwargs)
 
 
+class CachedJsonRequestView(PublicJsonRequestView):
+    """ Public view whose successful responses are cached until one of the
+    models in `cache_dependencies` changes """
+    cache_dependencies = ()
+
+    def get_cache_dependencies(self, request):
+        return self.cache_dependencies
+
+    def get(self, request, *args, **kwargs):
+        response_cache = get_response_cache()
+        key = cache_key(type(self).__name__, request.GET, self.get_cache_dependencies(request))
+        content = response_cache.get(key)
+        if content is not None:
+            response = HttpResponse(content, content_type='application/json')
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = self.handle_get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response_cache.set(key, response.content)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+# Models the aggregate endpoints can be asked about
+AGGREGATE_MODELS = {
+    'appeal': Appeal,
+    'event': Event,
+    'fieldreport': FieldReport,
+    'heop': Heop,
+}
+
+
 class EsPageSearch(PublicJsonRequestView):
     def handle_get(self, request, *args, **kwargs):
-        page_type = request.GET.get('type', None)
-        phrase = request.GET.get('keyword', None)
-        if phrase is None:
-            return bad_request('Must include a `keyword`')
-        index = ES_PAGE_NAME
-        query = {
-            'match': {
-                'body': {
-                    'query': phrase,
-                    'fuzziness': 0
-                }
-            }
-        }
+        try:
+            options = parse_search(request.GET)
+            hits = get_search_backend().search(options)
+        except ValueError as e:
+            return bad_request(str(e))
+        except SearchUnavailable as e:
+            # Answer right away with no results rather than keep the client waiting
+            logger.warning('Search unavailable: %s' % e)
+            return JsonResponse({'total': 0, 'max_score': None, 'hits': [], 'next': None, 'degraded': True})
+
+        hits['next'] = next_page(hits['hits'], options['size'])
+        if is_true(request.GET.get('expand')):
+            try:
+                hydrate_hits(request, hits['hits'])
+            except AuthenticationFailed as e:
+                return unauthorized(str(e.detail))
+        return JsonResponse(hits)
+
+
+class EsSuggest(PublicJsonRequestView):
+    def handle_get(self, request, *args, **kwargs):
+        try:
+            options = parse_suggest(request.GET)
+        except ValueError as e:
+            return bad_request(str(e))
+
+        key = json.dumps(options, sort_keys=True)
+        suggestions = suggestion_cache.get(key)
+        if suggestions is not None:
+            response = JsonResponse({'results': suggestions})
+            response['X-Cache'] = 'HIT'
+            return response
+
+        try:
+            suggestions = get_search_backend().suggest(options)
+        except SearchUnavailable as e:
+            logger.warning('Suggestions unavailable: %s' % e)
+            return JsonResponse({'results': [], 'degraded': True})
+        suggestion_cache.set(key, suggestions)
+        response = JsonResponse({'results': suggestions})
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class AreaAggregate(CachedJsonRequestView):
+    cache_dependencies = ('api.Appeal',)
 
-        sort = [
-            {'date': {'order': 'desc'}}
-        ]
-
-        if page_type is not None:
-            query = {
-                'bool': {
-                    'filter': {
-                        'term': {'type': page_type}
-                    },
-                    'must': {
-                        'match': query['match']
-                    }
-                }
-            }
-
-        results = ES_CLIENT.search(
-            index=index,
-            doc_type='page',
-            body=json.dumps({'query': query, 'sort': sort}),
-        )
-        return JsonResponse(results['hits'])
-
-
-class AreaAggregate(PublicJsonRequestView):
     def handle_get(self, request, *args, **kwargs):
         region_type = request.GET.get('type', None)
         region_id = request.GET.get('id', None)
@@ -128,14 +179,13 @@ class AreaAggregate(PublicJsonRequestView):
         return JsonResponse(dict(aggregate))
 
 
-class AggregateByDtype(PublicJsonRequestView):
+class AggregateByDtype(CachedJsonRequestView):
+    def get_cache_dependencies(self, request):
+        model = AGGREGATE_MODELS.get(request.GET.get('model_type'))
+        return (model._meta.label,) if model is not None else ()
+
     def handle_get(self, request, *args, **kwargs):
-        models = {
-            'appeal': Appeal,
-            'event': Event,
-            'fieldreport': FieldReport,
-            'heop': Heop,
-        }
+        models = AGGREGATE_MODELS
         mtype = request.GET.get('model_type', None)
         if mtype is None or not mtype in models:
             return bad_request('Must specify an `model_type` that is `heop`, `appeal`, `event`, or `fieldreport`')
@@ -150,14 +200,13 @@ class AggregateByDtype(PublicJsonRequestView):
         return JsonResponse(dict(aggregate=list(aggregate)))
 
 
-class AggregateByTime(PublicJsonRequestView):
+class AggregateByTime(CachedJsonRequestView):
+    def get_cache_dependencies(self, request):
+        model = AGGREGATE_MODELS.get(request.GET.get('model_type'))
+        return (model._meta.label,) if model is not None else ()
+
     def handle_get(self, request, *args, **kwargs):
-        models = {
-            'appeal': Appeal,
-            'event': Event,
-            'fieldreport': FieldReport,
-            'heop': Heop,
-        }
+        models = AGGREGATE_MODELS
 
         unit = request.GET.get('unit', None)
         start_date = request.GET.get('start_date', None)
@@ -191,33 +240,47 @@ class AggregateByTime(PublicJsonRequestView):
         filter_obj = { date_filter + '__gte': start_date }
 
         # useful shortcut for singular/plural location filters
-        is_appeal = True if mtype == 'appeal' else False
+        # appeals and heops have a single country and region
+        is_appeal = True if mtype == 'appeal' or mtype == 'heop' else False
 
         # set country and region filter properties
+        area_type = None
+        area_id = None
         if country is not None:
             country_filter = 'country' if is_appeal else 'countries__in'
             countries = country if is_appeal else [country]
             filter_obj[country_filter] = countries
+            area_type, area_id = 'country', country
         elif region is not None:
             region_filter = 'region' if is_appeal else 'regions__in'
             regions = region if is_appeal else [region]
             filter_obj[region_filter] = regions
+            area_type, area_id = 'region', region
 
         # allow custom filter attributes
         # TODO this should check if the model definition contains this field
+        custom_filters = {}
         for key, value in request.GET.items():
             if key[0:7] == 'filter_':
                 filter_obj[key[7:]] = value
+                custom_filters[key[7:]] = value
 
         # allow arbitrary SUM functions
         annotation_funcs = {
             'count': Count('id')
         }
         output_values = ['timespan', 'count']
+        sums = {}
         for key, value in request.GET.items():
             if key[0:4] == 'sum_':
                 annotation_funcs[key[4:]] = Sum(value)
                 output_values.append(key[4:])
+                sums[key[4:]] = value
+
+        # Answer from the monthly rollups when they cover the request
+        aggregate = self.aggregate_from_rollups(mtype, unit, start_date, area_type, area_id, custom_filters, sums)
+        if aggregate is not None:
+            return JsonResponse(dict(aggregate=aggregate))
 
         trunc_method = TruncMonth if unit == 'month' else TruncYear
 
@@ -231,9 +294,21 @@ class AggregateByTime(PublicJsonRequestView):
 
         return JsonResponse(dict(aggregate=list(aggregate)))
 
+    def aggregate_from_rollups(self, mtype, unit, start_date, area_type, area_id, custom_filters, sums):
+        # Rollups are bucketed by area and disaster type only
+        dtype = custom_filters.pop('dtype', None)
+        if len(custom_filters):
+            return None
+        try:
+            area_id = int(area_id) if area_id is not None else None
+            dtype = int(dtype) if dtype is not None else None
+        except ValueError:
+            return None
+        return aggregate_from_rollups(mtype, unit, start_date, area_type, area_id, dtype, sums)
+
 
 @method_decorator(csrf_exempt, name='dispatch')
-class PublicJsonPostView(View):
+class PublicJsonPostView(RequestLogMixin, View):
     http_method_names = ['post']
     def decode_auth_header(self, auth_header):
         parts = auth_header[7:].split(':')
@@ -249,23 +324,17 @@ class PublicJsonPostView(View):
         if not username or not key:
             return None
 
-        # Query the user
         try:
-            user = User.objects.get(username=username)
-        except ObjectDoesNotExist:
+            token = get_valid_token(key)
+        except AuthenticationFailed:
             return None
-
-        # Query the key
-        try:
-            Token.objects.get(user=user, key=key)
-        except ObjectDoesNotExist:
+        if token.user.username != username:
             return None
-
-        return user
+        return token.user
 
 
     def handle_post(self, request, *args, **kwargs):
-        print(pretty_request(request))
+        raise NotImplementedError('Public views implement `handle_post`')
 
     def post(self, request, *args, **kwargs):
         if request.META.get('CONTENT_TYPE').find('application/json') == -1:
@@ -295,7 +364,7 @@ class GetAuthToken(PublicJsonPostView):
                 'username': username,
                 'first': user.first_name,
                 'last': user.last_name,
-                'expires': api_key.created + timedelta(7),
+                'expires': token_expiry(api_key),
                 'id': user.id,
             })
         else:
@@ -360,3 +429,14 @@ class RecoverPassword(PublicJsonPostView):
                           render_to_string('email/recover_password.html', email_context))
 
         return JsonResponse({'status': 'ok'})
+
+
+class CostLimitedGraphQLView(GraphQLView):
+    """ Rejects operations deeper or costlier than `GRAPHQL_QUERY_LIMITS` before running them """
+
+    def execute(self, document_ast, **kwargs):
+        try:
+            check_query_cost(self.schema, document_ast, kwargs.get('operation_name'), kwargs.get('variable_values'))
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e], invalid=True)
+        return super(CostLimitedGraphQLView, self).execute(document_ast, **kwargs)
@@ -1,7 +1,7 @@
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django_filters import rest_framework as filters
 from rest_framework import viewsets
+from api.authentication import CachedTokenAuthentication
 from .models import (
     ERUOwner,
     ERU,
@@ -14,6 +14,8 @@ from .models import (
 )
 from api.models import Country
 from api.view_filters import ListFilter
+from api.conditional import ConditionalGetMixin
+from main.profiling import SerializerTimingMixin
 from .serializers import (
     ERUOwnerSerializer,
     ERUSerializer,
@@ -26,8 +28,8 @@ from .serializers import (
 )
 
 
-class ERUOwnerViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class ERUOwnerViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = ERUOwner.objects.all()
     serializer_class = ERUOwnerSerializer
@@ -40,39 +42,41 @@ class ERUFilter(filters.FilterSet):
         model = ERU
         fields = ('available',)
 
-class ERUViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class ERUViewset(SerializerTimingMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = ERU.objects.all()
     serializer_class = ERUSerializer
+    modified_field = 'updated_at'
+    conditional_dependencies = ('api.Event',)
     filter_class = ERUFilter
 
-class HeopViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class HeopViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = Heop.objects.all()
     serializer_class = HeopSerializer
 
-class FactViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class FactViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = Fact.objects.all()
     serializer_class = FactSerializer
 
-class RdrtViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class RdrtViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = Rdrt.objects.all()
     serializer_class = RdrtSerializer
 
-class FactPersonViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class FactPersonViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = FactPerson.objects.all()
     serializer_class = FactPersonSerializer
 
-class RdrtPersonViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class RdrtPersonViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     queryset = RdrtPerson.objects.all()
     serializer_class = RdrtPersonSerializer
@@ -91,7 +95,7 @@ class PartnerDeploymentFilterset(filters.FilterSet):
             'end_date': ('exact', 'gt', 'gte', 'lt', 'lte'),
         }
 
-class PartnerDeploymentViewset(viewsets.ReadOnlyModelViewSet):
+class PartnerDeploymentViewset(SerializerTimingMixin, viewsets.ReadOnlyModelViewSet):
     queryset = PartnerSocietyDeployment.objects.all()
     serializer_class = PartnerDeploymentSerializer
     filter_class = PartnerDeploymentFilterset
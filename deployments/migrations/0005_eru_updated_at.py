@@ -0,0 +1,20 @@
+# Generated by Django 2.0.5 on 2026-10-18 18:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deployments', '0004_auto_20180621_1519'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eru',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -50,6 +50,8 @@ class ERU(models.Model):
     eru_owner = models.ForeignKey(ERUOwner, on_delete=models.CASCADE)
     available = models.BooleanField(default=False)
 
+    updated_at = models.DateTimeField(auto_now=True)
+
 
     def __str__(self):
         return ['Basecamp', 'IT & Telecom', 'Logistics', 'RCRC Emergency Hospital', 'RCRC Emergency Clinic', 'Relief', 'WASH M15', 'WASH MSM20', 'WASH M40'][self.type]
@@ -0,0 +1,215 @@
+import fcntl
+import json
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.http import HttpResponse
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Every metric, with its type and help text, in exposition order
+METRICS = OrderedDict([
+    ('goapi_http_requests_total', ('counter', 'HTTP requests by route, method and status.')),
+    ('goapi_http_request_duration_seconds', ('histogram', 'HTTP request latency by route.')),
+    ('goapi_db_queries_total', ('counter', 'Database queries by route.')),
+    ('goapi_db_query_seconds_total', ('counter', 'Time spent in database queries by route.')),
+    ('goapi_es_requests_total', ('counter', 'Elasticsearch searches by outcome: ok, error or rejected by the circuit breaker.')),
+    ('goapi_es_seconds_total', ('counter', 'Time spent in elasticsearch searches by route.')),
+    ('goapi_command_runs_total', ('counter', 'Management command runs by status.')),
+    ('goapi_command_duration_seconds', ('gauge', 'Duration of the last run of a management command.')),
+    ('goapi_command_last_run_timestamp_seconds', ('gauge', 'When a management command last finished.')),
+    ('goapi_command_last_success_timestamp_seconds', ('gauge', 'When a management command last finished without an error.')),
+    ('goapi_command_records_total', ('counter', 'Records a management command handled, by action.')),
+    ('goapi_log_records_dropped_total', ('counter', 'Log records dropped because the logging queue was full.')),
+])
+
+
+def sample_key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+class MetricsStore(object):
+    """ Metrics shared by every process through one JSON file.
+
+    Each process collects counter increments and gauge values in memory and
+    merges them into the file under an exclusive lock when it flushes, so
+    gunicorn workers and cron commands add up to one set of numbers.
+    """
+
+    def __init__(self, path, flush_interval=1):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.flushed_at = time.monotonic()
+
+    def add(self, family, key, amount):
+        with self.lock:
+            self.counters[(family, key)] += amount
+
+    def set(self, family, key, value):
+        with self.lock:
+            self.gauges[(family, key)] = value
+
+    def flush(self):
+        with self.lock:
+            counters, gauges = self.counters, self.gauges
+            self.counters, self.gauges = defaultdict(float), {}
+            self.flushed_at = time.monotonic()
+        if not len(counters) and not len(gauges):
+            return
+
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            data = self.parse(f.read())
+            for (family, key), amount in counters.items():
+                samples = data.setdefault(family, {})
+                samples[key] = samples.get(key, 0) + amount
+            for (family, key), value in gauges.items():
+                data.setdefault(family, {})[key] = value
+            f.seek(0)
+            f.truncate()
+            json.dump(data, f)
+            f.flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def read(self):
+        self.flush()
+        try:
+            with open(self.path) as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                return self.parse(f.read())
+        except FileNotFoundError:
+            return {}
+
+    def parse(self, content):
+        try:
+            return json.loads(content) if content else {}
+        except ValueError:
+            # A write cut short; start over rather than stop counting
+            return {}
+
+
+_store = None
+_store_config = None
+
+
+def get_store():
+    """ The configured store, rebuilt if `METRICS` settings change """
+    global _store, _store_config
+    config = getattr(settings, 'METRICS', {})
+    if _store is None or _store_config is not config:
+        _store = MetricsStore(config.get('PATH', '/tmp/go-api-metrics.json'), config.get('FLUSH_INTERVAL', 1))
+        _store_config = config
+    return _store
+
+
+def inc(name, amount=1, **labels):
+    get_store().add(name, sample_key(name, labels), amount)
+
+
+def set_gauge(name, value, **labels):
+    get_store().set(name, sample_key(name, labels), value)
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """ Record a histogram observation; buckets are stored cumulative """
+    store = get_store()
+    for bound in buckets:
+        if value <= bound:
+            store.add(name, sample_key(name + '_bucket', dict(labels, le=format_value(bound))), 1)
+    store.add(name, sample_key(name + '_bucket', dict(labels, le='+Inf')), 1)
+    store.add(name, sample_key(name + '_sum', labels), value)
+    store.add(name, sample_key(name + '_count', labels), 1)
+
+
+def record_request(request, response, profile):
+    """ Count a request and what it cost, from its RequestProfile """
+    match = getattr(request, 'resolver_match', None)
+    route = match.view_name if match is not None else 'unmatched'
+    inc('goapi_http_requests_total', route=route, method=request.method, status=str(response.status_code))
+    observe('goapi_http_request_duration_seconds', profile.total / 1000, route=route)
+    inc('goapi_db_queries_total', profile.queries, route=route)
+    inc('goapi_db_query_seconds_total', profile.timings['db'] / 1000, route=route)
+    if profile.timings['es']:
+        inc('goapi_es_seconds_total', profile.timings['es'] / 1000, route=route)
+    get_store().maybe_flush()
+
+
+class command_metrics(ContextDecorator):
+    """ Record a management command's runs, duration and outcome.
+    Use as a decorator on `handle`.
+    """
+
+    def __init__(self, command):
+        self.command = command
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        finished = time.time()
+        status = 'success' if exc_type is None else 'error'
+        inc('goapi_command_runs_total', command=self.command, status=status)
+        set_gauge('goapi_command_duration_seconds', finished - self.started, command=self.command)
+        set_gauge('goapi_command_last_run_timestamp_seconds', finished, command=self.command)
+        if exc_type is None:
+            set_gauge('goapi_command_last_success_timestamp_seconds', finished, command=self.command)
+        get_store().flush()
+        return False
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return '%d' % value if abs(value) < 1e15 else repr(float(value))
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not len(labels):
+        return ''
+    escaped = ['%s="%s"' % (name, str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+               for name, value in labels]
+    return '{%s}' % ','.join(escaped)
+
+
+def sort_key(sample):
+    # Histogram buckets go in increasing order of their bounds
+    name, labels = sample
+    others = [pair for pair in labels if pair[0] != 'le']
+    bounds = [float(value) for label, value in labels if label == 'le']
+    return name, others, bounds
+
+
+def render(data):
+    """ Metrics in the Prometheus text exposition format """
+    lines = []
+    for family, (metric_type, help_text) in METRICS.items():
+        samples = data.get(family)
+        if not samples:
+            continue
+        lines.append('# HELP %s %s' % (family, help_text))
+        lines.append('# TYPE %s %s' % (family, metric_type))
+        parsed = sorted(((json.loads(key), value) for key, value in samples.items()), key=lambda item: sort_key(item[0]))
+        for (name, labels), value in parsed:
+            lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    token = getattr(settings, 'METRICS', {}).get('TOKEN')
+    if token and request.META.get('HTTP_AUTHORIZATION') != 'Bearer %s' % token:
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(render(get_store().read()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from api.logger import logger
+from .metrics import record_request
+
+_local = threading.local()
+
+
+def get_profiling_settings():
+    options = {
+        'ENABLED': True,
+        'SERVER_TIMING': False,
+        'MAX_QUERIES': 50,
+        'MAX_DB_MS': 500,
+        'MAX_TOTAL_MS': 2000,
+        'SAMPLE_RATE': 0.0,
+    }
+    options.update(getattr(settings, 'REQUEST_PROFILING', {}))
+    return options
+
+
+class RequestProfile(object):
+    """ What a request cost: queries, and milliseconds spent per kind of work """
+
+    def __init__(self, sample=False):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.timings = OrderedDict((name, 0.0) for name in ('db', 'es', 'serialize', 'render'))
+        # Only sampled requests keep their SQL
+        self.sql = [] if sample else None
+        self.total = None
+        self.size = None
+
+    def add(self, name, started):
+        self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+    def finish(self, response):
+        self.total = (time.perf_counter() - self.started) * 1000
+        if not response.streaming:
+            self.size = len(response.content)
+
+    def server_timing(self):
+        metrics = ['db;dur=%.1f;desc="%s queries"' % (self.timings['db'], self.queries)]
+        metrics += ['%s;dur=%.1f' % (name, duration) for name, duration in self.timings.items() if name != 'db']
+        metrics.append('total;dur=%.1f' % self.total)
+        return ', '.join(metrics)
+
+    def over_budget(self, options):
+        return (self.queries > options['MAX_QUERIES'] or
+                self.timings['db'] > options['MAX_DB_MS'] or
+                self.total > options['MAX_TOTAL_MS'])
+
+    def summary(self):
+        timings = ', '.join('%s %.0f ms' % item for item in self.timings.items())
+        return '%.0f ms, %s queries, %s, %s bytes' % (self.total, self.queries, timings, self.size)
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def timed(name):
+    """ Count the time spent in the block towards the current request's `name` timing """
+    profile = current_profile()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.add(name, started)
+
+
+_timed_serializers = {}
+
+
+def timed_serializer(serializer_class):
+    """ A subclass of `serializer_class` whose records count towards the `serialize` timing """
+    timed_class = _timed_serializers.get(serializer_class)
+    if timed_class is None:
+        def to_representation(self, instance):
+            # Also used for each record of a list, through the list serializer's child
+            with timed('serialize'):
+                return super(timed_class, self).to_representation(instance)
+        timed_class = type(serializer_class.__name__, (serializer_class,), {
+            '__module__': serializer_class.__module__,
+            'to_representation': to_representation,
+        })
+        _timed_serializers[serializer_class] = timed_class
+    return timed_class
+
+
+class SerializerTimingMixin(object):
+    """ Count the time a viewset's serializers take towards the request's
+    `serialize` timing, including any queries they make.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        # Not `get_serializer_class`, which viewsets override to pick serializers per action
+        serializer_class = timed_serializer(self.get_serializer_class())
+        kwargs['context'] = self.get_serializer_context()
+        return serializer_class(*args, **kwargs)
+
+
+class QueryRecorder(object):
+    """ Database execute wrapper that counts and times queries """
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.profile.queries += 1
+            self.profile.add('db', started)
+            if self.profile.sql is not None:
+                self.profile.sql.append(sql)
+
+
+def is_staff(request):
+    # DRF sets the users it authenticates, e.g. by token, on the Django request too
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+class RequestProfilingMiddleware(object):
+    """ Measure every request's queries, SQL, elasticsearch, serialize and render time.
+
+    With `SERVER_TIMING` on, or for staff users, the numbers go out in a
+    `Server-Timing` header. Requests over the
+    `REQUEST_PROFILING` budgets are logged. A `SAMPLE_RATE` share of
+    requests also log every query they ran. Every request is counted in the
+    `/metrics` numbers.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = get_profiling_settings()
+        if not options['ENABLED']:
+            return self.get_response(request)
+
+        profile = RequestProfile(sample=random.random() < options['SAMPLE_RATE'])
+        _local.profile = profile
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(QueryRecorder(profile)))
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+
+        profile.finish(response)
+        record_request(request, response, profile)
+        if options['SERVER_TIMING'] or is_staff(request):
+            response['Server-Timing'] = profile.server_timing()
+        if profile.over_budget(options):
+            logger.warning('Over budget: %s %s took %s' % (request.method, request.path, profile.summary()))
+        if profile.sql is not None:
+            logger.info('Sampled %s %s, %s:\n%s' % (request.method, request.path, profile.summary(),
+                                                    '\n'.join(sql[:1000] for sql in profile.sql)))
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this, so time until rendering finishes
+        profile = current_profile()
+        if profile is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                profile.add('render', started)
+            response.add_post_render_callback(rendered)
+        return response
@@ -4,6 +4,7 @@ mkdir -p $HOME/logs $HOME/static
 # apply migrations, load fixture data, collect static files
 python manage.py migrate
 python manage.py loaddata Regions Countries Districts DisasterTypes Actions
+python manage.py rebuild_rollups
 python manage.py collectstatic --noinput --clear
 python manage.py collectstatic --noinput -l
 
@@ -50,6 +51,8 @@ echo "export FRONTEND_URL=\"$FRONTEND_URL\"" >> $HOME/.env
 (crontab -l 2>/dev/null; echo '45 * * * * . /home/ifrc/.env; python /home/ifrc/go-api/manage.py ingest_appeals >> /home/ifrc/logs/ingest_appeals.log 2>&1') | crontab -
 (crontab -l 2>/dev/null; echo '*/20 * * * * . /home/ifrc/.env; python /home/ifrc/go-api/manage.py ingest_gdacs >> /home/ifrc/logs/ingest_gdacs.log 2>&1') | crontab -
 (crontab -l 2>/dev/null; echo '*/5 * * * * . /home/ifrc/.env; python /home/ifrc/go-api/manage.py index_and_notify >> /home/ifrc/logs/index_and_notify.log 2>&1') | crontab -
+(crontab -l 2>/dev/null; echo '* * * * * . /home/ifrc/.env; python /home/ifrc/go-api/manage.py drain_index_outbox >> /home/ifrc/logs/drain_index_outbox.log 2>&1') | crontab -
+(crontab -l 2>/dev/null; echo '0 3 * * * . /home/ifrc/.env; python /home/ifrc/go-api/manage.py rebuild_rollups >> /home/ifrc/logs/rebuild_rollups.log 2>&1') | crontab -
 service cron start
 
 tail -n 0 -f $HOME/logs/*.log &
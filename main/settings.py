@@ -32,7 +32,7 @@ INSTALLED_APPS = [
 ]
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.LimitOffsetCursorPagination',
     'PAGE_SIZE': 50,
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -42,13 +42,52 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
         'rest_framework_csv.renderers.PaginatedCSVRenderer',
+        'api.renderers.NDJSONRenderer',
     ),
 }
 
+# API tokens expire LIFETIME_DAYS after they were issued. Each worker caches
+# tokens for CACHE_TTL seconds, so changes made in other processes can take
+# that long to apply.
+TOKEN_AUTH = {
+    'LIFETIME_DAYS': 7,
+    'CACHE_TTL': 60,
+    'CACHE_SIZE': 1024,
+}
+
+# Cache for public aggregate responses: `local` (per-process LRU), `redis` or `none`
+RESPONSE_CACHE = {
+    'BACKEND': os.environ.get('RESPONSE_CACHE_BACKEND', 'local'),
+    'REDIS_URL': os.environ.get('REDIS_URL'),
+    'MAX_ENTRIES': 512,
+    'TIMEOUT': 60 * 60 * 24,
+}
+
 GRAPHENE = {
     'SCHEMA': 'api.schema.schema'
 }
 
+# Operations deeper or costlier than this are rejected before they run.
+# Lists without `first`/`last` are assumed to hold PAGE_SIZE items.
+GRAPHQL_QUERY_LIMITS = {
+    'MAX_DEPTH': 10,
+    'MAX_COST': 10000,
+    'PAGE_SIZE': 20,
+}
+
+# Elasticsearch client: timeouts in seconds, connections per worker, and
+# how many outages in a row open the circuit breaker, and for how long
+ELASTICSEARCH = {
+    'TIMEOUT': int(os.environ.get('ES_TIMEOUT', 5)),
+    'BULK_TIMEOUT': 120,
+    'MAX_RETRIES': 2,
+    'RETRY_ON_TIMEOUT': True,
+    'POOL_SIZE': 4,
+    'SNIFF': os.environ.get('ES_SNIFF') == 'true',
+    'BREAKER_FAILURES': 5,
+    'BREAKER_RESET': 30,
+}
+
 AZURE_STORAGE = {
     'CONTAINER': 'api',
     'ACCOUNT_NAME': os.environ.get('AZURE_STORAGE_ACCOUNT'),
@@ -57,6 +96,7 @@ AZURE_STORAGE = {
 }
 
 MIDDLEWARE = [
+    'main.profiling.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -67,6 +107,33 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Requests over these budgets are logged; SAMPLE_RATE of requests log their SQL.
+# Server-Timing headers go to staff users, or to everyone with SERVER_TIMING.
+REQUEST_PROFILING = {
+    'ENABLED': True,
+    'SERVER_TIMING': os.environ.get('PROFILING_SERVER_TIMING') == 'true',
+    'MAX_QUERIES': 50,
+    'MAX_DB_MS': 500,
+    'MAX_TOTAL_MS': 2000,
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', 0)),
+}
+
+# SAMPLE_RATE of public JSON view requests are logged to `api.requests`, with
+# passwords, tokens and keys redacted
+REQUEST_LOG = {
+    'SAMPLE_RATE': float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', 0)),
+    'MAX_VALUE_LENGTH': 256,
+    'MAX_BODY_LENGTH': 2048,
+}
+
+# Prometheus metrics at /metrics, shared by the web workers and cron commands
+# through one file. With a TOKEN set, scrapers must send it as a bearer token.
+METRICS = {
+    'PATH': os.environ.get('METRICS_PATH', '/tmp/go-api-metrics.json'),
+    'FLUSH_INTERVAL': 1,
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
 CORS_ORIGIN_ALLOW_ALL = True
 
 ROOT_URLCONF = 'main.urls'
@@ -15,18 +15,20 @@ Including another URLconf
 """
 from django.conf.urls import url, include
 from django.contrib import admin
-from graphene_django.views import GraphQLView
 from tastypie.api import Api
 from api.views import (
     GetAuthToken,
     ChangePassword,
     RecoverPassword,
     EsPageSearch,
+    EsSuggest,
     AggregateByDtype,
     AggregateByTime,
     UpdateSubscriptionPreferences,
     AreaAggregate,
+    CostLimitedGraphQLView,
 )
+from main.metrics import metrics_view
 from registrations.views import (
     NewRegistration,
     VerifyEmail,
@@ -72,7 +74,8 @@ router.register(r'subscription', notification_views.SubscriptionViewset, base_na
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^api/v1/es_search/', EsPageSearch.as_view()),
-    url(r'^api/v1/graphql/', GraphQLView.as_view(graphiql=True)),
+    url(r'^api/v1/es_suggest/', EsSuggest.as_view()),
+    url(r'^api/v1/graphql/', CostLimitedGraphQLView.as_view(graphiql=True)),
     url(r'^api/v1/aggregate/', AggregateByTime.as_view()),
     url(r'^api/v1/aggregate_dtype/', AggregateByDtype.as_view()),
     url(r'^api/v1/aggregate_area/', AreaAggregate.as_view()),
@@ -83,6 +86,7 @@ urlpatterns = [
     url(r'^validate_user', ValidateUser.as_view()),
     url(r'^change_password', ChangePassword.as_view()),
     url(r'^recover_password', RecoverPassword.as_view()),
+    url(r'^metrics$', metrics_view, name='metrics'),
 
     url(r'^api/v2/', include(router.urls)),
     url(r'^docs/', include_docs_urls(title='IFRC Go API')),
@@ -1,7 +1,9 @@
 from django_filters import rest_framework as filters
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import viewsets
+from api.authentication import CachedTokenAuthentication
+from api.conditional import ConditionalGetMixin
+from main.profiling import SerializerTimingMixin
 from .models import SurgeAlert, Subscription
 from .serializers import (
     SurgeAlertSerializer,
@@ -19,19 +21,21 @@ class SurgeAlertFilter(filters.FilterSet):
             'created_at': ('exact', 'gt', 'gte', 'lt', 'lte'),
         }
 
-class SurgeAlertViewset(viewsets.ReadOnlyModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class SurgeAlertViewset(SerializerTimingMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     queryset = SurgeAlert.objects.all()
     filter_class = SurgeAlertFilter
     ordering_fields = ('created_at', 'atype', 'category', 'event',)
+    modified_field = 'updated_at'
+    conditional_dependencies = ('api.Event',)
     def get_serializer_class(self):
         if self.request.user.is_authenticated:
             return SurgeAlertSerializer
         return UnauthenticatedSurgeAlertSerializer
 
-class SubscriptionViewset(viewsets.ModelViewSet):
+class SubscriptionViewset(SerializerTimingMixin, viewsets.ModelViewSet):
     serializer_class = SubscriptionSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     def get_queryset(self):
         return Subscription.objects.filter(user=self.request.user)